@@ -0,0 +1,78 @@
+"""
+Бюджет времени импорта при старте процесса.
+
+Запускает в отдельном интерпретаторе `python -X importtime` с django.setup()
+(как manage.py migrate) или с загрузкой URL-ов (как воркер), печатает
+самые тяжёлые модули и завершается с кодом 1, если:
+- суммарное время импорта больше --budget-ms;
+- загружен какой-то из --forbid (тяжёлые зависимости, которые должны
+  импортироваться лениво, только при обращении к блокчейну или Redis).
+
+    python scripts/bench_import_time.py --target web --budget-ms 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Фоновый прогрев (WARMUP_ON_START) как раз загружает pytoniq и redis,
+# но вне пути запроса — в замер старта он не входит
+_SETUP = 'import django; from django.conf import settings; settings.WARMUP_ON_START = False; django.setup()'
+TARGETS = {
+    'setup': _SETUP,
+    'web': _SETUP + '; import wallet.urls; from django.urls import get_resolver; get_resolver().url_patterns',
+}
+DEFAULT_FORBIDDEN = ('pytoniq', 'pytoniq_core', 'redis')
+
+
+def measure(target):
+    """[(имя модуля, собственное время мкс, накопленное мкс, глубина)] в порядке импорта."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='wallet.settings', PYTHONPATH=str(ROOT))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TARGETS[target]],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=sorted(TARGETS), default='web')
+    parser.add_argument('--budget-ms', type=float, default=1500)
+    parser.add_argument('--forbid', default=','.join(DEFAULT_FORBIDDEN),
+                        help='пакеты через запятую, которые не должны загружаться при старте')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    modules = measure(args.target)
+    total_ms = sum(self_us for _, self_us, _, _ in modules) / 1000
+    top_level = sorted((m for m in modules if m[3] == 1), key=lambda m: m[2], reverse=True)
+
+    print(f"Цель: {args.target}, модулей: {len(modules)}, всего {total_ms:.0f} мс (бюджет {args.budget_ms:.0f} мс)")
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print(f"{cumulative_us / 1000:9.1f} мс  {name}")
+
+    forbidden = {name for name in args.forbid.split(',') if name}
+    loaded = sorted({name.split('.')[0] for name, *_ in modules} & forbidden)
+    failed = False
+    if loaded:
+        print(f"Загружены при старте: {', '.join(loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"Превышен бюджет: {total_ms:.0f} мс > {args.budget_ms:.0f} мс")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Разбор ответа TON API со списком транзакций: response.json() против
+потокового provider_json.read_items.
+
+Фикстура повторяет ответ /v2/accounts/{id}/transactions: сообщения с
+raw_body и decoded_body, фазы исполнения и BOC в raw. Она пишется во
+временный файл. Каждый замер идёт в отдельном интерпретаторе, потому что
+пик RSS (VmHWM) — рекорд процесса:
+- json читает тело целиком и строит дерево (как response.json());
+- ijson читает файл потоком (как response.raw при stream=True).
+Печатаются время (лучшее из --repeat) и прирост пика RSS над
+интерпретатором до чтения ответа.
+
+    python scripts/bench_provider_json.py --sizes 400,2000,10000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+METHODS = ('json', 'ijson')
+
+
+def build_body(count):
+    transactions = []
+    for i in range(count):
+        transactions.append({
+            'hash': f'{i:064x}',
+            'lt': 47000000000000 + i,
+            'account': {'address': '0:' + 'a' * 64, 'is_scam': False, 'is_wallet': True},
+            'success': True,
+            'utime': 1700000000 + i * 60,
+            'orig_status': 'active',
+            'end_status': 'active',
+            'total_fees': 2757361,
+            'end_balance': 123456789012,
+            'transaction_type': 'TransOrd',
+            'state_update_old': f'{i:064x}',
+            'state_update_new': f'{i + 1:064x}',
+            'in_msg': {
+                'msg_type': 'int_msg', 'created_lt': 47000000000000 + i, 'ihr_disabled': True,
+                'bounce': False, 'bounced': False, 'value': 1000000000 + i, 'fwd_fee': 266669,
+                'ihr_fee': 0, 'import_fee': 0, 'created_at': 1700000000 + i * 60,
+                'destination': {'address': '0:' + 'a' * 64, 'is_scam': False, 'is_wallet': True},
+                'source': {'address': '0:' + 'b' * 64, 'name': 'sender.ton', 'is_scam': False, 'is_wallet': True},
+                'op_code': '0x00000000',
+                'raw_body': 'b5ee9c72' * 40,
+                'decoded_op_name': 'text_comment',
+                'decoded_body': {'text': f'payment #{i}'},
+            },
+            'out_msgs': [],
+            'block': f'(0,8000000000000000,{40000000 + i})',
+            'prev_trans_hash': f'{i - 1:064x}',
+            'prev_trans_lt': 47000000000000 + i - 1,
+            'compute_phase': {
+                'skipped': False, 'success': True, 'gas_fees': 1324400, 'gas_used': 3311,
+                'vm_steps': 68, 'exit_code': 0, 'exit_code_description': 'Ok',
+            },
+            'storage_phase': {'fees_collected': 21, 'status_change': 'acst_unchanged'},
+            'credit_phase': {'fees_collected': 0, 'credit': 1000000000 + i},
+            'action_phase': {
+                'success': True, 'result_code': 0, 'total_actions': 0, 'skipped_actions': 0,
+                'fwd_fees': 0, 'total_fees': 0,
+            },
+            'aborted': False,
+            'destroyed': False,
+            'raw': 'b5ee9c72' * 200,
+        })
+    return json.dumps({'transactions': transactions}).encode()
+
+
+def peak_rss_kb():
+    # ru_maxrss на Linux переживает exec и достаётся от родителя, VmHWM — нет
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _parse(method, path):
+    if method == 'json':
+        return json.loads(Path(path).read_bytes())['transactions']
+    from wallet_nalog.provider_json import read_items
+
+    with open(path, 'rb') as stream:
+        return read_items(stream, 'transactions')[0]
+
+
+def child(method, path, count, repeat):
+    if method == 'ijson':
+        import wallet_nalog.provider_json  # noqa: F401  (импорт не входит в замер)
+    baseline_kb = peak_rss_kb()
+    items = _parse(method, path)
+    peak_kb = peak_rss_kb()
+    assert len(items) == count
+    del items
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _parse(method, path)
+        best = min(best, time.perf_counter() - started)
+    print(json.dumps({'seconds': best, 'rss_kb': peak_kb - baseline_kb}))
+
+
+def measure(method, path, count, repeat):
+    proc = subprocess.run(
+        [sys.executable, __file__, '--child', method, '--fixture', path, '--sizes', str(count), '--repeat', str(repeat)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='400,2000,10000', help='число транзакций в ответе, через запятую')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=METHODS, help=argparse.SUPPRESS)
+    parser.add_argument('--fixture', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.child:
+        sys.path.insert(0, str(ROOT))
+        child(args.child, args.fixture, sizes[0], args.repeat)
+        return 0
+
+    print(f"{'транзакций':>10} {'тело, КБ':>9} {'метод':>6} {'время, мс':>10} {'пик RSS, МБ':>12}")
+    for count in sizes:
+        with tempfile.NamedTemporaryFile(suffix='.json') as fixture:
+            body = build_body(count)
+            fixture.write(body)
+            fixture.flush()
+            for method in METHODS:
+                result = measure(method, fixture.name, count, args.repeat)
+                print(
+                    f"{count:>10} {len(body) // 1024:>9} {method:>6} "
+                    f"{result['seconds'] * 1000:>10.1f} {result['rss_kb'] / 1024:>12.1f}"
+                )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
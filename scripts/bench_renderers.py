@@ -0,0 +1,105 @@
+"""
+Сравнение рендереров ответа API: стандартный JSONRenderer из DRF,
+ORJSONRenderer и MessagePackRenderer.
+
+Полезная нагрузка повторяет ответ /api/tax/total/ с детализацией (detail=all).
+
+    python scripts/bench_renderers.py --months 24 --per-month 500
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wallet.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from wallet_nalog.renderers import ORJSONRenderer, MessagePackRenderer  # noqa: E402
+
+
+def build_payload(months, per_month):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    monthly_taxes = []
+    for m in range(months):
+        transactions = []
+        for i in range(per_month):
+            amount = Decimal(i % 97) + Decimal('0.123456789')
+            transactions.append({
+                'tx_hash': f'{m:04x}{i:060x}',
+                'timestamp': (start + timedelta(days=30 * m, minutes=i)).isoformat(),
+                'operation_type': 'sell' if i % 3 == 0 else 'buy',
+                'amount_ton': float(amount),
+                'amount_usd': float(amount * Decimal('5.4')),
+                'matched_buy_amount_ton': float(amount),
+                'profit_ton': 0.0,
+                'profit_usd': 0.0,
+                'tax_rate': 0.05,
+                'tax_amount_ton': 0.0,
+                'tax_amount_usd': 0.0,
+            })
+        monthly_taxes.append({
+            'year': 2024 + m // 12,
+            'month': m % 12 + 1,
+            'total_sent_ton': 1234.5,
+            'total_sent_usd': 6666.3,
+            'total_tax_ton': 0.0,
+            'total_tax_usd': 0.0,
+            'transactions_count': per_month,
+            'transactions': transactions,
+            'demo_deals': [],
+        })
+    return {
+        'total_tax_ton': 0.0,
+        'total_tax_usd': 0.0,
+        'total_sent_ton': 1234.5 * months,
+        'total_sent_usd': 6666.3 * months,
+        'total_transactions': months * per_month,
+        'ton_price_usd': Decimal('5.4'),
+        'ton_price_stale': False,
+        'monthly_taxes': monthly_taxes,
+        'period': {'start': '2024-01', 'end': '2025-12'},
+    }
+
+
+def bench(renderer, payload, repeat):
+    best = float('inf')
+    body = b''
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = renderer.render(payload, renderer.media_type, {})
+        best = min(best, time.perf_counter() - started)
+    return best, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--per-month', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = build_payload(args.months, args.per_month)
+    print(f"Транзакций в ответе: {args.months * args.per_month}, лучший из {args.repeat} прогонов")
+
+    baseline = None
+    for name, renderer in [
+        ('DRF JSONRenderer', JSONRenderer()),
+        ('ORJSONRenderer', ORJSONRenderer()),
+        ('MessagePackRenderer', MessagePackRenderer()),
+    ]:
+        seconds, size = bench(renderer, payload, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<22} {seconds * 1000:9.1f} мс  {size / 1024:9.1f} КБ  x{baseline / seconds:.1f}")
+
+
+if __name__ == '__main__':
+    main()
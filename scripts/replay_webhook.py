@@ -0,0 +1,129 @@
+"""
+Локальное воспроизведение уведомлений о транзакциях.
+
+Читает события из файла и отправляет их пачками на
+/api/webhooks/transactions/ с подписью HMAC. Файл может быть объектом
+{"events": [...]}, JSON-массивом или JSONL (одно событие на строку). Для
+проверки можно перемешать порядок (--shuffle) и доставить каждую пачку
+повторно (--repeat).
+
+    python scripts/replay_webhook.py events.jsonl --batch-size 50 --shuffle --repeat 2
+    python scripts/replay_webhook.py --synthetic UQ... --count 500
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wallet.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import requests  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from wallet_nalog.webhooks import sign_payload  # noqa: E402
+
+
+def load_events(path):
+    text = Path(path).read_text(encoding='utf-8')
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data['events'] if 'events' in data else [data]
+    return data
+
+
+def synthetic_events(wallet, count, start_lt=47_000_000_000_000):
+    """Цепочка входящих переводов: lt растёт, prev_lt указывает на предыдущую."""
+    now = int(time.time()) - count * 60
+    events = []
+    for i in range(count):
+        lt = start_lt + i * 2
+        tx_hash = hashlib.sha256(f"{wallet}:{lt}".encode()).digest()
+        events.append({
+            'account': wallet,
+            'lt': lt,
+            'prev_lt': lt - 2 if i else None,
+            'tx_hash': tx_hash.hex(),
+            'transaction': {
+                'hash': tx_hash.hex(),
+                'lt': lt,
+                'utime': now + i * 60,
+                'in_msg': {'value': str(1_000_000_000 + i), 'source': {'address': 'UQ_replay_sender'}},
+            },
+        })
+    return events
+
+
+def send(url, secret, delivery_id, events):
+    body = json.dumps({'delivery_id': delivery_id, 'events': events}).encode()
+    timestamp = str(int(time.time()))
+    response = requests.post(url, data=body, timeout=60, headers={
+        'Content-Type': 'application/json',
+        'X-Webhook-Timestamp': timestamp,
+        'X-Webhook-Signature': sign_payload(secret, timestamp, body),
+    })
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', help='файл с событиями (JSON / JSONL)')
+    parser.add_argument('--synthetic', metavar='WALLET', help='сгенерировать события для кошелька')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api/webhooks/transactions/')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET') or next(iter(settings.WEBHOOK_SECRETS), ''))
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--shuffle', action='store_true', help='перемешать события перед отправкой')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='сколько раз доставлять каждую пачку')
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error('нужен --secret, WEBHOOK_SECRET или WEBHOOK_SECRETS в настройках')
+    if args.synthetic:
+        events = synthetic_events(args.synthetic, args.count)
+    elif args.path:
+        events = load_events(args.path)
+    else:
+        parser.error('укажите файл с событиями или --synthetic')
+    if args.shuffle:
+        random.Random(args.seed).shuffle(events)
+
+    run_id = base64.urlsafe_b64encode(os.urandom(6)).decode()
+    batches = [events[i:i + args.batch_size] for i in range(0, len(events), args.batch_size)]
+    totals = {'saved': 0, 'duplicate': 0, 'resync': 0}
+    started = time.perf_counter()
+    for n, batch in enumerate(batches):
+        for _ in range(args.repeat):
+            response = send(args.url, args.secret, f"replay-{run_id}-{n}", batch)
+            if response.status_code != 200:
+                print(f"Пачка {n}: {response.status_code} {response.text[:200]}")
+                return 1
+            result = response.json()
+            if result['duplicate']:
+                totals['duplicate'] += 1
+            else:
+                totals['saved'] += result['saved']
+                totals['resync'] += len(result['resync'])
+
+    print(
+        f"Событий {len(events)}, пачек {len(batches)} x{args.repeat} за {time.perf_counter() - started:.2f} с: "
+        f"сохранено {totals['saved']}, повторных доставок {totals['duplicate']}, на сверку {totals['resync']}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
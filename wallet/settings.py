@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wallet_nalog.middleware.ServerTimingMiddleware',  # Server-Timing и лог медленных запросов
+    'wallet_nalog.middleware.MetricsMiddleware',  # Гистограмма времени ответа для /metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'wallet_nalog.middleware.ProfilingMiddleware',  # ?__profile=1 для staff
 ]
 
 ROOT_URLCONF = 'wallet.urls'
@@ -138,14 +141,121 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # JSON по умолчанию; MessagePack — если клиент прислал Accept: application/msgpack.
+    # UserJSONRenderer подключается только на эндпоинтах авторизации.
     'DEFAULT_RENDERER_CLASSES': [
-        'wallet_nalog.renderers.UserJSONRenderer',
-        'rest_framework.renderers.JSONRenderer',
+        'wallet_nalog.renderers.ORJSONRenderer',
+        'wallet_nalog.renderers.MessagePackRenderer',
     ],
 }
 
 AUTH_USER_MODEL = 'wallet_nalog.User'
 
+# Кэш курса TON/USD (секунды)
+TON_PRICE_CACHE_TTL = 60
+# Доля TTL, после которой курс обновляется в фоне
+TON_PRICE_REFRESH_AHEAD = 0.8
+# Пауза перед повторным запросом к CoinGecko после ошибки
+TON_PRICE_RETRY_AFTER = 30
+TON_PRICE_HTTP_TIMEOUT = 5
+
+# Кэш пользователя в JWTAuthentication (секунды, tiered_cache); сбрасывается сигналами
+# при сохранении, сброс доходит до всех воркеров через канал инвалидации
+JWT_USER_CACHE_TTL = 30
+# Размер LRU уже проверенных access-токенов
+JWT_TOKEN_CACHE_SIZE = 1024
+
+# Сколько ждать сетевые секции /api/dashboard/ (баланс, курс), секунды
+DASHBOARD_SECTION_TIMEOUT = 10
+# Потоков для сетевых секций /api/dashboard/ на процесс; при заполненном пуле
+# сетевые секции не запускаются
+DASHBOARD_WORKERS = 8
+
+# Заголовок Server-Timing раскрывает внутреннее устройство — только для разработки
+SERVER_TIMING_HEADER = DEBUG
+# Запросы дольше порога (мс) пишутся в лог wallet_nalog.slow_requests
+SLOW_REQUEST_THRESHOLD_MS = 1000
+SLOW_REQUEST_TOP_SPANS = 5
+
+# /metrics отдаётся только с этих адресов (локальный Prometheus / агент).
+# За обратным прокси REMOTE_ADDR — адрес прокси, поэтому там задайте METRICS_TOKEN
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Токен для /metrics (Authorization: Bearer <токен>); если задан, список адресов не проверяется
+METRICS_TOKEN = ''
+
+# Построчные сообщения загрузки транзакций: в лог пишется каждое N-е,
+# остальные учитываются в wallet_log_messages_suppressed_total
+LOG_SAMPLE_EVERY = 100
+# Предупреждения считаются отдельно от отладочных строк и прореживаются слабее
+LOG_WARNING_SAMPLE_EVERY = 10
+
+# Админка истории транзакций: кэш числа строк и гистограммы по месяцам (секунды)
+ADMIN_COUNT_CACHE_TTL = 300
+ADMIN_TX_HISTOGRAM_TTL = 600
+
+# Фоновые задачи из админки: число потоков, пауза между обращениями
+# к провайдерам (секунды) и глубина полной дозагрузки истории (страниц)
+SYNC_JOB_CONCURRENCY = 2
+SYNC_JOB_MIN_INTERVAL = 2.0
+SYNC_BACKFILL_MAX_PAGES = 50
+# Задача в статусе «Выполняется» дольше этого (секунды) при старте воркера
+# считается прерванной перезапуском
+SYNC_JOB_STALE_AFTER = 3600
+
+# Прогрев воркера после старта (см. wallet_nalog/warmup.py): включён ли
+# автозапуск и сколько недавно активных кошельков подгружать в кэши
+WARMUP_ON_START = True
+WARMUP_HOT_WALLETS = 50
+
+# Redis за двухуровневым кэшем (wallet_nalog/tiered_cache.py): адрес, размер
+# пула, таймаут сокета (секунды) и задержка переподключения после ошибки
+# (удваивается с каждой неудачей от BACKOFF до BACKOFF_MAX секунд)
+REDIS_URL = 'redis://localhost:6379/0'
+REDIS_MAX_CONNECTIONS = 20
+REDIS_SOCKET_TIMEOUT = 1.0
+REDIS_RECONNECT_BACKOFF = 1.0
+REDIS_RECONNECT_BACKOFF_MAX = 60.0
+
+# L1-кэш в памяти процесса: число записей, максимальный срок жизни записи
+# (секунды) и размер значения, больше которого значение хранится только в Redis.
+# Изменения рассылаются другим воркерам через pub/sub канал
+CACHE_L1_SIZE = 512
+CACHE_L1_TTL = 30
+CACHE_L1_MAX_VALUE_BYTES = 256 * 1024
+CACHE_INVALIDATION_CHANNEL = 'wallet:cache:invalidate'
+
+# Уведомления о транзакциях (POST /api/webhooks/transactions/, см. webhooks.py):
+# секреты HMAC (пусто — приём выключен; несколько — для ротации), допустимое
+# расхождение X-Webhook-Timestamp (секунды), максимум событий в пачке и как
+# часто при работающих уведомлениях опрашивать сеть для сверки (секунды)
+WEBHOOK_SECRETS = []
+WEBHOOK_MAX_SKEW = 300
+WEBHOOK_MAX_EVENTS = 1000
+WEBHOOK_RECONCILE_INTERVAL = 900
+
+# Bloom-фильтр известных хешей транзакций кошелька (wallet_nalog/bloom.py):
+# доля ложных срабатываний и минимальная ёмкость фильтра
+BLOOM_ERROR_RATE = 0.01
+BLOOM_MIN_CAPACITY = 1000
+
+# Разбор транзакций при полной дозагрузке (см. wallet_nalog/parse_pool.py):
+# число процессов (0 — в текущем процессе), сколько страниц одновременно
+# в пуле и сколько транзакций в странице
+PARSE_WORKERS = 0
+PARSE_MAX_IN_FLIGHT = 4
+PARSE_CHUNK_SIZE = 200
+# Сколько загруженных, но ещё не записанных страниц истории держать в памяти
+# (см. wallet_nalog/history_stream.py)
+HISTORY_MAX_IN_FLIGHT_PAGES = 4
+
+# Сколько секунд держать в памяти глобальный конфиг сети TON (liteserver-ы)
+LITESERVER_CONFIG_TTL = 3600
+
+# Профилирование запросов staff-пользователей по ?__profile=1
+PROFILING_ENABLED = True
+# Шаг сэмплирования стека (секунды) для свёрнутых стеков / flame graph
+PROFILING_SAMPLE_INTERVAL = 0.005
+
 # Настройки django-unfold
 UNFOLD = {
     "SITE_TITLE": "CryptoTax Admin",
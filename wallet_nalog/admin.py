@@ -1,15 +1,79 @@
-from django.contrib import admin
+from datetime import datetime
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
-from pytoniq_core import Address
-from .models import WalletSession, TransactionHistory
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, DateField, Q
+from django.db.models.functions import TruncMonth
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from . import jobs
+from .models import WalletSession, TransactionHistory, MonthlyTaxSnapshot, AccountAddress, WalletDataVersion, ProfileArtifact, SyncJob, WebhookDelivery, tx_hash_to_bytes
 
 User = get_user_model()
 
+HEX_RE = re.compile(r'[0-9a-fA-F]+')
+TX_MONTH_HISTOGRAM_CACHE_KEY = 'admin:tx-month-histogram'
+
+
+def _friendly_address(addr):
+    """Адрес в формате UQ..., как он хранится в истории транзакций."""
+    from pytoniq_core import Address
+
+    try:
+        return Address(addr).to_str(is_bounceable=False)
+    except Exception:
+        return addr
+
+
+def _enqueue_jobs(modeladmin, request, kind, addresses):
+    """Ставит фоновые задачи и сообщает, сколько поставлено, со ссылкой на список задач."""
+    created, skipped = jobs.enqueue(kind, [_friendly_address(a) for a in addresses if a], requested_by=request.user)
+    url = reverse('admin:wallet_nalog_syncjob_changelist')
+    modeladmin.message_user(
+        request,
+        format_html(
+            'Поставлено задач «{}»: {}, уже в очереди: {}. <a href="{}">Прогресс</a>',
+            dict(SyncJob.KIND_CHOICES)[kind], len(created), skipped, url,
+        ),
+        messages.SUCCESS if created else messages.WARNING,
+    )
+
+
+class SyncJobActionsMixin:
+    """Действия «обновить историю», «полная дозагрузка», «пересчитать налог» для выбранных строк."""
+    actions = ('resync_history', 'full_backfill', 'recompute_tax')
+
+    def wallet_addresses(self, queryset):
+        raise NotImplementedError
+
+    @admin.action(description='Обновить историю транзакций (в фоне)')
+    def resync_history(self, request, queryset):
+        _enqueue_jobs(self, request, SyncJob.KIND_RESYNC, self.wallet_addresses(queryset))
+
+    @admin.action(description='Полная дозагрузка истории (в фоне)')
+    def full_backfill(self, request, queryset):
+        _enqueue_jobs(self, request, SyncJob.KIND_BACKFILL, self.wallet_addresses(queryset))
+
+    @admin.action(description='Пересчитать налоговые срезы (в фоне)')
+    def recompute_tax(self, request, queryset):
+        _enqueue_jobs(self, request, SyncJob.KIND_RECOMPUTE, self.wallet_addresses(queryset))
+
 
 # Регистрация модели User
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(SyncJobActionsMixin, BaseUserAdmin):
     list_display = ('email', 'wallet_info', 'is_active', 'is_staff', 'date_joined')
     list_filter = ('is_active', 'is_staff', 'is_superuser', 'date_joined')
     search_fields = ('email',)
@@ -45,13 +109,17 @@ class UserAdmin(BaseUserAdmin):
         return "Нет кошелька"
     wallet_info.short_description = 'Информация о кошельке'
 
+    def wallet_addresses(self, queryset):
+        return queryset.values_list('wallet__wallet_address', flat=True)
+
 
 @admin.register(WalletSession)
-class WalletSessionAdmin(admin.ModelAdmin):
+class WalletSessionAdmin(SyncJobActionsMixin, admin.ModelAdmin):
     list_display = ('session_key', 'wallet_address', 'wallet_type', 'connected', 'created_at', 'user_email')
     list_filter = ('connected', 'wallet_type', 'created_at')
     search_fields = ('session_key', 'wallet_address', 'user__email')
     readonly_fields = ('created_at', 'updated_at', 'user_email')
+    actions = SyncJobActionsMixin.actions + ('profile_total_tax',)
     
     fieldsets = (
         ('Основная информация', {
@@ -71,51 +139,283 @@ class WalletSessionAdmin(admin.ModelAdmin):
     user_email.short_description = 'Email пользователя'
     user_email.admin_order_field = 'user__email'
 
+    def wallet_addresses(self, queryset):
+        return queryset.values_list('wallet_address', flat=True)
+
+    @admin.action(description='Профилировать расчёт налога (в фоне)')
+    def profile_total_tax(self, request, queryset):
+        """Ставит задачи профилирования calculate_total_tax для выбранных кошельков."""
+        _enqueue_jobs(self, request, SyncJob.KIND_PROFILE, self.wallet_addresses(queryset))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без COUNT(*) на каждый показ списка.
+    Без фильтров на PostgreSQL берётся оценка из pg_class.reltuples,
+    в остальных случаях точное число кэшируется на ADMIN_COUNT_CACHE_TTL секунд.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        key = f"admin:count:{hashlib.sha1(sql.encode()).hexdigest()}"
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(settings, 'ADMIN_COUNT_CACHE_TTL', 300))
+        return count
+
+
+def transaction_month_histogram():
+    """
+    [(первый день месяца, число транзакций)] по убыванию месяца.
+    Группировка по всей таблице дорогая, поэтому результат кэшируется
+    на ADMIN_TX_HISTOGRAM_TTL секунд.
+    """
+    histogram = cache.get(TX_MONTH_HISTOGRAM_CACHE_KEY)
+    if histogram is None:
+        histogram = list(
+            TransactionHistory.objects.annotate(month=TruncMonth('timestamp', output_field=DateField()))
+            .values('month').annotate(count=Count('id')).order_by('-month').values_list('month', 'count')
+        )
+        cache.set(TX_MONTH_HISTOGRAM_CACHE_KEY, histogram, getattr(settings, 'ADMIN_TX_HISTOGRAM_TTL', 600))
+    return histogram
+
+
+class TransactionMonthFilter(admin.SimpleListFilter):
+    """Фильтр по месяцу вместо date_hierarchy: список месяцев берётся из кэшированной гистограммы."""
+    title = 'Месяц'
+    parameter_name = 'month'
+
+    def lookups(self, request, model_admin):
+        return [
+            (month.strftime('%Y-%m'), f"{month.strftime('%Y-%m')} ({count})")
+            for month, count in transaction_month_histogram()
+        ]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            start = datetime.strptime(self.value(), '%Y-%m')
+        except ValueError:
+            return queryset.none()
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        # Границы в текущей временной зоне — так же, как группирует TruncMonth
+        return queryset.filter(timestamp__gte=timezone.make_aware(start), timestamp__lt=timezone.make_aware(end))
+
 
 @admin.register(TransactionHistory)
 class TransactionHistoryAdmin(admin.ModelAdmin):
-    list_display = ('tx_hash_short', 'wallet_address_short', 'amount', 'from_address_short', 'to_address_short', 'status', 'timestamp', 'created_at')
-    list_filter = ('status', 'timestamp', 'created_at')
-    search_fields = ('tx_hash', 'wallet_address', 'from_address', 'to_address')
-    readonly_fields = ('created_at',)
-    date_hierarchy = 'timestamp'
+    """
+    Список рассчитан на миллионы строк: оценочный счётчик, адреса уже
+    хранятся в формате UQ... (без разбора Address на каждую строку),
+    поиск только по индексам, фильтр по месяцу из кэшированной гистограммы.
+    """
+    list_display = ('tx_hash_short', 'wallet_address_short', 'amount', 'from_address_short', 'to_address_short', 'direction', 'timestamp', 'created_at')
+    list_filter = (TransactionMonthFilter, 'direction')
+    # Реальный поиск — в get_search_results; поле нужно, чтобы админка показала строку поиска
+    search_fields = ('=wallet_address',)
+    search_help_text = 'Хеш транзакции (hex целиком или префикс от 8 символов, base64) или адрес (UQ.../EQ.../0:...)'
+    readonly_fields = ('tx_hash_hex', 'created_at')
+    list_select_related = ('from_account', 'to_account')
+    raw_id_fields = ('from_account', 'to_account')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('tx_hash', 'wallet_address', 'amount', 'status')
+            'fields': ('tx_hash_hex', 'lt', 'wallet_address', 'amount_nano', 'status', 'direction')
         }),
         ('Адреса', {
-            'fields': ('from_address', 'to_address')
+            'fields': ('from_account', 'to_account')
         }),
         ('Даты', {
             'fields': ('timestamp', 'created_at')
         }),
     )
-    
-    def _friendly(self, addr: str) -> str:
-        """Приводим адрес к удобному формату UQ... для отображения в админке."""
-        if not addr:
-            return ''
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск только по индексированным колонкам:
+        - полный хеш (hex или base64) — точное совпадение tx_hash;
+        - hex-префикс хеша — диапазон tx_hash по уникальному индексу;
+        - адрес — точное совпадение по кошельку и интернированным адресам;
+        - иначе — префикс wallet_address (диапазоном по индексу).
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        if HEX_RE.fullmatch(term):
+            if len(term) == 64:
+                return queryset.filter(tx_hash=bytes.fromhex(term)), False
+            if len(term) >= 8:
+                prefix = bytes.fromhex(term[:len(term) // 2 * 2])
+                return queryset.filter(tx_hash__gte=prefix, tx_hash__lte=prefix + b'\xff' * (32 - len(prefix))), False
+
+        from pytoniq_core import Address
+
         try:
-            return Address(addr).to_str(is_bounceable=False)
+            friendly = Address(term).to_str(is_bounceable=False)
         except Exception:
-            return addr
+            friendly = None
+        if friendly is not None:
+            account_ids = list(AccountAddress.objects.filter(friendly__in={term, friendly}).values_list('pk', flat=True))
+            return queryset.filter(
+                Q(wallet_address=friendly) | Q(from_account_id__in=account_ids) | Q(to_account_id__in=account_ids)
+            ), False
+
+        if len(term) == 44:
+            return queryset.filter(tx_hash=tx_hash_to_bytes(term)), False
+
+        # Префикс как диапазон, а не LIKE: так используется индекс по wallet_address
+        return queryset.filter(wallet_address__gte=term, wallet_address__lt=term + '\uffff'), False
 
     def tx_hash_short(self, obj):
-        return f"{obj.tx_hash[:16]}..." if obj.tx_hash else '-'
+        return f"{obj.tx_hash_hex[:16]}..." if obj.tx_hash else '-'
     tx_hash_short.short_description = 'Хеш транзакции'
 
+    def tx_hash_hex(self, obj):
+        return obj.tx_hash_hex
+    tx_hash_hex.short_description = 'Хеш транзакции (hex)'
+
     def wallet_address_short(self, obj):
-        addr = self._friendly(obj.wallet_address)
+        addr = obj.wallet_address
         return f"{addr[:16]}..." if addr else '-'
     wallet_address_short.short_description = 'Адрес кошелька'
     
     def from_address_short(self, obj):
-        addr = self._friendly(obj.from_address)
+        addr = obj.from_address
         return f"{addr[:16]}..." if addr else '-'
     from_address_short.short_description = 'От'
     
     def to_address_short(self, obj):
-        addr = self._friendly(obj.to_address)
+        addr = obj.to_address
         return f"{addr[:16]}..." if addr else '-'
     to_address_short.short_description = 'Кому'
+
+
+@admin.register(MonthlyTaxSnapshot)
+class MonthlyTaxSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('wallet_address', 'period', 'total_sent_ton', 'total_tax_ton', 'transactions_count', 'updated_at')
+    search_fields = ('wallet_address',)
+    readonly_fields = ('updated_at',)
+    ordering = ('wallet_address', '-period')
+
+
+@admin.register(AccountAddress)
+class AccountAddressAdmin(admin.ModelAdmin):
+    list_display = ('friendly', 'workchain')
+    search_fields = ('=friendly',)
+    readonly_fields = ('workchain', 'hash_part', 'friendly')
+
+
+@admin.register(WalletDataVersion)
+class WalletDataVersionAdmin(admin.ModelAdmin):
+    list_display = ('wallet_address', 'version', 'updated_at')
+    search_fields = ('=wallet_address',)
+    readonly_fields = ('wallet_address', 'version', 'updated_at')
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('delivery_id', 'status', 'events', 'received_at')
+    list_filter = ('status',)
+    search_fields = ('=delivery_id',)
+    readonly_fields = ('delivery_id', 'status', 'events', 'result', 'received_at')
+
+
+@admin.register(ProfileArtifact)
+class ProfileArtifactAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'endpoint', 'wallet_address', 'status_code', 'duration_ms', 'user', 'downloads')
+    list_filter = ('endpoint',)
+    search_fields = ('=wallet_address', 'endpoint')
+    list_select_related = ('user',)
+    readonly_fields = (
+        'created_at', 'user', 'wallet_address', 'endpoint', 'path', 'status_code', 'duration_ms', 'downloads',
+    )
+    exclude = ('pstats_dump', 'collapsed_stacks')
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:pk>/download/<str:kind>/',
+                self.admin_site.admin_view(self.download_view),
+                name='wallet_nalog_profileartifact_download',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk, kind):
+        """pstats — дамп cProfile (.prof), stacks — свёрнутые стеки для flame graph (.txt)."""
+        artifact = get_object_or_404(ProfileArtifact, pk=pk)
+        if kind == 'pstats':
+            response = HttpResponse(bytes(artifact.pstats_dump), content_type='application/octet-stream')
+            filename = f'profile-{artifact.pk}.prof'
+        elif kind == 'stacks':
+            response = HttpResponse(artifact.collapsed_stacks, content_type='text/plain; charset=utf-8')
+            filename = f'profile-{artifact.pk}.collapsed.txt'
+        else:
+            return HttpResponse(status=404)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">pstats</a> | <a href="{}">flame graph</a>',
+            reverse('admin:wallet_nalog_profileartifact_download', args=[obj.pk, 'pstats']),
+            reverse('admin:wallet_nalog_profileartifact_download', args=[obj.pk, 'stacks']),
+        )
+    downloads.short_description = 'Скачать'
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'wallet_address', 'status', 'progress_bar', 'message', 'requested_by', 'created_at', 'duration')
+    list_filter = ('status', 'kind')
+    search_fields = ('=wallet_address',)
+    list_select_related = ('requested_by',)
+    readonly_fields = (
+        'kind', 'wallet_address', 'requested_by', 'status', 'progress', 'message',
+        'result', 'error', 'created_at', 'started_at', 'finished_at',
+    )
+    actions = ('retry_failed',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress_bar(self, obj):
+        return format_html('<progress value="{}" max="100"></progress> {}%', obj.progress, obj.progress)
+    progress_bar.short_description = 'Прогресс'
+
+    def duration(self, obj):
+        if not obj.started_at:
+            return '-'
+        end = obj.finished_at or timezone.now()
+        return f"{(end - obj.started_at).total_seconds():.1f} с"
+    duration.short_description = 'Длительность'
+
+    @admin.action(description='Повторить задачи с ошибкой')
+    def retry_failed(self, request, queryset):
+        count = jobs.retry(queryset)
+        self.message_user(request, f'Возвращено в очередь: {count}', messages.SUCCESS)
+
@@ -5,3 +5,10 @@ class WalletNalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wallet_nalog'
     verbose_name = 'Кошельки и налоги'
+
+    def ready(self):
+        # Сигналы инвалидации кэша аутентификации
+        from . import signals  # noqa: F401
+        # Прогрев воркера в фоне (только в серверных процессах, см. warmup.py)
+        from .warmup import schedule_on_start
+        schedule_on_start()
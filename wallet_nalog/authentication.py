@@ -1,44 +1,191 @@
+import json
 import jwt
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
 from rest_framework import authentication, exceptions
-from .models import User
+from .metrics import cache_hit, cache_miss
+from .models import User, WalletSession
+from .tiered_cache import tiered_cache
+
+
+USER_CACHE_KEY = 'auth:user:{user_id}'
+# Обратная ссылка кошелёк -> пользователь, чтобы сбросить кэш при сохранении
+# WalletSession без запроса к БД
+WALLET_USER_CACHE_KEY = 'auth:wallet-user:{wallet_id}'
+# Поля пользователя, которые кэш отдаёт без запроса к БД. Пароль, email и
+# права суперпользователя в Redis не попадают: у пользователя из кэша они
+# отложены, и save() такого экземпляра обновляет только загруженные поля
+USER_CACHE_FIELDS = ('id', 'wallet_id', 'is_active', 'is_staff')
+WALLET_CACHE_FIELDS = ('id', 'session_key', 'wallet_address', 'wallet_type', 'connected', 'created_at', 'updated_at')
+
+
+def _user_cache_ttl():
+    return getattr(settings, 'JWT_USER_CACHE_TTL', 30)
+
+
+def _token_cache_size():
+    return getattr(settings, 'JWT_TOKEN_CACHE_SIZE', 1024)
+
+
+class _DecodedTokenCache:
+    """
+    LRU уже проверенных access-токенов: подпись HMAC проверяется один раз,
+    дальше токен берётся из памяти. Срок действия (exp) проверяется
+    при каждом обращении.
+    """
+
+    def __init__(self):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            payload = self._items.get(token)
+            if payload is None:
+                return None
+            if payload.get('exp', 0) <= time.time():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return payload
+
+    def put(self, token, payload):
+        with self._lock:
+            self._items[token] = payload
+            self._items.move_to_end(token)
+            while len(self._items) > _token_cache_size():
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+decoded_tokens = _DecodedTokenCache()
+
+
+def decode_access_token(token):
+    payload = decoded_tokens.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+    if payload.get('token_type') != 'access':
+        raise exceptions.AuthenticationFailed('Неверный тип токена')
+    decoded_tokens.put(token, payload)
+    return payload
+
+
+def _encode(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _dump_instance(instance, attnames):
+    return {attname: getattr(instance, attname) for attname in attnames}
+
+
+def _load_instance(model, row):
+    """Экземпляр из кэша; поля, которых нет в row, отложены (deferred) и читаются из БД при обращении."""
+    fields = [field for field in model._meta.concrete_fields if field.attname in row]
+    return model.from_db(
+        DEFAULT_DB_ALIAS,
+        [field.attname for field in fields],
+        [field.to_python(row[field.attname]) for field in fields],
+    )
+
+
+def _dump_user(user):
+    wallet = user.wallet if user.wallet_id else None
+    return json.dumps(
+        {
+            'user': _dump_instance(user, USER_CACHE_FIELDS),
+            'wallet': _dump_instance(wallet, WALLET_CACHE_FIELDS) if wallet else None,
+        },
+        default=_encode,
+    )
+
+
+def _load_user(data):
+    payload = json.loads(data)
+    user = _load_instance(User, payload['user'])
+    user.wallet = _load_instance(WalletSession, payload['wallet']) if payload['wallet'] else None
+    return user
+
+
+def get_cached_user(user_id):
+    """
+    Пользователь вместе с кошельком (select_related) из tiered_cache.
+    В кэше живёт JWT_USER_CACHE_TTL секунд; сбрасывается сигналами
+    при сохранении User или WalletSession (см. signals.py), и сброс
+    доходит до L1 остальных воркеров через канал инвалидации.
+    """
+    key = USER_CACHE_KEY.format(user_id=user_id)
+    ttl = _user_cache_ttl()
+    data = tiered_cache.get(key, ttl)
+    if data is not None:
+        cache_hit('auth_user')
+        return _load_user(data)
+
+    cache_miss('auth_user')
+    user = User.objects.select_related('wallet').get(id=user_id)
+    tiered_cache.set(key, _dump_user(user), ttl)
+    if user.wallet_id:
+        tiered_cache.set(WALLET_USER_CACHE_KEY.format(wallet_id=user.wallet_id), str(user.pk), ttl)
+    return user
+
+
+def invalidate_user_cache(user_id):
+    tiered_cache.delete(USER_CACHE_KEY.format(user_id=user_id))
+
+
+def invalidate_wallet_cache(wallet_id):
+    key = WALLET_USER_CACHE_KEY.format(wallet_id=wallet_id)
+    user_id = tiered_cache.get(key)
+    if user_id is not None:
+        invalidate_user_cache(user_id)
+        tiered_cache.delete(key)
 
 
 class JWTAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        
+
         if not auth_header:
             return None
-        
+
         try:
             token = auth_header.split(' ')[1]
         except IndexError:
             raise exceptions.AuthenticationFailed('Неверный формат токена. Используйте "Bearer <token>"')
-        
+
         try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            if payload.get('token_type') != 'access':
-                raise exceptions.AuthenticationFailed('Неверный тип токена')
-            
+            payload = decode_access_token(token)
+
             user_id = payload.get('user_id')
             if not user_id:
                 raise exceptions.AuthenticationFailed('Токен не содержит user_id')
-            
+
             try:
-                user = User.objects.get(id=user_id)
+                user = get_cached_user(user_id)
             except User.DoesNotExist:
                 raise exceptions.AuthenticationFailed('Пользователь не найден')
-            
+
             if not user.is_active:
                 raise exceptions.AuthenticationFailed('Пользователь неактивен')
-            
+
             return (user, token)
-            
+
+        except exceptions.AuthenticationFailed:
+            raise
         except jwt.ExpiredSignatureError:
             raise exceptions.AuthenticationFailed('Токен истек')
         except jwt.InvalidTokenError:
             raise exceptions.AuthenticationFailed('Неверный токен')
         except Exception as e:
             raise exceptions.AuthenticationFailed(f'Ошибка аутентификации: {str(e)}')
-
@@ -0,0 +1,219 @@
+"""
+Bloom-фильтр известных хешей транзакций кошелька.
+
+При обновлении истории почти все полученные транзакции уже есть в БД.
+Раньше каждый хеш проверялся отдельным запросом. Теперь фильтр отвечает
+«точно нет» или «возможно есть». Новые хеши сохраняются без проверки, а
+«возможно есть» проверяется одним запросом на пачку. Если вся страница
+истории уже известна, пагинация останавливается.
+
+Фильтр хранится в tiered_cache (L1 процесса + Redis) вместе с версией
+данных кошелька (WalletDataVersion), на которой он построен. Загрузка
+истории пишет пачки по очереди; внутри deferred(...) фильтр между пачками
+живёт в памяти потока и записывается в tiered_cache один раз в конце. Если версия
+не совпадает, значит кошелёк обновлял кто-то, кто не записал свои хеши
+в фильтр. Тогда фильтр перестраивается из БД. Ложноотрицательный ответ
+после гонки двух записывающих не опасен: tx_hash уникален, и повтор
+отсекает ограничение БД.
+"""
+from contextlib import contextmanager
+import base64
+import json
+import logging
+import math
+import threading
+
+from django.conf import settings
+
+from .metrics import BLOOM_CHECKS
+from .models import TransactionHistory, WalletDataVersion, tx_hash_to_bytes
+from .tiered_cache import tiered_cache
+
+logger = logging.getLogger(__name__)
+
+# Кошельки, чьи фильтры записываются в конце deferred(): {кошелёк: фильтр или None}
+_deferred = threading.local()
+
+BLOOM_CACHE_KEY = 'bloom:tx:{wallet}'
+# Фильтр живёт, пока кошелёк обновляется; перестроить его дёшево
+BLOOM_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def _error_rate():
+    return getattr(settings, 'BLOOM_ERROR_RATE', 0.01)
+
+
+def _min_capacity():
+    return getattr(settings, 'BLOOM_MIN_CAPACITY', 1000)
+
+
+class BloomFilter:
+    """
+    Битовый массив на capacity элементов с долей ложных срабатываний error_rate.
+    Хеши транзакций уже равномерно распределены, поэтому позиции берутся
+    прямо из их байтов (двойное хеширование Кирша — Митценмахера).
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, count=0, version=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+        self.version = version
+
+    def _positions(self, tx_hash):
+        h1 = int.from_bytes(tx_hash[:8], 'little')
+        h2 = int.from_bytes(tx_hash[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, tx_hash):
+        for position in self._positions(tx_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, tx_hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(tx_hash))
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def dumps(self):
+        return json.dumps({
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'count': self.count,
+            'version': self.version,
+            'bits': base64.b64encode(self.bits).decode(),
+        })
+
+    @classmethod
+    def loads(cls, data):
+        data = json.loads(data)
+        return cls(
+            data['capacity'], data['error_rate'], bytearray(base64.b64decode(data['bits'])),
+            count=data['count'], version=data['version'],
+        )
+
+
+def _pending():
+    if not hasattr(_deferred, 'filters'):
+        _deferred.filters = {}
+    return _deferred.filters
+
+
+def _write(wallet_address, bloom):
+    tiered_cache.set(BLOOM_CACHE_KEY.format(wallet=wallet_address), bloom.dumps(), BLOOM_CACHE_TTL)
+
+
+def _store(wallet_address, bloom):
+    pending = _pending()
+    if wallet_address in pending:
+        pending[wallet_address] = bloom
+    else:
+        _write(wallet_address, bloom)
+
+
+@contextmanager
+def deferred(wallet_address):
+    """
+    Внутри блока фильтр кошелька не записывается в tiered_cache при каждой
+    пачке (base64 всего массива + рассылка инвалидации), а хранится в памяти
+    потока. На выходе — в том числе по ошибке, ведь записанные пачки уже
+    закоммичены — фильтр записывается один раз.
+    """
+    pending = _pending()
+    if wallet_address in pending:
+        yield
+        return
+    pending[wallet_address] = None
+    try:
+        yield
+    finally:
+        bloom = pending.pop(wallet_address)
+        if bloom is not None:
+            _write(wallet_address, bloom)
+
+
+def _cached(wallet_address):
+    bloom = _pending().get(wallet_address)
+    if bloom is not None:
+        return bloom
+    data = tiered_cache.get(BLOOM_CACHE_KEY.format(wallet=wallet_address), BLOOM_CACHE_TTL)
+    if not data:
+        return None
+    try:
+        return BloomFilter.loads(data)
+    except Exception as e:
+        logger.warning("Не удалось прочитать Bloom-фильтр %s: %s", wallet_address, e)
+        return None
+
+
+def rebuild(wallet_address, version=None):
+    """
+    Строит фильтр по всем хешам кошелька из БД (с запасом по ёмкости вдвое).
+    Ёмкость берётся из COUNT, хеши читаются потоком и в памяти не копятся.
+    """
+    if version is None:
+        version, _ = WalletDataVersion.current(wallet_address)
+    stored = TransactionHistory.objects.filter(wallet_address=wallet_address)
+    bloom = BloomFilter(max(_min_capacity(), 2 * stored.count()), _error_rate(), version=version)
+    for tx_hash in stored.values_list('tx_hash', flat=True).iterator(chunk_size=5000):
+        bloom.add(tx_hash_to_bytes(tx_hash))
+    _store(wallet_address, bloom)
+    logger.debug("Bloom-фильтр %s перестроен: %d хешей", wallet_address, bloom.count)
+    return bloom
+
+
+def get_filter(wallet_address):
+    """Фильтр кошелька; перестраивается, если отстал от версии данных или переполнен."""
+    version, _ = WalletDataVersion.current(wallet_address)
+    bloom = _cached(wallet_address)
+    if bloom is None or bloom.version != version or bloom.saturated:
+        bloom = rebuild(wallet_address, version)
+    return bloom
+
+
+def known_hashes(wallet_address, hashes, bloom=None):
+    """
+    Какие из хешей (bytes) уже сохранены. Отрицательный ответ фильтра
+    принимается без БД; возможные совпадения проверяются одним запросом.
+    """
+    hashes = set(hashes)
+    if not hashes:
+        return set()
+    if bloom is None:
+        bloom = get_filter(wallet_address)
+    maybe = [tx_hash for tx_hash in hashes if tx_hash in bloom]
+    BLOOM_CHECKS.labels(result='negative').inc(len(hashes) - len(maybe))
+    if not maybe:
+        return set()
+    # Проверяем по всей таблице: tx_hash уникален глобально
+    known = {tx_hash_to_bytes(h) for h in TransactionHistory.objects.filter(tx_hash__in=maybe).values_list('tx_hash', flat=True)}
+    BLOOM_CHECKS.labels(result='true_positive').inc(len(known))
+    BLOOM_CHECKS.labels(result='false_positive').inc(len(maybe) - len(known))
+    return known
+
+
+def remember(wallet_address, bloom, hashes):
+    """
+    Добавляет только что сохранённые хеши в фильтр, по которому шла проверка.
+    Вызывается после WalletDataVersion.bump: если версия выросла больше чем
+    на единицу, кошелёк параллельно обновлял кто-то ещё — фильтр перестраивается.
+    """
+    version, _ = WalletDataVersion.current(wallet_address)
+    for tx_hash in hashes:
+        bloom.add(tx_hash)
+    if bloom.saturated or version != bloom.version + 1:
+        rebuild(wallet_address, version)
+        return
+    bloom.version = version
+    _store(wallet_address, bloom)
+
+
+def page_known(wallet_address, hashes):
+    """Все ли хеши страницы истории уже сохранены — тогда глубже идти не нужно."""
+    hashes = set(hashes)
+    return bool(hashes) and len(known_hashes(wallet_address, hashes)) == len(hashes)
@@ -0,0 +1,150 @@
+"""
+Потоковая загрузка истории: загрузка → разбор → запись.
+
+Раньше история кошелька собиралась в один список, и только потом
+разбиралась и сохранялась. Пиковая память росла с длиной истории, а
+ошибка на последней странице теряла всё загруженное. Теперь:
+
+- страницы берутся из асинхронного генератора iter_history_pages по мере
+  получения. Генератор работает в отдельном потоке со своим циклом событий;
+- между загрузкой и записью стоит очередь на HISTORY_MAX_IN_FLIGHT_PAGES
+  страниц. Когда запись отстаёт, загрузка ждёт;
+- запись идёт в вызывающем потоке (parse_pool.ingest_pages) пачками по
+  PARSE_CHUNK_SIZE транзакций. Разбор при PARSE_WORKERS > 0 уходит в пул
+  процессов;
+- каждая пачка пишется одним bulk_create и коммитится сразу. Если
+  следующая страница не загрузилась, сохранённое остаётся, а ошибка
+  возвращается в поле error результата.
+
+После полной загрузки ставится отметка ton:synced:<адрес> на
+TRANSACTIONS_CACHE_TTL секунд. Пока она жива, stream_history(use_cache=True)
+в сеть не ходит. Уведомление о транзакциях (webhooks) её снимает.
+"""
+import asyncio
+import logging
+import queue
+import threading
+
+from django.conf import settings
+
+from .metrics import track_background_thread
+from .parse_pool import ingest_pages
+from .tiered_cache import tiered_cache
+
+logger = logging.getLogger(__name__)
+
+SYNCED_CACHE_KEY = 'ton:synced:{wallet}'
+
+_DONE = object()
+
+
+def _max_in_flight_pages():
+    return max(1, int(getattr(settings, 'HISTORY_MAX_IN_FLIGHT_PAGES', 4)))
+
+
+def _chunk_size():
+    return max(1, int(getattr(settings, 'PARSE_CHUNK_SIZE', 200)))
+
+
+def rechunk(pages, size):
+    """Перекладывает страницы провайдера в пачки по size транзакций (последняя — остаток)."""
+    buffer = []
+    for page in pages:
+        buffer.extend(page)
+        while len(buffer) >= size:
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if buffer:
+        yield buffer
+
+
+class _PageFeed:
+    """
+    Загрузка страниц в отдельном потоке со своим циклом событий.
+    Страницы передаются записи через очередь на in_flight мест; пока
+    очередь полна, генератор страниц не продвигается.
+    """
+
+    def __init__(self, pages_factory, in_flight):
+        self._pages_factory = pages_factory
+        self._queue = queue.Queue(maxsize=in_flight)
+        self._stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='history-fetch', daemon=True)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def _produce(self):
+        pages = self._pages_factory()
+        try:
+            async for page in pages:
+                # Блокирующее ожидание места — вне цикла событий (у LiteClient там фоновые задачи)
+                if not await asyncio.to_thread(self._put, page):
+                    return
+        finally:
+            await pages.aclose()
+
+    def _run(self):
+        with track_background_thread('history_fetch'):
+            try:
+                asyncio.run(self._produce())
+            except Exception as e:
+                self.error = e
+            finally:
+                self._put(_DONE)
+
+    def __iter__(self):
+        self.thread.start()
+        while True:
+            page = self._queue.get()
+            if page is _DONE:
+                return
+            yield page
+
+    def stop(self):
+        self._stopped.set()
+        if self.thread.ident is not None:
+            self.thread.join(timeout=30)
+
+
+def stream_history(wallet_address, use_cache=True, max_pages=3, max_iterations=5, stop_at_known=True,
+                   refresh_snapshots=True, in_flight=None, before_request=None):
+    """
+    Загружает историю кошелька и пишет её в БД по мере получения страниц
+    (запись — в вызывающем потоке). before_request передаётся в
+    iter_history_pages. Возвращает {'fetched': ..., 'saved': ...};
+    при ошибке загрузки добавляется 'error', а сохранённое до неё остаётся
+    в БД. Ошибка записи пробрасывается, загрузка при этом останавливается.
+    """
+    from .tonservice import TRANSACTIONS_CACHE_TTL, _friendly_address, iter_history_pages
+
+    try:
+        synced_key = SYNCED_CACHE_KEY.format(wallet=_friendly_address(wallet_address))
+    except Exception:
+        synced_key = SYNCED_CACHE_KEY.format(wallet=wallet_address)
+    if use_cache and tiered_cache.get(synced_key):
+        logger.info("История %s недавно загружена, в сеть не идём", wallet_address)
+        return {'fetched': 0, 'saved': 0}
+
+    feed = _PageFeed(
+        lambda: iter_history_pages(wallet_address, max_pages, max_iterations, stop_at_known, before_request),
+        in_flight or _max_in_flight_pages(),
+    )
+    try:
+        result = ingest_pages(wallet_address, rechunk(feed, _chunk_size()), refresh_snapshots=refresh_snapshots)
+    finally:
+        feed.stop()
+
+    if feed.error is not None:
+        logger.error("Загрузка истории %s прервана: %s", wallet_address, feed.error)
+        result['error'] = str(feed.error)[:500]
+    else:
+        tiered_cache.set(synced_key, '1', TRANSACTIONS_CACHE_TTL)
+    return result
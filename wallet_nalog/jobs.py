@@ -0,0 +1,240 @@
+"""
+Фоновые задачи из админки: обновление истории, полная дозагрузка,
+пересчёт налоговых срезов и профилирование расчёта налога для выбранных
+кошельков.
+
+Задачи хранятся в SyncJob и выполняются пулом из SYNC_JOB_CONCURRENCY
+потоков. Обращения к провайдерам (TON API, TON Center, LiteClient) —
+каждая страница истории, а не только первая — разнесены минимум на
+SYNC_JOB_MIN_INTERVAL секунд на все воркеры (слот в tiered_cache), чтобы
+пачка задач не упиралась в лимиты API. Запрос админки только ставит задачи в очередь.
+
+Пул живёт в памяти процесса, поэтому после перезапуска прогрев
+(recover_orphaned) снова отдаёт пулу задачи из очереди, а задачи,
+выполнявшиеся дольше SYNC_JOB_STALE_AFTER секунд, отмечает ошибкой.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .metrics import SYNC_FAILURES, track_background_thread
+from .history_stream import stream_history
+from .models import SyncJob, WalletDataVersion
+from .profiling import profile_call, save_profile
+from .tax_calculator import calculate_total_tax, rebuild_monthly_snapshots
+from .tiered_cache import tiered_cache
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+PROVIDER_SLOT_KEY = 'sync:provider-slot'
+# Как часто проверять, освободился ли слот провайдера, секунды
+PROVIDER_SLOT_POLL = 0.1
+
+
+def _concurrency():
+    return getattr(settings, 'SYNC_JOB_CONCURRENCY', 2)
+
+
+def _min_interval():
+    return getattr(settings, 'SYNC_JOB_MIN_INTERVAL', 2.0)
+
+
+def _backfill_max_pages():
+    return getattr(settings, 'SYNC_BACKFILL_MAX_PAGES', 50)
+
+
+def _stale_after():
+    return getattr(settings, 'SYNC_JOB_STALE_AFTER', 3600)
+
+
+class _ProviderThrottle:
+    """
+    Пропускает к провайдерам не чаще одного раза в SYNC_JOB_MIN_INTERVAL секунд
+    на все воркеры: слот — ключ с TTL в tiered_cache, занимаемый через SET NX
+    (как reconcile_due). Без Redis слот общий только для потоков процесса.
+    """
+
+    def wait(self):
+        interval = _min_interval()
+        if interval <= 0:
+            return
+        while not tiered_cache.add(PROVIDER_SLOT_KEY, '1', interval):
+            time.sleep(min(interval, PROVIDER_SLOT_POLL))
+
+
+provider_throttle = _ProviderThrottle()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_concurrency(), thread_name_prefix='sync-job')
+        return _executor
+
+
+def _run_in_worker(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # У каждого потока пула своё соединение с БД
+        close_old_connections()
+
+
+def _submit(job_id):
+    _get_executor().submit(_run_in_worker, job_id)
+
+
+def enqueue(kind, wallet_addresses, requested_by=None):
+    """
+    Ставит задачи kind для кошельков в очередь.
+    Кошельки, для которых такая задача уже ждёт или выполняется, пропускаются.
+    Возвращает (созданные задачи, число пропущенных).
+    """
+    addresses = list(dict.fromkeys(a for a in wallet_addresses if a))
+    active = set(SyncJob.objects.filter(
+        kind=kind, wallet_address__in=addresses, status__in=SyncJob.ACTIVE_STATUSES
+    ).values_list('wallet_address', flat=True))
+
+    jobs = SyncJob.objects.bulk_create([
+        SyncJob(kind=kind, wallet_address=address, requested_by=requested_by)
+        for address in addresses if address not in active
+    ])
+    # Потоки пула видят задачи только после коммита транзакции админки
+    job_ids = [job.pk for job in jobs]
+    transaction.on_commit(lambda: [_submit(job_id) for job_id in job_ids])
+    return jobs, len(active)
+
+
+def _progress(job, progress, message):
+    job.progress = progress
+    job.message = message
+    SyncJob.objects.filter(pk=job.pk).update(progress=progress, message=message)
+
+
+def _fetch_and_save(job, **fetch_kwargs):
+    _progress(job, 10, 'Загрузка и сохранение истории')
+    # Страницы пишутся по мере загрузки: при ошибке сохранённое остаётся,
+    # а повтор задачи пропустит его через Bloom-фильтр
+    result = stream_history(job.wallet_address, before_request=provider_throttle.wait, **fetch_kwargs)
+    if 'error' in result:
+        raise RuntimeError(
+            f"Сохранено {result['saved']} из {result['fetched']} загруженных транзакций, затем ошибка: {result['error']}"
+        )
+    return result
+
+
+def _run_resync(job):
+    return _fetch_and_save(job)
+
+
+def _run_backfill(job):
+    max_pages = _backfill_max_pages()
+    # Срезы пересчитываются целиком ниже
+    result = _fetch_and_save(
+        job, use_cache=False, max_pages=max_pages, max_iterations=max_pages, stop_at_known=False,
+        refresh_snapshots=False,
+    )
+    _progress(job, 80, 'Пересчёт налоговых срезов')
+    result['snapshots'] = rebuild_monthly_snapshots(job.wallet_address)
+    WalletDataVersion.bump(job.wallet_address)
+    return result
+
+
+def _run_recompute(job):
+    _progress(job, 20, 'Пересчёт налоговых срезов')
+    snapshots = rebuild_monthly_snapshots(job.wallet_address)
+    # Срезы изменились — ETag налоговых ответов должен смениться
+    WalletDataVersion.bump(job.wallet_address)
+    return {'snapshots': snapshots}
+
+
+def _run_profile(job):
+    _progress(job, 20, 'Расчёт налога под профайлером')
+    _, seconds, pstats_dump, collapsed = profile_call(calculate_total_tax, job.wallet_address)
+    artifact = save_profile(
+        endpoint='admin:calculate_total_tax',
+        seconds=seconds,
+        pstats_dump=pstats_dump,
+        collapsed_stacks=collapsed,
+        user=job.requested_by,
+        wallet_address=job.wallet_address,
+    )
+    return {'profile_id': artifact.pk, 'duration_ms': artifact.duration_ms}
+
+
+RUNNERS = {
+    SyncJob.KIND_RESYNC: _run_resync,
+    SyncJob.KIND_BACKFILL: _run_backfill,
+    SyncJob.KIND_RECOMPUTE: _run_recompute,
+    SyncJob.KIND_PROFILE: _run_profile,
+}
+
+
+def run_job(job_id):
+    """Выполняет задачу, если она ещё в очереди (задачу забирает только один поток)."""
+    claimed = SyncJob.objects.filter(pk=job_id, status=SyncJob.STATUS_QUEUED).update(
+        status=SyncJob.STATUS_RUNNING, started_at=timezone.now(), message='Запущена'
+    )
+    if not claimed:
+        return
+
+    job = SyncJob.objects.get(pk=job_id)
+    try:
+        with track_background_thread('sync_job'):
+            result = RUNNERS[job.kind](job)
+        SyncJob.objects.filter(pk=job_id).update(
+            status=SyncJob.STATUS_SUCCEEDED, progress=100, message='Готово',
+            result=result, finished_at=timezone.now(),
+        )
+        logger.info("Задача %s (%s) для %s выполнена: %s", job_id, job.kind, job.wallet_address, result)
+    except Exception as e:
+        SYNC_FAILURES.labels(stage=f'job_{job.kind}').inc()
+        logger.error("Задача %s (%s) для %s завершилась ошибкой: %s", job_id, job.kind, job.wallet_address, e, exc_info=True)
+        SyncJob.objects.filter(pk=job_id).update(
+            status=SyncJob.STATUS_FAILED, message='Ошибка', error=str(e)[:2000], finished_at=timezone.now(),
+        )
+
+
+def recover_orphaned():
+    """
+    Задачи, потерянные при перезапуске процесса: ждущие в очереди снова
+    отдаются пулу, а выполнявшиеся дольше SYNC_JOB_STALE_AFTER секунд
+    отмечаются ошибкой (их можно повторить из админки).
+    Возвращает (возвращено в пул, отмечено ошибкой).
+    """
+    now = timezone.now()
+    failed = SyncJob.objects.filter(
+        status=SyncJob.STATUS_RUNNING, started_at__lt=now - timedelta(seconds=_stale_after()),
+    ).update(
+        status=SyncJob.STATUS_FAILED, message='Ошибка',
+        error='Задача прервана перезапуском процесса', finished_at=now,
+    )
+    # Задачу из очереди забирает только один поток (см. run_job), поэтому
+    # повторная отправка из нескольких воркеров безопасна
+    job_ids = list(SyncJob.objects.filter(status=SyncJob.STATUS_QUEUED).values_list('pk', flat=True))
+    for job_id in job_ids:
+        _submit(job_id)
+    if failed or job_ids:
+        logger.warning("Задачи после перезапуска: возвращено в пул %d, прервано %d", len(job_ids), failed)
+    return len(job_ids), failed
+
+
+def retry(jobs):
+    """Возвращает завершившиеся ошибкой задачи в очередь."""
+    job_ids = list(jobs.filter(status=SyncJob.STATUS_FAILED).values_list('pk', flat=True))
+    SyncJob.objects.filter(pk__in=job_ids).update(
+        status=SyncJob.STATUS_QUEUED, progress=0, message='', error='', started_at=None, finished_at=None,
+    )
+    transaction.on_commit(lambda: [_submit(job_id) for job_id in job_ids])
+    return len(job_ids)
@@ -0,0 +1,67 @@
+"""
+Сэмплирование подробных сообщений в горячих циклах.
+
+При загрузке десятков тысяч транзакций строка на каждую транзакцию
+заметно тормозит запись и раздувает логи. SampledLog пишет только каждое
+LOG_SAMPLE_EVERY-е сообщение, остальные считает подавленными: их число
+попадает в итоговую строку пачки и в метрику wallet_log_messages_suppressed_total.
+Предупреждения считаются отдельно и прореживаются слабее
+(LOG_WARNING_SAMPLE_EVERY): редкая ошибка не должна теряться среди
+отладочных строк.
+"""
+import logging
+
+from django.conf import settings
+
+from .metrics import LOG_SUPPRESSED
+
+
+def _sample_every():
+    return max(1, int(getattr(settings, 'LOG_SAMPLE_EVERY', 100)))
+
+
+def _warning_sample_every():
+    return max(1, int(getattr(settings, 'LOG_WARNING_SAMPLE_EVERY', 10)))
+
+
+class SampledLog:
+    """
+    Обёртка над logger для одной пачки. У каждого уровня свой счётчик, и
+    первое сообщение уровня в пачке пишется всегда. Сообщения ниже уровня
+    логгера не форматируются и не считаются.
+    """
+
+    def __init__(self, logger, every=None, warning_every=None):
+        self.logger = logger
+        self.every = every if every is not None else _sample_every()
+        self.warning_every = warning_every if warning_every is not None else _warning_sample_every()
+        self.seen = 0
+        self.suppressed = 0
+        self._unreported = 0
+        self._seen_by_level = {}
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        self.seen += 1
+        seen = self._seen_by_level.get(level, 0) + 1
+        self._seen_by_level[level] = seen
+        every = self.warning_every if level >= logging.WARNING else self.every
+        if (seen - 1) % every:
+            self.suppressed += 1
+            self._unreported += 1
+            return
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def flush(self):
+        """Переносит подавленные сообщения в метрику; возвращает их общее число."""
+        if self._unreported:
+            LOG_SUPPRESSED.labels(logger=self.logger.name).inc(self._unreported)
+            self._unreported = 0
+        return self.suppressed
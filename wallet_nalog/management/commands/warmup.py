@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wallet_nalog.warmup import run_warmup
+
+
+class Command(BaseCommand):
+    help = 'Прогрев: БД, Redis, конфиг сети TON, курс TON/USD и кэши активных кошельков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hot-wallets', type=int, default=None,
+                            help='сколько недавно активных кошельков прогреть (по умолчанию WARMUP_HOT_WALLETS)')
+        parser.add_argument('--strict', action='store_true',
+                            help='завершиться с ошибкой, если какой-то шаг не выполнен')
+
+    def handle(self, *args, hot_wallets=None, strict=False, **options):
+        results = run_warmup(hot_wallets=hot_wallets)
+        for name, result in results.items():
+            if result['ok']:
+                self.stdout.write(self.style.SUCCESS(f"{name:<18} {result['ms']:>8.1f} мс  {result['detail']}"))
+            else:
+                self.stdout.write(self.style.WARNING(f"{name:<18} {result['ms']:>8.1f} мс  ошибка: {result['error']}"))
+
+        failed = [name for name, result in results.items() if not result['ok']]
+        if failed and strict:
+            raise CommandError(f"Не выполнены шаги прогрева: {', '.join(failed)}")
@@ -0,0 +1,125 @@
+"""
+Метрики Prometheus.
+
+В одном процессе (runserver) метрики живут в реестре по умолчанию.
+При нескольких воркерах (gunicorn) задайте переменную окружения
+PROMETHEUS_MULTIPROC_DIR до запуска — каждый процесс пишет значения
+в файлы этого каталога, а /metrics собирает их через MultiProcessCollector.
+"""
+from contextlib import contextmanager
+import functools
+import inspect
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Внешние API и LiteClient: от десятков миллисекунд до таймаутов в 10-15 секунд
+PROVIDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+
+PROVIDER_LATENCY = Histogram(
+    'wallet_provider_request_seconds',
+    'Время обращения к внешнему провайдеру (CoinGecko, TON Center, tonapi, LiteClient)',
+    ['provider', 'outcome'],
+    buckets=PROVIDER_BUCKETS,
+)
+ENDPOINT_LATENCY = Histogram(
+    'wallet_http_request_seconds',
+    'Время обработки HTTP-запроса',
+    ['method', 'view', 'status'],
+)
+CACHE_REQUESTS = Counter(
+    'wallet_cache_requests_total',
+    'Обращения к кэшам: hit / miss',
+    ['cache', 'result'],
+)
+TRANSACTIONS_INGESTED = Counter(
+    'wallet_transactions_ingested_total',
+    'Новые транзакции, сохранённые в БД',
+)
+SYNC_FAILURES = Counter(
+    'wallet_sync_failures_total',
+    'Ошибки синхронизации с блокчейном и пересчёта данных',
+    ['stage'],
+)
+LOG_SUPPRESSED = Counter(
+    'wallet_log_messages_suppressed_total',
+    'Подробные сообщения, отброшенные сэмплированием логов',
+    ['logger'],
+)
+BLOOM_CHECKS = Counter(
+    'wallet_bloom_checks_total',
+    'Проверки хешей транзакций Bloom-фильтром: negative — без запроса к БД',
+    ['result'],
+)
+WEBHOOK_DELIVERIES = Counter(
+    'wallet_webhook_deliveries_total',
+    'Пачки уведомлений о транзакциях',
+    ['result'],
+)
+REDIS_UP = Gauge(
+    'wallet_redis_up',
+    'Доступен ли Redis (1 / 0) по мнению воркера',
+    multiprocess_mode='livemin',
+)
+BACKGROUND_THREADS = Gauge(
+    'wallet_background_threads',
+    'Работающие фоновые потоки',
+    ['kind'],
+    multiprocess_mode='livesum',
+)
+
+
+def cache_hit(cache):
+    CACHE_REQUESTS.labels(cache=cache, result='hit').inc()
+
+
+def cache_miss(cache):
+    CACHE_REQUESTS.labels(cache=cache, result='miss').inc()
+
+
+@contextmanager
+def provider_timer(provider):
+    """Замер обращения к провайдеру; исключение помечается outcome=error."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        PROVIDER_LATENCY.labels(provider=provider, outcome=outcome).observe(time.perf_counter() - started)
+
+
+def timed_provider(provider):
+    """provider_timer в виде декоратора (поддерживает корутины)."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with provider_timer(provider):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with provider_timer(provider):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_background_thread(kind):
+    """Контекстный менеджер: поток учитывается в wallet_background_threads, пока работает."""
+    return BACKGROUND_THREADS.labels(kind=kind).track_inprogress()
+
+
+def render_latest():
+    """(тело, content-type) для ответа /metrics."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,4 +1,18 @@
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
 from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import AuthenticationFailed
+import json
+import logging
+import time
+
+from .authentication import JWTAuthentication
+from .metrics import ENDPOINT_LATENCY
+from .profiling import profile_call, save_profile
+from .timing import start_timing, stop_timing
+
+slow_request_logger = logging.getLogger('wallet_nalog.slow_requests')
 
 
 class DisableCSRFForAPI(MiddlewareMixin):
@@ -9,3 +23,113 @@ class DisableCSRFForAPI(MiddlewareMixin):
             setattr(request, '_dont_enforce_csrf_checks', True)
         return None
 
+
+class ServerTimingMiddleware:
+    """
+    Разбивка времени запроса по БД, внешним HTTP, LiteClient и налоговому движку.
+
+    - заголовок Server-Timing (виден во вкладке Network браузера),
+      если включён SERVER_TIMING_HEADER;
+    - запросы дольше SLOW_REQUEST_THRESHOLD_MS пишутся в лог
+      wallet_nalog.slow_requests одной JSON-строкой: число SQL-запросов,
+      суммы по спанам и SLOW_REQUEST_TOP_SPANS самых медленных спанов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing, token = start_timing(top_n=getattr(settings, 'SLOW_REQUEST_TOP_SPANS', 5))
+        try:
+            with connection.execute_wrapper(timing.db_wrapper):
+                response = self.get_response(request)
+        finally:
+            stop_timing(timing, token)
+
+        if getattr(settings, 'SERVER_TIMING_HEADER', True):
+            response['Server-Timing'] = timing.server_timing_header()
+
+        threshold_ms = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 1000)
+        if threshold_ms is not None and timing.total * 1000 >= threshold_ms:
+            entry = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **timing.summary(),
+            }
+            slow_request_logger.warning(f"slow_request {json.dumps(entry, ensure_ascii=False, default=str)}")
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Время ответа в гистограмме wallet_http_request_seconds.
+    Метка view — имя URL-маршрута, а не путь: иначе адреса и параметры
+    в пути раздули бы число временных рядов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        if view != 'metrics':
+            ENDPOINT_LATENCY.labels(
+                method=request.method,
+                view=view,
+                status=str(response.status_code),
+            ).observe(time.perf_counter() - started)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    ?__profile=1 у staff-пользователя: запрос выполняется под профайлером,
+    результат сохраняется в ProfileArtifact (скачивается из админки).
+    В ответ добавляются заголовки X-Profile-Id и X-Profile-URL.
+
+    Пользователь берётся из сессии админки или из JWT; для остальных
+    параметр игнорируется. Выключается настройкой PROFILING_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.GET.get('__profile') != '1' or not getattr(settings, 'PROFILING_ENABLED', True):
+            return self.get_response(request)
+
+        user = self._staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        response, seconds, pstats_dump, collapsed = profile_call(self.get_response, request)
+        match = getattr(request, 'resolver_match', None)
+        artifact = save_profile(
+            endpoint=match.url_name if match is not None and match.url_name else request.path,
+            seconds=seconds,
+            pstats_dump=pstats_dump,
+            collapsed_stacks=collapsed,
+            user=user,
+            wallet_address=user.wallet.wallet_address if user.wallet else '',
+            path=request.get_full_path(),
+            status_code=response.status_code,
+        )
+        response['X-Profile-Id'] = str(artifact.pk)
+        response['X-Profile-URL'] = reverse('admin:wallet_nalog_profileartifact_change', args=[artifact.pk])
+        return response
+
+    def _staff_user(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            return user
+        try:
+            authenticated = JWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if authenticated is not None and authenticated[0].is_staff:
+            return authenticated[0]
+        return None
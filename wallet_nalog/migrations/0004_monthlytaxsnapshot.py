@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0003_walletsession_alter_user_table_transactionhistory_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transactionhistory',
+            options={'verbose_name': 'Транзакция', 'verbose_name_plural': 'История транзакций'},
+        ),
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name': 'Пользователь', 'verbose_name_plural': 'Пользователи'},
+        ),
+        migrations.AlterModelOptions(
+            name='walletsession',
+            options={'verbose_name': 'Сессия кошелька', 'verbose_name_plural': 'Сессии кошельков'},
+        ),
+        migrations.CreateModel(
+            name='MonthlyTaxSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet_address', models.CharField(max_length=100)),
+                ('period', models.DateField()),
+                ('total_sent_ton', models.DecimalField(decimal_places=9, default=0, max_digits=20)),
+                ('total_tax_ton', models.DecimalField(decimal_places=9, default=0, max_digits=20)),
+                ('transactions_count', models.PositiveIntegerField(default=0)),
+                ('transactions', models.JSONField(default=list)),
+                ('closing_lots', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Налоговый срез за месяц',
+                'verbose_name_plural': 'Налоговые срезы по месяцам',
+                'db_table': 'monthly_tax_snapshots',
+                'constraints': [models.UniqueConstraint(fields=('wallet_address', 'period'), name='uniq_snapshot_wallet_period')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:18
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_direction(apps, schema_editor):
+    """Заполняем direction для существующих строк set-based UPDATE-запросами."""
+    TransactionHistory = apps.get_model('wallet_nalog', 'TransactionHistory')
+    pending = TransactionHistory.objects.filter(direction='')
+    pending.filter(from_address=F('wallet_address'), to_address=F('wallet_address')).update(direction='self')
+    pending.filter(to_address=F('wallet_address')).update(direction='in')
+    pending.filter(from_address=F('wallet_address')).update(direction='out')
+    pending.update(direction='other')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0004_monthlytaxsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='direction',
+            field=models.CharField(blank=True, choices=[('in', 'Входящая'), ('out', 'Исходящая'), ('self', 'Перевод самому себе'), ('other', 'Не относится к кошельку')], max_length=5),
+        ),
+        migrations.RunPython(backfill_direction, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['wallet_address', 'direction', 'timestamp'], name='tx_wallet_direction_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Шаг 1 из 3: добавляем компактные колонки рядом со старыми.
+    Колонки nullable, поэтому миграция не переписывает таблицу.
+    """
+
+    dependencies = [
+        ('wallet_nalog', '0005_transactionhistory_direction'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transactionhistory',
+            name='transaction_tx_hash_75b313_idx',
+        ),
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='tx_hash_bin',
+            field=models.BinaryField(max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='amount_nano',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='lt',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:02
+
+import base64
+import binascii
+import hashlib
+from decimal import Decimal
+from django.db import migrations, transaction
+from django.db.models import Min, Subquery
+
+BATCH_SIZE = 2000
+
+
+def tx_hash_to_bytes(value):
+    """
+    Копия wallet_nalog.models.tx_hash_to_bytes на момент миграции:
+    миграция не должна зависеть от того, как функция изменится потом.
+    """
+    value = str(value).strip()
+    if len(value) == 64:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    for decode in (base64.b64decode, base64.urlsafe_b64decode):
+        try:
+            decoded = decode(value + '=' * (-len(value) % 4))
+        except (binascii.Error, ValueError):
+            continue
+        if len(decoded) == 32:
+            return decoded
+    return hashlib.sha256(value.encode()).digest()
+
+
+def backfill_compact_columns(apps, schema_editor):
+    """
+    Шаг 2 из 3: переносим данные пачками по BATCH_SIZE строк.
+    Каждая пачка — отдельная короткая транзакция, чтобы не держать
+    блокировку на всю таблицу. lt для старых записей неизвестен
+    и заполнится при следующей синхронизации.
+    """
+    TransactionHistory = apps.get_model('wallet_nalog', 'TransactionHistory')
+    MonthlyTaxSnapshot = apps.get_model('wallet_nalog', 'MonthlyTaxSnapshot')
+
+    last_pk = 0
+    while True:
+        batch = list(
+            TransactionHistory.objects
+            .filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'tx_hash', 'amount')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for tx in batch:
+            tx.tx_hash_bin = tx_hash_to_bytes(tx.tx_hash)
+            tx.amount_nano = int((Decimal(tx.amount) * 1000000000).to_integral_value())
+        with transaction.atomic():
+            TransactionHistory.objects.bulk_update(batch, ['tx_hash_bin', 'amount_nano'])
+        last_pk = batch[-1].pk
+
+    delete_duplicate_hashes(TransactionHistory)
+
+    # В срезах хранятся хеши в старом формате — они пересоберутся при первом чтении
+    MonthlyTaxSnapshot.objects.all().delete()
+
+
+def delete_duplicate_hashes(TransactionHistory):
+    """
+    Одна и та же транзакция могла быть сохранена дважды: hex от tonapi и
+    base64 от toncenter. После перевода в байты такие строки совпадают.
+    Оставляем строку с наименьшим id, иначе 0008 не сможет включить
+    уникальность tx_hash. Дубликаты ищет сама БД (GROUP BY), хеши в
+    память процесса не читаются.
+    """
+    keep = (
+        TransactionHistory.objects
+        .values('tx_hash_bin')
+        .annotate(keep_pk=Min('pk'))
+        .values('keep_pk')
+    )
+    with transaction.atomic():
+        TransactionHistory.objects.exclude(pk__in=Subquery(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('wallet_nalog', '0006_transactionhistory_compact_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_compact_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Шаг 3 из 3: удаляем строковый хеш и Decimal-сумму, включаем ограничения.
+
+    Эта миграция не онлайн: после неё код предыдущего релиза, который ещё
+    пишет строковый tx_hash и amount, падает. Её применяют в окне
+    обслуживания, когда воркеры старой версии уже остановлены (см. README,
+    «Обновление схемы транзакций»).
+    """
+
+    dependencies = [
+        ('wallet_nalog', '0007_backfill_transactionhistory_compact_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='transactionhistory',
+            name='tx_hash',
+        ),
+        migrations.RemoveField(
+            model_name='transactionhistory',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='transactionhistory',
+            old_name='tx_hash_bin',
+            new_name='tx_hash',
+        ),
+        migrations.AlterField(
+            model_name='transactionhistory',
+            name='tx_hash',
+            field=models.BinaryField(max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='transactionhistory',
+            name='amount_nano',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='transactionhistory',
+            constraint=models.UniqueConstraint(condition=models.Q(('lt__isnull', False)), fields=('wallet_address', 'lt'), name='uniq_tx_wallet_lt'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Шаг 1 из 3: таблица адресов и nullable-ссылки на неё из транзакций."""
+
+    dependencies = [
+        ('wallet_nalog', '0008_transactionhistory_drop_legacy_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('workchain', models.SmallIntegerField(blank=True, null=True)),
+                ('hash_part', models.BinaryField(blank=True, max_length=32, null=True)),
+                ('friendly', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Адрес',
+                'verbose_name_plural': 'Адреса',
+                'db_table': 'addresses',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('hash_part__isnull', False)), fields=('workchain', 'hash_part'), name='uniq_address_raw')],
+            },
+        ),
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='from_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='wallet_nalog.accountaddress'),
+        ),
+        migrations.AddField(
+            model_name='transactionhistory',
+            name='to_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='wallet_nalog.accountaddress'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:40
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+
+
+def parse_address(friendly):
+    from pytoniq_core import Address
+    try:
+        parsed = Address(friendly)
+        return parsed.wc, bytes(parsed.hash_part)
+    except Exception:
+        return None, None
+
+
+def backfill_accounts(apps, schema_editor):
+    """
+    Шаг 2 из 3: интернируем строки from_address/to_address пачками
+    и проставляем ссылки. Каждая пачка — отдельная короткая транзакция.
+    """
+    TransactionHistory = apps.get_model('wallet_nalog', 'TransactionHistory')
+    AccountAddress = apps.get_model('wallet_nalog', 'AccountAddress')
+
+    known = {}
+    last_pk = 0
+    while True:
+        batch = list(
+            TransactionHistory.objects
+            .filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'from_address', 'to_address')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        with transaction.atomic():
+            missing = {tx.from_address for tx in batch} | {tx.to_address for tx in batch}
+            missing = {a for a in missing if a and a not in known}
+            if missing:
+                known.update(AccountAddress.objects.filter(friendly__in=missing).values_list('friendly', 'pk'))
+                new = []
+                for friendly in missing - known.keys():
+                    workchain, hash_part = parse_address(friendly)
+                    new.append(AccountAddress(workchain=workchain, hash_part=hash_part, friendly=friendly))
+                AccountAddress.objects.bulk_create(new, ignore_conflicts=True)
+                known.update(
+                    AccountAddress.objects.filter(friendly__in=[a.friendly for a in new]).values_list('friendly', 'pk')
+                )
+
+            for tx in batch:
+                tx.from_account_id = known.get(tx.from_address)
+                tx.to_account_id = known.get(tx.to_address)
+            TransactionHistory.objects.bulk_update(batch, ['from_account', 'to_account'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('wallet_nalog', '0009_accountaddress'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_accounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Шаг 3 из 3: удаляем строковые колонки адресов. Как и 0008, требует
+    окна обслуживания: код предыдущего релиза читает эти колонки.
+    """
+
+    dependencies = [
+        ('wallet_nalog', '0010_backfill_transaction_accounts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='transactionhistory',
+            name='from_address',
+        ),
+        migrations.RemoveField(
+            model_name='transactionhistory',
+            name='to_address',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Индекс под keyset-пагинацию: сначала создаём новый, потом удаляем старый."""
+
+    dependencies = [
+        ('wallet_nalog', '0011_transactionhistory_drop_address_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['wallet_address', 'timestamp', 'id'], name='tx_wallet_ts_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='transactionhistory',
+            name='transaction_wallet__4a2f56_idx',
+        ),
+    ]
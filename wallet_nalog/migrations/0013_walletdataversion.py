@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0012_transactionhistory_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet_address', models.CharField(max_length=100, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Версия данных кошелька',
+                'verbose_name_plural': 'Версии данных кошельков',
+                'db_table': 'wallet_data_versions',
+            },
+        ),
+    ]
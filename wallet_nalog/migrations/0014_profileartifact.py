@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0013_walletdataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('wallet_address', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('endpoint', models.CharField(max_length=100)),
+                ('path', models.CharField(blank=True, max_length=500)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('duration_ms', models.FloatField()),
+                ('pstats_dump', models.BinaryField()),
+                ('collapsed_stacks', models.TextField(blank=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profiles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'db_table': 'profile_artifacts',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0014_profileartifact'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['timestamp'], name='tx_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0016_syncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_id', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('processing', 'Обрабатывается'), ('done', 'Обработана')], default='processing', max_length=10)),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Доставка уведомлений',
+                'verbose_name_plural': 'Доставки уведомлений',
+                'db_table': 'webhook_deliveries',
+                'ordering': ['-received_at'],
+            },
+        ),
+    ]
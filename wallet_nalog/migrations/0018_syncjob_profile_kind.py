@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet_nalog', '0017_webhookdelivery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='syncjob',
+            name='kind',
+            field=models.CharField(choices=[('resync', 'Обновление истории'), ('backfill', 'Полная дозагрузка истории'), ('recompute', 'Пересчёт налоговых срезов'), ('profile_tax', 'Профилирование расчёта налога')], max_length=20),
+        ),
+    ]
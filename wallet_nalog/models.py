@@ -1,11 +1,50 @@
 # wallet_app/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
 from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from django.conf import settings
+from collections import OrderedDict
+import base64
+import binascii
+import hashlib
+import threading
 import jwt
 
+from .timing import span
+
+NANOTON = Decimal('1000000000')
+
+
+def tx_hash_to_bytes(value):
+    """
+    Приводит хеш транзакции к 32 байтам.
+    Провайдеры отдают hex (tonapi), base64 (toncenter) или bytes (LiteClient).
+    Нераспознанные строки хешируются sha256, чтобы сохранить уникальность.
+    """
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value)
+        return value if len(value) == 32 else hashlib.sha256(value).digest()
+
+    value = str(value).strip()
+    if len(value) == 64:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    for decode in (base64.b64decode, base64.urlsafe_b64decode):
+        try:
+            decoded = decode(value + '=' * (-len(value) % 4))
+        except (binascii.Error, ValueError):
+            continue
+        if len(decoded) == 32:
+            return decoded
+    return hashlib.sha256(value.encode()).digest()
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -45,27 +84,272 @@ class WalletSession(models.Model):
         return f"{self.wallet_address or 'No address'} - {self.session_key}"
 
 
+class AccountAddressManager(models.Manager):
+    """
+    Get-or-create для адресов с кэшем в памяти процесса.
+    При загрузке транзакций адреса интернируются пачкой:
+    один SELECT на известные адреса и один INSERT на новые.
+    """
+    cache_size = 10000
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def _remember_many(self, items):
+        with self._cache_lock:
+            for friendly, pk in items:
+                self._cache[friendly] = pk
+                self._cache.move_to_end(friendly)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def intern_many(self, addresses):
+        """Возвращает {адрес: id} для всех непустых адресов, создавая недостающие."""
+        result = {}
+        missing = set()
+        for friendly in set(addresses):
+            if not friendly:
+                continue
+            pk = self._cache.get(friendly)
+            if pk is None:
+                missing.add(friendly)
+            else:
+                result[friendly] = pk
+
+        if missing:
+            known = dict(self.filter(friendly__in=missing).values_list('friendly', 'pk'))
+            with span('address', 'parse'):
+                new = [self.model.from_friendly(friendly) for friendly in missing if friendly not in known]
+            if new:
+                self.bulk_create(new, ignore_conflicts=True)
+                known.update(self.filter(friendly__in=[a.friendly for a in new]).values_list('friendly', 'pk'))
+            # Кэшируем только после коммита: при откате id могут оказаться недействительными
+            resolved = list(known.items())
+            transaction.on_commit(lambda: self._remember_many(resolved))
+            result.update(known)
+        return result
+
+    def intern(self, address):
+        if not address:
+            return None
+        return self.intern_many([address]).get(address)
+
+    def preload(self, addresses):
+        """Кладёт в кэш id уже известных адресов (прогрев воркера); новые не создаёт."""
+        known = list(self.filter(friendly__in={a for a in addresses if a}).values_list('friendly', 'pk'))
+        self._remember_many(known)
+        return len(known)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+
+class AccountAddress(models.Model):
+    """Интернированный адрес контрагента: workchain + hash и дружелюбная форма (UQ...)."""
+    workchain = models.SmallIntegerField(null=True, blank=True)
+    hash_part = models.BinaryField(max_length=32, null=True, blank=True)
+    friendly = models.CharField(max_length=100, unique=True)
+
+    objects = AccountAddressManager()
+
+    class Meta:
+        db_table = 'addresses'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['workchain', 'hash_part'],
+                condition=models.Q(hash_part__isnull=False),
+                name='uniq_address_raw',
+            ),
+        ]
+        verbose_name = 'Адрес'
+        verbose_name_plural = 'Адреса'
+
+    def __str__(self):
+        return self.friendly
+
+    @classmethod
+    def from_friendly(cls, friendly):
+        """Разбирает адрес; если формат не распознан, сохраняем только строку."""
+        from pytoniq_core import Address
+        try:
+            parsed = Address(friendly)
+            return cls(workchain=parsed.wc, hash_part=bytes(parsed.hash_part), friendly=friendly)
+        except Exception:
+            return cls(friendly=friendly)
+
+
 class TransactionHistory(models.Model):
+    DIRECTION_IN = 'in'
+    DIRECTION_OUT = 'out'
+    DIRECTION_SELF = 'self'
+    DIRECTION_OTHER = 'other'
+    DIRECTION_CHOICES = [
+        (DIRECTION_IN, 'Входящая'),
+        (DIRECTION_OUT, 'Исходящая'),
+        (DIRECTION_SELF, 'Перевод самому себе'),
+        (DIRECTION_OTHER, 'Не относится к кошельку'),
+    ]
+
     wallet_address = models.CharField(max_length=100)
-    tx_hash = models.CharField(max_length=100, unique=True)
+    tx_hash = models.BinaryField(max_length=32, unique=True)
+    # Логическое время транзакции; для старых записей может быть неизвестно
+    lt = models.BigIntegerField(null=True, blank=True)
     timestamp = models.DateTimeField()
-    amount = models.DecimalField(max_digits=20, decimal_places=9)
-    from_address = models.CharField(max_length=100)
-    to_address = models.CharField(max_length=100)
+    amount_nano = models.BigIntegerField(default=0)  # сумма в нанотонах
+    from_account = models.ForeignKey(
+        AccountAddress, on_delete=models.PROTECT, related_name='+', null=True, blank=True
+    )
+    to_account = models.ForeignKey(
+        AccountAddress, on_delete=models.PROTECT, related_name='+', null=True, blank=True
+    )
     status = models.CharField(max_length=20, default='completed')
+    # Направление относительно wallet_address, вычисляется при загрузке
+    direction = models.CharField(max_length=5, choices=DIRECTION_CHOICES, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'transaction_history'
         indexes = [
-            models.Index(fields=['wallet_address', 'timestamp']),
-            models.Index(fields=['tx_hash']),
+            # Ключ для keyset-пагинации истории: (timestamp, id) внутри кошелька
+            models.Index(fields=['wallet_address', 'timestamp', 'id'], name='tx_wallet_ts_id_idx'),
+            models.Index(fields=['wallet_address', 'direction', 'timestamp'], name='tx_wallet_direction_ts_idx'),
+            # Фильтр по месяцу в админке по всей таблице
+            models.Index(fields=['timestamp'], name='tx_timestamp_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['wallet_address', 'lt'],
+                condition=models.Q(lt__isnull=False),
+                name='uniq_tx_wallet_lt',
+            ),
         ]
         verbose_name = 'Транзакция'
         verbose_name_plural = 'История транзакций'
     
     def __str__(self):
-        return f"{self.tx_hash[:16]}... - {self.amount} TON"
+        return f"{self.tx_hash_hex[:16]}... - {self.amount} TON"
+
+    @property
+    def tx_hash_hex(self):
+        return bytes(self.tx_hash).hex() if self.tx_hash is not None else ''
+
+    @property
+    def amount(self):
+        """Сумма в TON."""
+        return Decimal(self.amount_nano).scaleb(-9)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_nano = int((Decimal(str(value)) * NANOTON).to_integral_value(rounding=ROUND_HALF_UP))
+
+    @property
+    def from_address(self):
+        """Адрес отправителя; для списков используйте select_related('from_account')."""
+        return self.from_account.friendly if self.from_account_id else ''
+
+    @from_address.setter
+    def from_address(self, value):
+        self.from_account_id = AccountAddress.objects.intern(value)
+
+    @property
+    def to_address(self):
+        """Адрес получателя; для списков используйте select_related('to_account')."""
+        return self.to_account.friendly if self.to_account_id else ''
+
+    @to_address.setter
+    def to_address(self, value):
+        self.to_account_id = AccountAddress.objects.intern(value)
+
+    @classmethod
+    def classify_direction(cls, wallet_address, from_address, to_address):
+        """
+        Покупка (in), продажа (out), перевод самому себе (self) или чужая операция (other).
+        Принимает как строки адресов, так и id из AccountAddress.
+        """
+        is_from_wallet = from_address == wallet_address
+        is_to_wallet = to_address == wallet_address
+        if is_from_wallet and is_to_wallet:
+            return cls.DIRECTION_SELF
+        if is_to_wallet:
+            return cls.DIRECTION_IN
+        if is_from_wallet:
+            return cls.DIRECTION_OUT
+        return cls.DIRECTION_OTHER
+
+    def save(self, *args, **kwargs):
+        self.tx_hash = tx_hash_to_bytes(self.tx_hash)
+        if not self.direction:
+            self.direction = self.classify_direction(self.wallet_address, self.from_address, self.to_address)
+        super().save(*args, **kwargs)
+
+
+class MonthlyTaxSnapshot(models.Model):
+    """
+    Материализованный расчёт налога за завершённый месяц.
+    Хранит итоги в TON, детализацию операций и остаток FIFO-пула покупок
+    на конец месяца, чтобы следующий месяц считался без пересчёта истории.
+    Суммы в USD не хранятся — они зависят от текущего курса.
+    """
+    wallet_address = models.CharField(max_length=100)
+    period = models.DateField()  # первое число месяца
+    total_sent_ton = models.DecimalField(max_digits=20, decimal_places=9, default=0)
+    total_tax_ton = models.DecimalField(max_digits=20, decimal_places=9, default=0)
+    transactions_count = models.PositiveIntegerField(default=0)
+    transactions = models.JSONField(default=list)
+    closing_lots = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'monthly_tax_snapshots'
+        constraints = [
+            models.UniqueConstraint(fields=['wallet_address', 'period'], name='uniq_snapshot_wallet_period'),
+        ]
+        verbose_name = 'Налоговый срез за месяц'
+        verbose_name_plural = 'Налоговые срезы по месяцам'
+
+    def __str__(self):
+        return f"{self.wallet_address} - {self.period:%Y-%m}"
+
+
+class WalletDataVersion(models.Model):
+    """
+    Версия данных кошелька. Увеличивается при каждой загрузке новых
+    транзакций и служит основой ETag для эндпоинтов чтения:
+    пока версия не изменилась, клиент получает 304 без пересчёта.
+    """
+    wallet_address = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'wallet_data_versions'
+        verbose_name = 'Версия данных кошелька'
+        verbose_name_plural = 'Версии данных кошельков'
+
+    def __str__(self):
+        return f"{self.wallet_address} v{self.version}"
+
+    @classmethod
+    def bump(cls, wallet_address):
+        """Атомарно увеличивает версию (UPDATE ... SET version = version + 1)."""
+        now = timezone.now()
+        updated = cls.objects.filter(wallet_address=wallet_address).update(
+            version=models.F('version') + 1, updated_at=now
+        )
+        if not updated:
+            _, created = cls.objects.get_or_create(
+                wallet_address=wallet_address, defaults={'version': 1, 'updated_at': now}
+            )
+            if not created:
+                cls.objects.filter(wallet_address=wallet_address).update(
+                    version=models.F('version') + 1, updated_at=now
+                )
+
+    @classmethod
+    def current(cls, wallet_address):
+        """(version, updated_at); для кошелька без данных — (0, None)."""
+        row = cls.objects.filter(wallet_address=wallet_address).values_list('version', 'updated_at').first()
+        return row if row is not None else (0, None)
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -184,4 +468,116 @@ class User(AbstractBaseUser, PermissionsMixin):
             self.wallet.wallet_address = None
             self.wallet.wallet_type = None
             self.wallet.connected = False
-            self.wallet.save()
\ No newline at end of file
+            self.wallet.save()
+
+
+class ProfileArtifact(models.Model):
+    """
+    Профиль одного запроса (или расчёта из админки), снятый по ?__profile=1.
+
+    pstats_dump — статистика cProfile в формате pstats (открывается через
+    pstats.Stats, snakeviz); collapsed_stacks — сэмплы стеков в формате
+    «a;b;c N» для flamegraph.pl и speedscope.
+    """
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='profiles')
+    wallet_address = models.CharField(max_length=100, blank=True, db_index=True)
+    endpoint = models.CharField(max_length=100)
+    path = models.CharField(max_length=500, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField()
+    pstats_dump = models.BinaryField()
+    collapsed_stacks = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'profile_artifacts'
+        ordering = ['-created_at']
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+
+    def __str__(self):
+        return f"{self.endpoint} {self.wallet_address or '-'} {self.duration_ms:.0f} мс"
+
+
+class SyncJob(models.Model):
+    """
+    Фоновая задача, поставленная из админки: загрузка истории кошелька,
+    пересчёт налоговых срезов или профилирование расчёта налога. Выполняется пулом из jobs.py,
+    прогресс и результат видны в админке.
+    """
+    KIND_RESYNC = 'resync'
+    KIND_BACKFILL = 'backfill'
+    KIND_RECOMPUTE = 'recompute'
+    KIND_PROFILE = 'profile_tax'
+    KIND_CHOICES = [
+        (KIND_RESYNC, 'Обновление истории'),
+        (KIND_BACKFILL, 'Полная дозагрузка истории'),
+        (KIND_RECOMPUTE, 'Пересчёт налоговых срезов'),
+        (KIND_PROFILE, 'Профилирование расчёта налога'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_SUCCEEDED, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    wallet_address = models.CharField(max_length=100)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)  # проценты
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'sync_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='sync_job_status_idx'),
+            models.Index(fields=['wallet_address', 'kind', 'status'], name='sync_job_wallet_idx'),
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.wallet_address} ({self.get_status_display()})"
+
+
+class WebhookDelivery(models.Model):
+    """
+    Принятая пачка уведомлений о транзакциях (webhooks.py).
+    Уникальный delivery_id делает повторную доставку той же пачки безопасной:
+    её не обрабатывают второй раз, а отдают сохранённый результат.
+    """
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Обрабатывается'),
+        (STATUS_DONE, 'Обработана'),
+    ]
+
+    delivery_id = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PROCESSING)
+    events = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'webhook_deliveries'
+        ordering = ['-received_at']
+        verbose_name = 'Доставка уведомлений'
+        verbose_name_plural = 'Доставки уведомлений'
+
+    def __str__(self):
+        return f"{self.delivery_id} ({self.get_status_display()})"
@@ -0,0 +1,153 @@
+"""
+Разбор транзакций в пуле процессов для больших дозагрузок истории.
+
+Разбор ответа провайдера (нормализация адресов, обход сообщений, даты)
+нагружает процессор и держит GIL. При полной дозагрузке сотни страниц
+разбираются на одном ядре, пока сеть простаивает. С PARSE_WORKERS > 0
+страницы раздаются ProcessPoolExecutor. Обратно приходят компактные
+записи (tx_hash, timestamp, amount_nano, lt, адреса), а не исходные словари.
+
+Стадии связаны с обратным давлением:
+- в пуле одновременно не больше PARSE_MAX_IN_FLIGHT страниц;
+- следующая страница берётся у загрузки, только когда освободилось место;
+- результаты отдаются записи по порядку, и пока запись занята, новые
+  страницы в пул не уходят.
+
+Процессы пула запускаются через spawn. Форк многопоточного воркера
+(пул задач, подписчик кэша, прогрев) небезопасен. Через PARSE_WORKERS = 0
+(по умолчанию) страницы разбираются в текущем процессе.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _workers():
+    return max(0, int(getattr(settings, 'PARSE_WORKERS', 0)))
+
+
+def _max_in_flight():
+    return max(1, int(getattr(settings, 'PARSE_MAX_IN_FLIGHT', 2 * max(1, _workers()))))
+
+
+def _chunk_size():
+    return max(1, int(getattr(settings, 'PARSE_CHUNK_SIZE', 200)))
+
+
+def _init_worker():
+    import django
+    from django.conf import settings as worker_settings
+
+    # Процесс пула только разбирает транзакции: прогрев и подключения ему не нужны
+    worker_settings.WARMUP_ON_START = False
+    django.setup()
+
+
+def _parse_page(wallet_address, transactions):
+    from .tonservice import parse_transactions
+
+    return parse_transactions(wallet_address, transactions)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=_workers(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def shutdown():
+    """Останавливает пул (тесты, смена PARSE_WORKERS)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def chunked(transactions, size=None):
+    """Режет готовый список транзакций на страницы по PARSE_CHUNK_SIZE."""
+    size = size or _chunk_size()
+    for start in range(0, len(transactions), size):
+        yield transactions[start:start + size]
+
+
+def _picklable(page):
+    # Объекты LiteClient в другой процесс не передаются — их разбираем на месте
+    return all(isinstance(tx, dict) for tx in page)
+
+
+def parse_pages(wallet_address, pages, max_in_flight=None):
+    """
+    Генератор (записи, счётчики) по страницам в исходном порядке.
+    pages — любой итератор страниц; он читается не дальше, чем позволяет
+    max_in_flight (по умолчанию PARSE_MAX_IN_FLIGHT).
+    """
+    from .tonservice import parse_transactions
+
+    if not _workers():
+        for page in pages:
+            yield parse_transactions(wallet_address, page)
+        return
+
+    executor = _get_executor()
+    max_in_flight = max_in_flight or _max_in_flight()
+    pending = deque()
+    try:
+        for page in pages:
+            if _picklable(page):
+                pending.append(executor.submit(_parse_page, wallet_address, page))
+            else:
+                pending.append(parse_transactions(wallet_address, page))
+            while len(pending) >= max_in_flight:
+                yield _result(pending.popleft())
+        while pending:
+            yield _result(pending.popleft())
+    finally:
+        # Запись прервалась — недоразобранные страницы не нужны
+        for item in pending:
+            if not isinstance(item, tuple):
+                item.cancel()
+
+
+def _result(item):
+    return item if isinstance(item, tuple) else item.result()
+
+
+def ingest_pages(wallet_address, pages, refresh_snapshots=True):
+    """
+    Загрузка → разбор → запись: каждая разобранная страница сразу пишется
+    в БД, Bloom-фильтр и налоговые срезы обновляются один раз в конце.
+    Возвращает {'fetched': ..., 'saved': ...}.
+    """
+    from . import bloom
+    from .tonservice import _normalize_address, refresh_snapshots_since, store_records
+
+    fetched = saved = 0
+    earliest = None
+    with bloom.deferred(_normalize_address(wallet_address)):
+        for records, stats in parse_pages(wallet_address, pages):
+            fetched += stats['total']
+            page_saved, page_earliest = store_records(wallet_address, records, stats, refresh_snapshots=False)
+            saved += page_saved
+            if page_earliest is not None and (earliest is None or page_earliest < earliest):
+                earliest = page_earliest
+
+    if saved and refresh_snapshots:
+        refresh_snapshots_since(_normalize_address(wallet_address), earliest)
+    logger.info("Дозагрузка %s: разобрано %d, сохранено %d (процессов разбора %d)", wallet_address, fetched, saved, _workers())
+    return {'fetched': fetched, 'saved': saved}
@@ -0,0 +1,195 @@
+"""
+Сервис курса TON/USD.
+
+Курс кэшируется в двухуровневом кэше (L1 процесса + Redis, см. tiered_cache),
+а при недоступном Redis — ещё и в памяти процесса; свежим считается
+TON_PRICE_CACHE_TTL секунд. Незадолго до истечения TTL курс обновляется
+в фоновом потоке, поэтому запросы к налоговым эндпоинтам не ждут CoinGecko.
+Если внешний API недоступен, отдаём последнее известное значение
+с флагом stale=True.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from django.conf import settings
+import json
+import logging
+import threading
+import time
+
+from .metrics import SYNC_FAILURES, cache_hit, cache_miss, provider_timer, track_background_thread
+from .timing import span
+from .tiered_cache import tiered_cache
+
+logger = logging.getLogger(__name__)
+
+COINGECKO_PRICE_URL = 'https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd'
+PRICE_CACHE_KEY = 'ton:price:usd'
+
+# Запасной курс, если API недоступно и в кэше ничего нет
+FALLBACK_PRICE_USD = Decimal('5.0')
+
+# Последнее известное значение храним в Redis дольше TTL,
+# чтобы было что отдать при недоступности CoinGecko
+LAST_KNOWN_PRICE_KEEP_SECONDS = 7 * 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class PriceQuote:
+    price: Decimal
+    fetched_at: float
+    stale: bool = False
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+_lock = threading.Lock()
+_memory_quote = None
+_refresh_in_progress = False
+_last_failure_at = 0.0
+
+
+def _cache_ttl():
+    return getattr(settings, 'TON_PRICE_CACHE_TTL', 60)
+
+
+def _refresh_ahead():
+    """Доля TTL, после которой курс обновляется в фоне."""
+    return getattr(settings, 'TON_PRICE_REFRESH_AHEAD', 0.8)
+
+
+def _retry_after():
+    return getattr(settings, 'TON_PRICE_RETRY_AFTER', 30)
+
+
+def _http_timeout():
+    return getattr(settings, 'TON_PRICE_HTTP_TIMEOUT', 5)
+
+
+def _read_cached_quote():
+    cached = tiered_cache.get(PRICE_CACHE_KEY, _cache_ttl())
+    if cached:
+        try:
+            data = json.loads(cached)
+            return PriceQuote(Decimal(data['price']), float(data['fetched_at']))
+        except Exception as e:
+            logger.warning(f"Ошибка чтения курса TON из кэша: {e}")
+    return _memory_quote
+
+
+def _store_quote(quote):
+    global _memory_quote
+    _memory_quote = quote
+    tiered_cache.set(
+        PRICE_CACHE_KEY,
+        json.dumps({'price': str(quote.price), 'fetched_at': quote.fetched_at}),
+        LAST_KNOWN_PRICE_KEEP_SECONDS,
+    )
+
+
+def fetch_ton_price_usd():
+    """
+    Запрос курса к CoinGecko без кэша.
+    Возвращает Decimal или None, если API недоступно.
+    """
+    global _last_failure_at
+    import requests
+
+    try:
+        with span('http', 'coingecko'), provider_timer('coingecko'):
+            response = requests.get(COINGECKO_PRICE_URL, timeout=_http_timeout())
+        if response.status_code == 200:
+            price = response.json().get('the-open-network', {}).get('usd')
+            if price:
+                return Decimal(str(price))
+        logger.warning(f"CoinGecko вернул статус {response.status_code}")
+    except Exception as e:
+        logger.warning(f"Ошибка при получении курса TON/USD: {e}")
+    SYNC_FAILURES.labels(stage='price').inc()
+    _last_failure_at = time.time()
+    return None
+
+
+def refresh_ton_price():
+    """Синхронно обновляет курс в кэше. Возвращает новый PriceQuote или None."""
+    price = fetch_ton_price_usd()
+    if price is None:
+        return None
+    quote = PriceQuote(price, time.time())
+    _store_quote(quote)
+    return quote
+
+
+def _refresh_in_background():
+    global _refresh_in_progress
+    with _lock:
+        if _refresh_in_progress:
+            return
+        _refresh_in_progress = True
+
+    def worker():
+        global _refresh_in_progress
+        try:
+            with track_background_thread('price_refresh'):
+                refresh_ton_price()
+        finally:
+            _refresh_in_progress = False
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+def get_ton_price():
+    """
+    Текущий курс TON/USD в виде PriceQuote.
+
+    - свежий курс отдаём из кэша;
+    - после TON_PRICE_REFRESH_AHEAD * TTL запускаем фоновое обновление
+      и отдаём закэшированное значение;
+    - после истечения TTL обновляем синхронно, а если CoinGecko недоступен —
+      отдаём последнее известное значение с stale=True
+      (повторная попытка не раньше чем через TON_PRICE_RETRY_AFTER секунд).
+    """
+    ttl = _cache_ttl()
+    quote = _read_cached_quote()
+
+    if quote is not None:
+        age = quote.age
+        if age < ttl * _refresh_ahead():
+            cache_hit('price')
+            return quote
+        if age < ttl:
+            cache_hit('price')
+            _refresh_in_background()
+            return quote
+
+    cache_miss('price')
+    fresh = None
+    if time.time() - _last_failure_at >= _retry_after():
+        fresh = refresh_ton_price()
+    if fresh is not None:
+        return fresh
+    if quote is not None:
+        return PriceQuote(quote.price, quote.fetched_at, stale=True)
+    return PriceQuote(FALLBACK_PRICE_USD, 0.0, stale=True)
+
+
+def peek_ton_price():
+    """
+    Закэшированный курс без обращения к CoinGecko или None, если кэш пуст.
+    Курс старше TON_PRICE_CACHE_TTL помечается stale=True.
+    """
+    quote = _read_cached_quote()
+    if quote is None:
+        return None
+    if quote.age >= _cache_ttl():
+        return PriceQuote(quote.price, quote.fetched_at, stale=True)
+    return quote
+
+
+def reset_price_cache():
+    """Сбрасывает закэшированный курс (используется в тестах)."""
+    global _memory_quote, _last_failure_at
+    _memory_quote = None
+    _last_failure_at = 0.0
+    tiered_cache.delete(PRICE_CACHE_KEY)
@@ -0,0 +1,102 @@
+"""
+Профилирование по запросу.
+
+profile_call запускает функцию под cProfile и одновременно снимает сэмплы
+стека вызывающего потока. Результат сохраняется в ProfileArtifact:
+pstats-дамп для детального разбора и свёрнутые стеки для flame graph.
+
+Используется ProfilingMiddleware (?__profile=1 у staff-пользователя)
+и действием «Профилировать расчёт налога» в админке кошельков.
+"""
+from collections import Counter
+import cProfile
+import marshal
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .models import ProfileArtifact
+
+
+def _sample_interval():
+    return getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.005)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    # co_qualname появился в Python 3.11, на 3.10 — только имя функции
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """
+    Сэмплирующий профайлер: фоновый поток раз в interval секунд снимает
+    стек целевого потока через sys._current_frames и считает одинаковые стеки.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        own_frame = sys._getframe()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not own_frame:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Свёрнутые стеки: по строке «корень;...;лист количество»."""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def profile_call(func, *args, **kwargs):
+    """
+    Вызывает func под профайлером.
+    Возвращает (результат, секунды, pstats-дамп, свёрнутые стеки).
+    """
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), _sample_interval())
+    sampler.start()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - started
+        sampler.stop()
+
+    # Тот же формат, что у pstats.Stats.dump_stats: читается pstats.Stats(path)
+    profiler.create_stats()
+    return result, seconds, marshal.dumps(profiler.stats), sampler.collapsed()
+
+
+def save_profile(*, endpoint, seconds, pstats_dump, collapsed_stacks, user=None, wallet_address='', path='', status_code=None):
+    return ProfileArtifact.objects.create(
+        user=user,
+        wallet_address=wallet_address or '',
+        endpoint=endpoint[:100],
+        path=path[:500],
+        status_code=status_code,
+        duration_ms=round(seconds * 1000, 2),
+        pstats_dump=pstats_dump,
+        collapsed_stacks=collapsed_stacks,
+    )
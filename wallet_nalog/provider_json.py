@@ -0,0 +1,92 @@
+"""
+Потоковый разбор ответов провайдеров истории (TON API, TON Center).
+
+response.json() строит полное дерево ответа. У транзакции TON API это
+сообщения с raw_body и decoded_body, фазы исполнения и BOC в raw, а для
+записи нужны только хеш, lt, время, суммы и адреса. Здесь тело ответа
+читается из сокета по событиям ijson. Для каждой транзакции собирается
+словарь только из полей TRANSACTION_FIELDS, а остальное пропускается, не
+создавая объектов. Форма записи та же, что у полного ответа, поэтому
+tx_hash_bytes и parse_transaction работают с ней без изменений.
+"""
+import ijson
+
+# Поля транзакции, которые читают tx_hash_bytes, parse_transaction и
+# пагинация TON Center (пути через точку, item — элемент списка)
+TRANSACTION_FIELDS = (
+    'hash', 'tx_hash', 'lt', 'utime', 'now', 'timestamp',
+    'transaction_id.lt', 'transaction_id.hash',
+    'prev_transaction_id.lt', 'prev_transaction_id.hash',
+    'in_msg.value', 'in_msg.amount', 'in_msg.source', 'in_msg.source.address',
+    'out_msgs.item.value', 'out_msgs.item.amount',
+    'out_msgs.item.destination', 'out_msgs.item.destination.address',
+    'actions.item.type', 'actions.item.TonTransfer.amount',
+    'actions.item.sender.address', 'actions.item.recipient.address',
+)
+
+_SCALAR_EVENTS = frozenset(('null', 'boolean', 'integer', 'double', 'number', 'string'))
+
+
+def _paths(fields, item_prefix):
+    """
+    Полные пути ijson, которые нужно строить, и для каждой нужной
+    карты — допустимые ключи. Строки собираются заранее, чтобы в цикле по
+    событиям не резать и не склеивать префиксы.
+    """
+    wanted = {item_prefix}
+    keys = {}
+    for field in fields:
+        parent = item_prefix
+        for part in field.split('.'):
+            path = f'{parent}.{part}'
+            wanted.add(path)
+            if part != 'item':
+                keys.setdefault(parent, set()).add(part)
+            parent = path
+    return frozenset(wanted), {prefix: frozenset(names) for prefix, names in keys.items()}
+
+
+def read_items(stream, items_path, fields=TRANSACTION_FIELDS):
+    """
+    Читает JSON из файлоподобного stream. Возвращает (элементы, meta):
+    элементы — список по пути items_path (например, 'transactions' или
+    'result'), в каждом только поля fields; meta — скалярные поля верхнего
+    уровня (ok, error, code).
+    """
+    item_prefix = f'{items_path}.item'
+    wanted, keys = _paths(fields, item_prefix)
+    items = []
+    meta = {}
+    builder = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None:
+            if prefix == item_prefix and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix and '.' not in prefix and event in _SCALAR_EVENTS:
+                meta[prefix] = value
+            continue
+
+        # Ненужное поддерево отсекается на своём ключе: пути внутри него
+        # не входят в wanted
+        if event == 'map_key':
+            names = keys.get(prefix)
+            if names is None or value not in names:
+                continue
+        elif prefix not in wanted:
+            continue
+        elif prefix == item_prefix and event == 'end_map':
+            builder.event(event, value)
+            items.append(builder.value)
+            builder = None
+            continue
+        builder.event(event, value)
+
+    return items, meta
+
+
+def response_items(response, items_path, fields=TRANSACTION_FIELDS):
+    """read_items по телу ответа requests, открытого с stream=True."""
+    response.raw.decode_content = True
+    return read_items(response.raw, items_path, fields)
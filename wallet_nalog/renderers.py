@@ -1,14 +1,59 @@
-import json
-from rest_framework.renderers import JSONRenderer  
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Decimal, lazy-строки, QuerySet, bytes и т.п. приводим так же, как DRF
+_drf_encoder = JSONEncoder()
+
+
+def _default(obj):
+    return _drf_encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    JSON-рендерер на orjson: сериализует большие налоговые ответы и списки
+    транзакций в несколько раз быстрее стандартного json.
+    Типы, которые orjson не знает, приводятся через JSONEncoder из DRF.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        # Отступы по запросу клиента: Accept: application/json; indent=2
+        if accepted_media_type and 'indent' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Бинарный ответ для клиентов, приславших Accept: application/msgpack."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class UserJSONRenderer(ORJSONRenderer):
+    """Рендерер эндпоинтов авторизации: декодирует токены, если они пришли в bytes."""
 
-class UserJSONRenderer(JSONRenderer):
-    charset = 'utf-8'
-    
     def render(self, data, media_type=None, renderer_context=None):
         token = data.get('token', None)
         if token is not None and isinstance(token, bytes):
             data['token'] = token.decode('utf-8')
-        
+
         tokens = data.get('tokens', None)
         if tokens is not None:
             if isinstance(tokens, dict):
@@ -16,6 +61,5 @@ class UserJSONRenderer(JSONRenderer):
                     tokens['access'] = tokens['access'].decode('utf-8')
                 if 'refresh' in tokens and isinstance(tokens['refresh'], bytes):
                     tokens['refresh'] = tokens['refresh'].decode('utf-8')
-        
-        return super().render(data, media_type, renderer_context)
 
+        return super().render(data, media_type, renderer_context)
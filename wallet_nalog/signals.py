@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user_cache, invalidate_wallet_cache
+from .models import User, WalletSession
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    """Сбрасываем закэшированного для аутентификации пользователя."""
+    invalidate_user_cache(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=WalletSession)
+def drop_cached_wallet_owner(sender, instance, **kwargs):
+    """Пользователь кэшируется вместе с кошельком — сбрасываем и его."""
+    invalidate_wallet_cache(instance.pk)
@@ -1,9 +1,71 @@
 // API Client with automatic token refresh
 class APIClient {
+    static MSGPACK_DECODER_URL = 'https://unpkg.com/@msgpack/msgpack@2.8.0';
+
     constructor() {
         this.baseURL = window.location.origin + '/api';
         this.accessToken = localStorage.getItem('access_token');
         this.refreshToken = localStorage.getItem('refresh_token');
+        // MessagePack is opt-in: the decoder bundle is loaded only after the user enables it
+        this.preferMsgpack = false;
+        // Bodies of GET responses keyed by format + URL, revalidated with If-None-Match
+        this.etagCache = new Map();
+        this.etagCacheLimit = 100;
+        this.msgpackLoading = null;
+        if (localStorage.getItem('prefer_msgpack') === '1') {
+            this.setPreferMsgpack(true);
+        }
+    }
+
+    msgpackAvailable() {
+        return typeof MessagePack !== 'undefined' && typeof MessagePack.decode === 'function';
+    }
+
+    // Loads the @msgpack/msgpack browser bundle (global MessagePack) once
+    loadMsgpack() {
+        if (this.msgpackAvailable()) {
+            return Promise.resolve();
+        }
+        if (!this.msgpackLoading) {
+            this.msgpackLoading = new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                script.src = APIClient.MSGPACK_DECODER_URL;
+                script.crossOrigin = 'anonymous';
+                script.onload = () => resolve();
+                script.onerror = () => {
+                    this.msgpackLoading = null;
+                    reject(new Error('Failed to load the MessagePack decoder'));
+                };
+                document.head.appendChild(script);
+            });
+        }
+        return this.msgpackLoading;
+    }
+
+    // Until the decoder is loaded requests keep asking for JSON
+    async setPreferMsgpack(enabled) {
+        localStorage.setItem('prefer_msgpack', enabled ? '1' : '0');
+        if (!enabled) {
+            this.preferMsgpack = false;
+            return false;
+        }
+        try {
+            await this.loadMsgpack();
+            this.preferMsgpack = this.msgpackAvailable();
+        } catch (error) {
+            console.warn('MessagePack disabled:', error.message);
+            this.preferMsgpack = false;
+        }
+        return this.preferMsgpack;
+    }
+
+    // Decodes the body according to Content-Type (JSON or MessagePack)
+    async readBody(response) {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('application/msgpack')) {
+            return MessagePack.decode(new Uint8Array(await response.arrayBuffer()));
+        }
+        return response.json();
     }
 
     async refreshAccessToken() {
@@ -53,6 +115,10 @@ class APIClient {
             options.headers['Authorization'] = `Bearer ${this.accessToken}`;
         }
 
+        if (this.preferMsgpack && !options.headers['Accept']) {
+            options.headers['Accept'] = 'application/msgpack, application/json;q=0.9';
+        }
+
         let response = await fetch(url, options);
 
         // If token expired, try to refresh
@@ -75,6 +141,37 @@ class APIClient {
         return response;
     }
 
+    // GET with conditional revalidation: on 304 the previously received body is returned
+    async fetchCached(url) {
+        const key = `${this.preferMsgpack ? 'msgpack' : 'json'} ${url}`;
+        const cached = this.etagCache.get(key);
+        const options = { cache: 'no-store', headers: {} };
+        if (cached) {
+            options.headers['If-None-Match'] = cached.etag;
+        }
+
+        const response = await this.fetchWithAuth(url, options);
+
+        if (response.status === 304 && cached) {
+            // Move to the end of the Map to keep LRU order
+            this.etagCache.delete(key);
+            this.etagCache.set(key, cached);
+            const revalidated = new Response(null, { status: 200, statusText: 'Not Modified', headers: response.headers });
+            return { response: revalidated, data: cached.data, notModified: true };
+        }
+
+        const data = await this.readBody(response);
+        const etag = response.headers.get('ETag');
+        this.etagCache.delete(key);
+        if (response.ok && etag) {
+            this.etagCache.set(key, { etag, data });
+            while (this.etagCache.size > this.etagCacheLimit) {
+                this.etagCache.delete(this.etagCache.keys().next().value);
+            }
+        }
+        return { response, data };
+    }
+
     async register(email, password, passwordConfirm) {
         const response = await fetch(`${this.baseURL}/register/`, {
             method: 'POST',
@@ -110,7 +207,7 @@ class APIClient {
 
     async getWallet() {
         const response = await this.fetchWithAuth(`${this.baseURL}/Wallet/`);
-        const data = await response.json();
+        const data = await this.readBody(response);
         return { response, data };
     }
 
@@ -126,55 +223,71 @@ class APIClient {
             })
         });
 
-        const data = await response.json();
+        const data = await this.readBody(response);
         return { response, data };
     }
 
-    async getBalance() {
-        const response = await this.fetchWithAuth(`${this.baseURL}/wallet/balance/`);
-        const data = await response.json();
+    // Wallet, balance, first transactions page, tax totals and price in one request
+    async getDashboard() {
+        const response = await this.fetchWithAuth(`${this.baseURL}/dashboard/`);
+        const data = await this.readBody(response);
         return { response, data };
     }
 
-    async getTransactions(refresh = false) {
-        const url = refresh 
-            ? `${this.baseURL}/wallet/transactions/?refresh=true`
-            : `${this.baseURL}/wallet/transactions/`;
-        const response = await this.fetchWithAuth(url);
-        const data = await response.json();
-        return { response, data };
+    async getBalance() {
+        return this.fetchCached(`${this.baseURL}/wallet/balance/`);
     }
 
-    async getTaxForMonth(year, month) {
-        const response = await this.fetchWithAuth(
-            `${this.baseURL}/tax/month/?year=${encodeURIComponent(year)}&month=${encodeURIComponent(month)}`
+    async getTransactions(refresh = false, { before = null, limit = null } = {}) {
+        const params = new URLSearchParams();
+        if (refresh) params.set('refresh', 'true');
+        if (before) params.set('before', before);
+        if (limit) params.set('limit', String(limit));
+        const query = params.toString();
+        const url = `${this.baseURL}/wallet/transactions/${query ? `?${query}` : ''}`;
+        return this.fetchCached(url);
+    }
+
+    // detail: 'none' | 'sells' | 'all'. The UI only shows totals, so it asks for 'none'
+    // and fetches per-operation detail separately via getTaxMonthTransactions.
+    async getTaxForMonth(year, month, { detail = 'none', fields = null } = {}) {
+        const params = new URLSearchParams({ year, month });
+        if (detail) params.append('detail', detail);
+        if (fields) params.append('fields', fields.join(','));
+        return this.fetchCached(
+            `${this.baseURL}/tax/month/?${params.toString()}`
+        );
+    }
+
+    async getTaxMonthTransactions(year, month, { detail = 'all', offset = 0, limit = 100 } = {}) {
+        const params = new URLSearchParams({ year, month, detail, offset, limit });
+        return this.fetchCached(
+            `${this.baseURL}/tax/month/transactions/?${params.toString()}`
         );
-        const data = await response.json();
-        return { response, data };
     }
 
-    async getTaxForAllMonths(startYear = null, startMonth = null) {
+    async getTaxForAllMonths(startYear = null, startMonth = null, { detail = 'none', fields = null } = {}) {
         const params = new URLSearchParams();
         if (startYear) params.append('start_year', startYear);
         if (startMonth) params.append('start_month', startMonth);
+        if (detail) params.append('detail', detail);
+        if (fields) params.append('fields', fields.join(','));
         
-        const response = await this.fetchWithAuth(
+        return this.fetchCached(
             `${this.baseURL}/tax/all/?${params.toString()}`
         );
-        const data = await response.json();
-        return { response, data };
     }
 
-    async getTotalTax(startYear = null, startMonth = null) {
+    async getTotalTax(startYear = null, startMonth = null, { detail = 'none', fields = null } = {}) {
         const params = new URLSearchParams();
         if (startYear) params.append('start_year', startYear);
         if (startMonth) params.append('start_month', startMonth);
+        if (detail) params.append('detail', detail);
+        if (fields) params.append('fields', fields.join(','));
         
-        const response = await this.fetchWithAuth(
+        return this.fetchCached(
             `${this.baseURL}/tax/total/?${params.toString()}`
         );
-        const data = await response.json();
-        return { response, data };
     }
 
     logout() {
@@ -182,6 +295,7 @@ class APIClient {
         this.refreshToken = null;
         localStorage.removeItem('access_token');
         localStorage.removeItem('refresh_token');
+        this.etagCache.clear();
     }
 }
 
@@ -59,20 +59,19 @@ async function checkAuth() {
     if (loadingScreen) loadingScreen.classList.add('hidden');
 }
 
-// Check wallet connection
+// Check wallet connection (first paint comes from a single /dashboard/ request)
 async function checkWalletConnection() {
     try {
-        const { response, data } = await api.getWallet();
+        const { response, data } = await api.getDashboard();
+        const wallet = response.ok ? data.wallet : null;
         
-        if (response.ok && data.connected) {
-            walletAddress = data.wallet_address;
+        if (wallet && wallet.connected) {
+            walletAddress = wallet.wallet_address;
             updateWalletStatus(true);
             document.getElementById('wallet-address').textContent = 
                 formatAddress(walletAddress);
             document.getElementById('wallet-status-text').textContent = 'Активен';
-            await loadBalance();
-            // Auto-load transactions if wallet is connected
-            await loadTransactions();
+            await applyDashboard(data);
         } else {
             updateWalletStatus(false);
             document.getElementById('wallet-address').textContent = 'Не подключен';
@@ -84,6 +83,35 @@ async function checkWalletConnection() {
     }
 }
 
+// Fill the dashboard from /dashboard/ sections; a failed section falls back to its own endpoint
+async function applyDashboard(data) {
+    const balance = data.balance || {};
+    if (balance.ok) {
+        document.getElementById('balance-value').textContent = 
+            `${parseFloat(balance.data.balance_ton).toFixed(2)} TON`;
+        document.getElementById('wallet-status-text').textContent = 
+            balance.data.is_active ? 'Активен' : 'Неактивен';
+    } else {
+        console.error('Error loading balance:', balance.error);
+    }
+
+    const tax = data.tax || {};
+    if (tax.ok) {
+        document.getElementById('total-tax').textContent = 
+            `${(tax.data.total_tax_ton || 0).toFixed(2)} TON`;
+    } else {
+        console.error('Error loading tax totals:', tax.error);
+    }
+
+    const transactions = data.transactions || {};
+    if (transactions.ok && transactions.data.transactions.length > 0) {
+        showTransactionsFirstPage(transactions.data);
+    } else {
+        // Empty DB or error: the transactions endpoint knows how to load history from the chain
+        await loadTransactions();
+    }
+}
+
 // Update wallet status UI
 function updateWalletStatus(connected) {
     const statusDot = document.querySelector('.status-dot');
@@ -461,57 +489,195 @@ async function loadBalance() {
     }
 }
 
-// Load transactions
+// Transactions list: cursor pagination + virtualized rendering
+const TX_PAGE_SIZE = 50;
+const TX_ROW_HEIGHT = 96;
+const TX_OVERSCAN = 6;
+// Start loading the next page when this many pixels are left to the bottom
+const TX_PREFETCH_PX = TX_ROW_HEIGHT * 10;
+
+const txList = {
+    items: [],
+    nextCursor: null,
+    hasMore: false,
+    loading: false,
+    // Bumped on every reload so late responses of a previous list are dropped
+    generation: 0,
+    viewport: null,
+    spacer: null,
+    rows: null,
+    renderedRange: null,
+};
+
+function renderTransactionsEmpty(container, title, message) {
+    container.innerHTML = `
+        <div class="empty-state">
+            <svg width="64" height="64" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5">
+                <path d="M21 12H3M16 6l6 6-6 6M8 6l-6 6 6 6"></path>
+            </svg>
+            <h3>${title}</h3>
+            <p>${message}</p>
+        </div>
+    `;
+}
+
+function renderTransactionsError(container, title, message) {
+    container.innerHTML = `
+        <div class="empty-state">
+            <h3>${title}</h3>
+            <p>${message}</p>
+        </div>
+    `;
+}
+
+function mountTransactionsViewport(container) {
+    container.innerHTML = `
+        <div class="transactions-viewport">
+            <div class="transactions-spacer">
+                <div class="transactions-rows"></div>
+            </div>
+            <div class="transactions-footer hidden"><div class="loading-spinner"></div></div>
+        </div>
+    `;
+    txList.viewport = container.querySelector('.transactions-viewport');
+    txList.spacer = container.querySelector('.transactions-spacer');
+    txList.rows = container.querySelector('.transactions-rows');
+    txList.renderedRange = null;
+    txList.viewport.addEventListener('scroll', onTransactionsScroll, { passive: true });
+}
+
+// Only the rows inside the visible window (plus overscan) exist in the DOM
+function renderVisibleTransactions(force = false) {
+    const { viewport, spacer, rows, items } = txList;
+    if (!viewport) return;
+
+    spacer.style.height = `${items.length * TX_ROW_HEIGHT}px`;
+
+    const first = Math.max(0, Math.floor(viewport.scrollTop / TX_ROW_HEIGHT) - TX_OVERSCAN);
+    // A hidden page has clientHeight 0: assume a full window so the list is ready when shown
+    const viewportHeight = viewport.clientHeight || window.innerHeight;
+    const visibleCount = Math.ceil(viewportHeight / TX_ROW_HEIGHT) + TX_OVERSCAN * 2;
+    const last = Math.min(items.length, first + visibleCount);
+
+    const range = txList.renderedRange;
+    if (!force && range && range.first === first && range.last === last) return;
+    txList.renderedRange = { first, last };
+
+    const wallet = normalizeAddress(walletAddress);
+    const fragment = document.createDocumentFragment();
+    for (let i = first; i < last; i++) {
+        const tx = items[i];
+        const isOutgoing = normalizeAddress(tx.from_address) === wallet;
+        fragment.appendChild(createTransactionElement(tx, isOutgoing));
+    }
+    rows.style.transform = `translateY(${first * TX_ROW_HEIGHT}px)`;
+    rows.replaceChildren(fragment);
+}
+
+function onTransactionsScroll() {
+    renderVisibleTransactions();
+    const { viewport } = txList;
+    const remaining = viewport.scrollHeight - viewport.scrollTop - viewport.clientHeight;
+    if (remaining < TX_PREFETCH_PX) {
+        loadMoreTransactions();
+    }
+}
+
+function setTransactionsFooter(visible) {
+    const footer = txList.viewport && txList.viewport.querySelector('.transactions-footer');
+    if (footer) footer.classList.toggle('hidden', !visible);
+}
+
+async function loadMoreTransactions() {
+    if (txList.loading || !txList.hasMore || !txList.nextCursor) return;
+
+    const generation = txList.generation;
+    txList.loading = true;
+    setTransactionsFooter(true);
+
+    try {
+        const { response, data } = await api.getTransactions(false, {
+            before: txList.nextCursor,
+            limit: TX_PAGE_SIZE,
+        });
+        if (generation !== txList.generation) return;
+
+        if (response.ok && Array.isArray(data.transactions)) {
+            txList.items.push(...data.transactions);
+            txList.nextCursor = data.next_cursor;
+            txList.hasMore = Boolean(data.has_more);
+            document.getElementById('total-transactions').textContent = txList.items.length;
+            renderVisibleTransactions(true);
+        } else {
+            console.error('Error loading more transactions:', data.error);
+            txList.hasMore = false;
+        }
+    } catch (error) {
+        console.error('Error loading more transactions:', error);
+    } finally {
+        if (generation === txList.generation) {
+            txList.loading = false;
+            setTransactionsFooter(false);
+        }
+    }
+}
+
+function showTransactionsFirstPage(data, container = document.getElementById('transactions-container')) {
+    if (!container) return;
+
+    txList.items = data.transactions.slice();
+    txList.nextCursor = data.next_cursor;
+    txList.hasMore = Boolean(data.has_more);
+
+    // Update total transactions count
+    document.getElementById('total-transactions').textContent = txList.items.length;
+
+    mountTransactionsViewport(container);
+    renderVisibleTransactions(true);
+}
+
+// Load transactions (first page)
 async function loadTransactions(forceRefresh = false) {
     const container = document.getElementById('transactions-container');
     
     if (!container) return;
+
+    const generation = ++txList.generation;
+    txList.items = [];
+    txList.nextCursor = null;
+    txList.hasMore = false;
+    txList.loading = true;
+    txList.viewport = null;
     
     container.innerHTML = '<div class="empty-state"><div class="loading-spinner"></div><p>Загрузка транзакций...</p></div>';
 
     try {
-        const { response, data } = await api.getTransactions(forceRefresh);
+        const { response, data } = await api.getTransactions(forceRefresh, { limit: TX_PAGE_SIZE });
+        if (generation !== txList.generation) return;
 
         if (response.ok && data.transactions && Array.isArray(data.transactions)) {
             if (data.transactions.length === 0) {
-                container.innerHTML = `
-                    <div class="empty-state">
-                        <svg width="64" height="64" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5">
-                            <path d="M21 12H3M16 6l6 6-6 6M8 6l-6 6 6 6"></path>
-                        </svg>
-                        <h3>Нет транзакций</h3>
-                        <p>Транзакции появятся здесь после подключения кошелька</p>
-                    </div>
-                `;
+                renderTransactionsEmpty(container, 'Нет транзакций', 'Транзакции появятся здесь после подключения кошелька');
                 return;
             }
 
-            container.innerHTML = '';
-            
-            // Update total transactions count
-            document.getElementById('total-transactions').textContent = data.count || data.transactions.length;
-
-            data.transactions.forEach((tx) => {
-                const isOutgoing = normalizeAddress(tx.from_address) === normalizeAddress(walletAddress);
-                const txElement = createTransactionElement(tx, isOutgoing);
-                container.appendChild(txElement);
-            });
+            showTransactionsFirstPage(data, container);
         } else {
-            container.innerHTML = `
-                <div class="empty-state">
-                    <h3>Ошибка загрузки</h3>
-                    <p>${data.error || 'Неизвестная ошибка'}</p>
-                </div>
-            `;
+            renderTransactionsError(container, 'Ошибка загрузки', data.error || 'Неизвестная ошибка');
         }
     } catch (error) {
         console.error('Error loading transactions:', error);
-        container.innerHTML = `
-            <div class="empty-state">
-                <h3>Ошибка</h3>
-                <p>${error.message}</p>
-            </div>
-        `;
+        renderTransactionsError(container, 'Ошибка', error.message);
+    } finally {
+        if (generation === txList.generation) {
+            txList.loading = false;
+        }
+    }
+
+    // The first page may not fill the viewport: there is nothing to scroll yet
+    if (generation === txList.generation && txList.viewport
+        && txList.viewport.scrollHeight <= txList.viewport.clientHeight) {
+        loadMoreTransactions();
     }
 }
 
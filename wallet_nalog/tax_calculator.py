@@ -1,117 +1,167 @@
-from .tonservice import get_balance, get_history_transaction, account_info
-from .models import TransactionHistory, WalletSession
+from .models import TransactionHistory, MonthlyTaxSnapshot
+from django.db import transaction
+from django.db.models import Count, Min, Max, Sum
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
-import asyncio
-import requests
+
+from .price_service import get_ton_price
+from .timing import timed
 
 
 # Ставка налога: 5% от прибыли по каждой продаже
 TAX_RATE_PROFIT = Decimal('0.05')
 
+# Уровень детализации по операциям внутри месяца:
+# none — только итоги, sells — только продажи, all — все операции
+DETAIL_NONE = 'none'
+DETAIL_SELLS = 'sells'
+DETAIL_ALL = 'all'
+DETAIL_LEVELS = (DETAIL_NONE, DETAIL_SELLS, DETAIL_ALL)
+
+# Поля месяца, которые можно запросить через ?fields=
+MONTH_FIELDS = (
+    'year', 'month', 'total_sent_ton', 'total_sent_usd', 'total_tax_ton', 'total_tax_usd',
+    'transactions_count', 'transactions', 'demo_deals',
+)
+
+
+def parse_fields(raw):
+    """
+    Разбирает ?fields=year,month,total_tax_ton в кортеж полей месяца.
+    Пустое значение — все поля (None). Неизвестное поле — ValueError.
+    """
+    if not raw:
+        return None
+    fields = tuple(f.strip() for f in raw.split(',') if f.strip())
+    unknown = [f for f in fields if f not in MONTH_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+
+def resolve_detail(detail=None, fields=None):
+    """
+    Итоговый уровень детализации. Если detail не указан, а в fields нет
+    transactions — детализация не нужна и не строится.
+    """
+    if detail is None:
+        if fields is not None and 'transactions' not in fields:
+            return DETAIL_NONE
+        return DETAIL_ALL
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"Параметр detail должен быть одним из: {', '.join(DETAIL_LEVELS)}")
+    return detail
+
+
+def _select_fields(item, fields):
+    if fields is None:
+        return item
+    return {key: item[key] for key in fields if key in item}
+
 
 def get_ton_price_usd():
     """
     Текущая цена TON в USD для расчёта эквивалента.
-    Если API недоступно, используем запасное значение.
+    Курс берётся из кэша price_service; если API недоступно,
+    используется последнее известное или запасное значение.
     """
-    try:
-        response = requests.get(
-            'https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd',
-            timeout=10
-        )
-        if response.status_code == 200:
-            data = response.json()
-            price = data.get('the-open-network', {}).get('usd')
-            if price:
-                return Decimal(str(price))
-    except Exception as e:
-        print(f"Ошибка при получении курса TON/USD: {e}")
-    
-    # Запасной курс, если API недоступно
-    return Decimal('5.0') 
-
-
-def calculate_tax_for_month(wallet_address, year, month, ton_price_usd=None):
+    return get_ton_price().price
+
+
+def _month_bounds(period):
+    """Границы месяца [start, end) в виде timezone-aware дат."""
+    start_naive = datetime(period.year, period.month, 1)
+    end_period = _next_period(period)
+    end_naive = datetime(end_period.year, end_period.month, 1)
+    return timezone.make_aware(start_naive), timezone.make_aware(end_naive)
+
+
+def _next_period(period):
+    if period.month == 12:
+        return date(period.year + 1, 1, 1)
+    return date(period.year, period.month + 1, 1)
+
+
+def _prev_period(period):
+    if period.month == 1:
+        return date(period.year - 1, 12, 1)
+    return date(period.year, period.month - 1, 1)
+
+
+def _period_of(dt):
+    local_dt = timezone.localtime(dt)
+    return date(local_dt.year, local_dt.month, 1)
+
+
+def _current_period():
+    return _period_of(timezone.now())
+
+
+@timed('fifo')
+def _compute_month(wallet_address, period, opening_lots, detail=DETAIL_ALL):
     """
-    Расчёт налога за месяц по логике:
+    Расчёт месяца в TON по логике:
     - считаем покупки и продажи TON;
     - для каждой продажи считаем прибыль = сумма продажи - сумма покупок (FIFO),
       использованных под эту продажу;
     - если прибыль > 0, налог = 5% от прибыли;
     - если продажа "в минус" (прибыль <= 0), налог не берётся.
+
+    Пул покупок переносится между месяцами: opening_lots — остаток на начало
+    месяца, closing_lots в результате — остаток на конец.
+    Суммы хранятся строками, чтобы не терять точность Decimal.
+    Словари детализации строятся только для уровня detail.
     """
-    # Используем timezone-aware даты, совместимые с Django
-    start_naive = datetime(year, month, 1)
-    if month == 12:
-        end_naive = datetime(year + 1, 1, 1)
-    else:
-        end_naive = datetime(year, month + 1, 1)
+    start_date, end_date = _month_bounds(period)
 
-    # Делаем aware в соответствии с настройками TIME_ZONE
-    start_date = timezone.make_aware(start_naive)
-    end_date = timezone.make_aware(end_naive)
-    
+    # Внутренние переводы самому себе и прочее пропускаем на стороне БД
     month_txs = TransactionHistory.objects.filter(
         wallet_address=wallet_address,
+        direction__in=[TransactionHistory.DIRECTION_IN, TransactionHistory.DIRECTION_OUT],
         timestamp__gte=start_date,
         timestamp__lt=end_date
-    ).order_by('timestamp')
-    
-    if ton_price_usd is None:
-        ton_price_usd = get_ton_price_usd()
-    
+    ).order_by('timestamp').only('tx_hash', 'timestamp', 'amount_nano', 'direction')
+
     total_tax_ton = Decimal('0')
-    total_tax_usd = Decimal('0')
     total_sent_ton = Decimal('0')   # суммарный объём продаж
-    total_sent_usd = Decimal('0')
     transactions_detail = []
+    transactions_count = 0
+    keep_buys = detail == DETAIL_ALL
+    keep_sells = detail in (DETAIL_SELLS, DETAIL_ALL)
 
     # Пул покупок для FIFO-списания при продажах
-    buys_pool = []  # элементы: {'amount': Decimal}
+    buys_pool = [Decimal(lot) for lot in opening_lots]
 
     for tx in month_txs:
-        amount_ton = Decimal(str(tx.amount))
-
-        # Определяем тип операции относительно нашего кошелька
-        is_buy = tx.to_address == wallet_address and tx.from_address != wallet_address
-        is_sell = tx.from_address == wallet_address and tx.to_address != wallet_address
-
-        if not is_buy and not is_sell:
-            # Внутренние переводы самому себе и прочее — пропускаем
-            continue
-
-        amount_usd = amount_ton * ton_price_usd
+        amount_ton = tx.amount
+        transactions_count += 1
 
-        if is_buy:
+        if tx.direction == TransactionHistory.DIRECTION_IN:
             # Покупка: просто добавляем в пул, налог не берём
-            buys_pool.append({'amount': amount_ton})
+            buys_pool.append(amount_ton)
+            if not keep_buys:
+                continue
             transactions_detail.append({
-                'tx_hash': tx.tx_hash,
+                'tx_hash': tx.tx_hash_hex,
                 'timestamp': tx.timestamp.isoformat(),
                 'operation_type': 'buy',
-                'amount_ton': float(amount_ton),
-                'amount_usd': float(amount_usd),
-                'matched_buy_amount_ton': float(amount_ton),
-                'profit_ton': 0.0,
-                'profit_usd': 0.0,
-                'tax_rate': float(TAX_RATE_PROFIT),
-                'tax_amount_ton': 0.0,
-                'tax_amount_usd': 0.0,
+                'amount_ton': str(amount_ton),
+                'matched_buy_amount_ton': str(amount_ton),
+                'profit_ton': '0',
+                'tax_amount_ton': '0',
             })
             continue
 
         # Продажа: считаем, какой объём покупок идёт "под неё" (FIFO)
         total_sent_ton += amount_ton
-        total_sent_usd += amount_usd
 
         remaining = amount_ton
         matched_buy = Decimal('0')
 
         while remaining > 0 and buys_pool:
-            lot = buys_pool[0]
-            lot_amount = lot['amount']
+            lot_amount = buys_pool[0]
 
             use_amount = remaining if remaining <= lot_amount else lot_amount
             matched_buy += use_amount
@@ -121,7 +171,7 @@ def calculate_tax_for_month(wallet_address, year, month, ton_price_usd=None):
             if lot_amount <= 0:
                 buys_pool.pop(0)
             else:
-                lot['amount'] = lot_amount
+                buys_pool[0] = lot_amount
 
         # Прибыль в TON = объём продажи - объём покупок, отнесённый на эту продажу
         profit_ton = amount_ton - matched_buy
@@ -131,148 +181,409 @@ def calculate_tax_for_month(wallet_address, year, month, ton_price_usd=None):
             profit_ton = Decimal('0')
             tax_ton = Decimal('0')
 
-        profit_usd = profit_ton * ton_price_usd
-        tax_usd = tax_ton * ton_price_usd
-
         total_tax_ton += tax_ton
-        total_tax_usd += tax_usd
 
+        if not keep_sells:
+            continue
         transactions_detail.append({
-            'tx_hash': tx.tx_hash,
+            'tx_hash': tx.tx_hash_hex,
             'timestamp': tx.timestamp.isoformat(),
             'operation_type': 'sell',
-            'amount_ton': float(amount_ton),
-            'amount_usd': float(amount_usd),
-            'matched_buy_amount_ton': float(matched_buy),
-            'profit_ton': float(profit_ton),
+            'amount_ton': str(amount_ton),
+            'matched_buy_amount_ton': str(matched_buy),
+            'profit_ton': str(profit_ton),
+            'tax_amount_ton': str(tax_ton),
+        })
+
+    return {
+        'total_sent_ton': total_sent_ton,
+        'total_tax_ton': total_tax_ton,
+        'transactions_count': transactions_count,
+        'transactions': transactions_detail,
+        'closing_lots': [str(lot) for lot in buys_pool],
+    }
+
+
+def _snapshot_to_month(snapshot, detail=DETAIL_ALL):
+    # При detail=none поле transactions не загружено (defer) и не трогается
+    if detail == DETAIL_NONE:
+        transactions = []
+    elif detail == DETAIL_SELLS:
+        transactions = [d for d in snapshot.transactions if d['operation_type'] == 'sell']
+    else:
+        transactions = snapshot.transactions
+    return {
+        'total_sent_ton': snapshot.total_sent_ton,
+        'total_tax_ton': snapshot.total_tax_ton,
+        'transactions_count': snapshot.transactions_count,
+        'transactions': transactions,
+        'closing_lots': snapshot.closing_lots,
+    }
+
+
+def _demo_deals(period, ton_price_usd):
+    """
+    Вымышленные сделки для демонстрации (пример с покупкой/продажей 1000 TON).
+    Используем один месяц (декабрь 2025), чтобы показать,
+    как считается налог 5% от положительной разницы между покупкой и продажей.
+    """
+    if not (period.year == 2025 and period.month == 12):
+        return [], Decimal('0'), Decimal('0')
+
+    amount_demo_ton = Decimal('1000')
+    # Берём текущий курс как "цена покупки"
+    buy_price = ton_price_usd
+    # Для демонстрации считаем, что на следующий день курс вырос на 10%
+    sell_price = (ton_price_usd * Decimal('1.10')).quantize(Decimal('0.00000001'))
+
+    buy_usd = amount_demo_ton * buy_price
+    sell_usd = amount_demo_ton * sell_price
+    profit_usd = sell_usd - buy_usd  # прибыль в USD
+
+    if profit_usd > 0:
+        tax_usd = (profit_usd * TAX_RATE_PROFIT).quantize(Decimal('0.00000001'))
+    else:
+        tax_usd = Decimal('0')
+
+    # Налог в TON по курсу продажи
+    tax_ton = (tax_usd / sell_price).quantize(Decimal('0.000000001')) if tax_usd > 0 else Decimal('0')
+
+    demo_deals = [
+        {
+            'operation_type': 'buy',
+            'date': '11.12.2025',
+            'amount_ton': float(amount_demo_ton),
+            'amount_usd': float(buy_usd),
+            'price_usd': float(buy_price),
+            'profit_ton': 0.0,
+            'profit_usd': 0.0,
+            'tax_rate': float(TAX_RATE_PROFIT),
+            'tax_amount_ton': 0.0,
+            'tax_amount_usd': 0.0,
+        },
+        {
+            'operation_type': 'sell',
+            'date': '12.12.2025',
+            'amount_ton': float(amount_demo_ton),
+            'amount_usd': float(sell_usd),
+            'price_usd': float(sell_price),
+            'profit_ton': float((profit_usd / sell_price).quantize(Decimal('0.000000001'))) if profit_usd > 0 else 0.0,
             'profit_usd': float(profit_usd),
             'tax_rate': float(TAX_RATE_PROFIT),
             'tax_amount_ton': float(tax_ton),
             'tax_amount_usd': float(tax_usd),
-        })
+        },
+    ]
+    return demo_deals, tax_ton, tax_usd
 
-    # Вымышленные сделки для демонстрации (пример с покупкой/продажей 1000 TON).
-    # Используем один месяц (например, декабрь 2025), чтобы показать,
-    # как считается налог 5% от положительной разницы между покупкой и продажей.
-    demo_deals = []
-    demo_tax_ton = Decimal('0')
-    demo_tax_usd = Decimal('0')
-
-    if year == 2025 and month == 12:
-        amount_demo_ton = Decimal('1000')
-        # Берём текущий курс как "цена покупки"
-        buy_price = ton_price_usd
-        # Для демонстрации считаем, что на следующий день курс вырос на 10%
-        sell_price = (ton_price_usd * Decimal('1.10')).quantize(Decimal('0.00000001'))
-
-        buy_usd = amount_demo_ton * buy_price
-        sell_usd = amount_demo_ton * sell_price
-        profit_usd = sell_usd - buy_usd  # прибыль в USD
-
-        if profit_usd > 0:
-            tax_usd = (profit_usd * TAX_RATE_PROFIT).quantize(Decimal('0.00000001'))
-        else:
-            tax_usd = Decimal('0')
 
-        # Налог в TON по курсу продажи
-        tax_ton = (tax_usd / sell_price).quantize(Decimal('0.000000001')) if tax_usd > 0 else Decimal('0')
+def _price_transaction(detail, ton_price_usd):
+    """Переводит детализацию операции из TON-представления в формат ответа API."""
+    amount_ton = Decimal(detail['amount_ton'])
+    profit_ton = Decimal(detail['profit_ton'])
+    tax_ton = Decimal(detail['tax_amount_ton'])
+    return {
+        'tx_hash': detail['tx_hash'],
+        'timestamp': detail['timestamp'],
+        'operation_type': detail['operation_type'],
+        'amount_ton': float(amount_ton),
+        'amount_usd': float(amount_ton * ton_price_usd),
+        'matched_buy_amount_ton': float(Decimal(detail['matched_buy_amount_ton'])),
+        'profit_ton': float(profit_ton),
+        'profit_usd': float(profit_ton * ton_price_usd),
+        'tax_rate': float(TAX_RATE_PROFIT),
+        'tax_amount_ton': float(tax_ton),
+        'tax_amount_usd': float(tax_ton * ton_price_usd),
+    }
 
-        demo_deals = [
-            {
-                'operation_type': 'buy',
-                'date': '11.12.2025',
-                'amount_ton': float(amount_demo_ton),
-                'amount_usd': float(buy_usd),
-                'price_usd': float(buy_price),
-                'profit_ton': 0.0,
-                'profit_usd': 0.0,
-                'tax_rate': float(TAX_RATE_PROFIT),
-                'tax_amount_ton': 0.0,
-                'tax_amount_usd': 0.0,
-            },
-            {
-                'operation_type': 'sell',
-                'date': '12.12.2025',
-                'amount_ton': float(amount_demo_ton),
-                'amount_usd': float(sell_usd),
-                'price_usd': float(sell_price),
-                'profit_ton': float((profit_usd / sell_price).quantize(Decimal('0.000000001'))) if profit_usd > 0 else 0.0,
-                'profit_usd': float(profit_usd),
-                'tax_rate': float(TAX_RATE_PROFIT),
-                'tax_amount_ton': float(tax_ton),
-                'tax_amount_usd': float(tax_usd),
-            },
-        ]
-
-        demo_tax_ton = tax_ton
-        demo_tax_usd = tax_usd
 
-    return {
-        'year': year,
-        'month': month,
+def _price_month(period, month_data, ton_price_usd, detail=DETAIL_ALL):
+    total_sent_ton = Decimal(month_data['total_sent_ton'])
+    demo_deals, demo_tax_ton, demo_tax_usd = _demo_deals(period, ton_price_usd)
+
+    result = {
+        'year': period.year,
+        'month': period.month,
         'total_sent_ton': float(total_sent_ton),
-        'total_sent_usd': float(total_sent_usd),
+        'total_sent_usd': float(total_sent_ton * ton_price_usd),
         'total_tax_ton': float(demo_tax_ton),
         'total_tax_usd': float(demo_tax_usd),
-        'transactions_count': len(transactions_detail),
-        'transactions': transactions_detail,
+        'transactions_count': month_data['transactions_count'],
         'demo_deals': demo_deals,
     }
+    if detail != DETAIL_NONE:
+        result['transactions'] = [_price_transaction(d, ton_price_usd) for d in month_data['transactions']]
+    return result
+
 
+def _rebuild_snapshots(wallet_address, start_period, end_period):
+    """
+    Пересчитывает срезы с start_period по end_period включительно.
+    Остаток FIFO-пула берётся из среза предыдущего месяца.
+    """
+    previous = MonthlyTaxSnapshot.objects.filter(
+        wallet_address=wallet_address,
+        period=_prev_period(start_period)
+    ).only('closing_lots').first()
+    lots = previous.closing_lots if previous else []
+
+    period = start_period
+    with transaction.atomic():
+        while period <= end_period:
+            month_data = _compute_month(wallet_address, period, lots)
+            MonthlyTaxSnapshot.objects.update_or_create(
+                wallet_address=wallet_address,
+                period=period,
+                defaults={
+                    'total_sent_ton': month_data['total_sent_ton'],
+                    'total_tax_ton': month_data['total_tax_ton'],
+                    'transactions_count': month_data['transactions_count'],
+                    'transactions': month_data['transactions'],
+                    'closing_lots': month_data['closing_lots'],
+                },
+            )
+            lots = month_data['closing_lots']
+            period = _next_period(period)
+
+
+def _snapshot_end_period(last_tx_timestamp):
+    """Срезы храним только для завершённых месяцев, текущий считаем на лету."""
+    return min(_period_of(last_tx_timestamp), _prev_period(_current_period()))
+
+
+def refresh_monthly_snapshots(wallet_address, since=None):
+    """
+    Обновляет срезы после загрузки новых транзакций.
+    Пересчитываются только месяцы начиная с самого раннего затронутого
+    (since) и недостающие месяцы после последнего сохранённого среза.
+    """
+    bounds = TransactionHistory.objects.filter(
+        wallet_address=wallet_address
+    ).aggregate(first=Min('timestamp'), last=Max('timestamp'))
+    if bounds['first'] is None:
+        return
 
-def calculate_tax_for_all_months(wallet_address, start_year=None, start_month=None, ton_price_usd=None):
-    first_tx = TransactionHistory.objects.filter(
+    end_period = _snapshot_end_period(bounds['last'])
+    last_snapshot = MonthlyTaxSnapshot.objects.filter(
         wallet_address=wallet_address
-    ).order_by('timestamp').first()
-    
-    if not first_tx:
-        return []
-    
-    last_tx = TransactionHistory.objects.filter(
+    ).order_by('-period').only('period').first()
+
+    if last_snapshot is None:
+        start_period = _period_of(bounds['first'])
+    else:
+        start_period = _next_period(last_snapshot.period)
+        if since is not None:
+            start_period = min(start_period, _period_of(since))
+
+    if start_period <= end_period:
+        _rebuild_snapshots(wallet_address, start_period, end_period)
+
+
+def rebuild_monthly_snapshots(wallet_address):
+    """Удаляет все срезы кошелька и пересчитывает их с первой транзакции."""
+    bounds = TransactionHistory.objects.filter(
+        wallet_address=wallet_address
+    ).aggregate(first=Min('timestamp'), last=Max('timestamp'))
+    with transaction.atomic():
+        MonthlyTaxSnapshot.objects.filter(wallet_address=wallet_address).delete()
+        if bounds['first'] is None:
+            return 0
+        start_period = _period_of(bounds['first'])
+        end_period = _snapshot_end_period(bounds['last'])
+        if start_period <= end_period:
+            _rebuild_snapshots(wallet_address, start_period, end_period)
+    return MonthlyTaxSnapshot.objects.filter(wallet_address=wallet_address).count()
+
+
+def _load_months(wallet_address, start_period, end_period, detail=DETAIL_ALL):
+    """
+    Данные по месяцам [start_period, end_period] в TON-представлении.
+    Завершённые месяцы читаются из срезов одним запросом,
+    пересчитывается не более одного (текущего) месяца.
+    При detail=none JSON с детализацией не читается из БД.
+    """
+    refresh_monthly_snapshots(wallet_address)
+
+    snapshots_qs = MonthlyTaxSnapshot.objects.filter(
+        wallet_address=wallet_address,
+        period__gte=start_period,
+        period__lte=end_period,
+    )
+    if detail == DETAIL_NONE:
+        snapshots_qs = snapshots_qs.defer('transactions')
+    snapshots = {s.period: s for s in snapshots_qs}
+
+    months = []
+    lots = None
+    period = start_period
+    while period <= end_period:
+        snapshot = snapshots.get(period)
+        if snapshot is not None:
+            month_data = _snapshot_to_month(snapshot, detail)
+        else:
+            if lots is None:
+                previous = snapshots.get(_prev_period(period)) or MonthlyTaxSnapshot.objects.filter(
+                    wallet_address=wallet_address,
+                    period=_prev_period(period)
+                ).only('closing_lots').first()
+                lots = previous.closing_lots if previous else []
+            month_data = _compute_month(wallet_address, period, lots, detail)
+        lots = month_data['closing_lots']
+        months.append((period, month_data))
+        period = _next_period(period)
+    return months
+
+
+@timed('tax')
+def calculate_tax_for_month(wallet_address, year, month, ton_price_usd=None, detail=None, fields=None):
+    """
+    Налог за месяц. Завершённые месяцы берутся из MonthlyTaxSnapshot,
+    текущий месяц считается на лету (см. _compute_month).
+    detail и fields — см. resolve_detail и parse_fields.
+    """
+    detail = resolve_detail(detail, fields)
+    if ton_price_usd is None:
+        ton_price_usd = get_ton_price_usd()
+
+    period = date(year, month, 1)
+    month_data = _load_months(wallet_address, period, period, detail)[0][1]
+    return _select_fields(_price_month(period, month_data, ton_price_usd, detail), fields)
+
+
+@timed('tax')
+def calculate_month_transactions(wallet_address, year, month, detail=DETAIL_ALL, offset=0, limit=100, ton_price_usd=None):
+    """
+    Постраничная детализация операций одного месяца.
+    В формат API переводится только запрошенная страница.
+    """
+    if detail == DETAIL_NONE:
+        raise ValueError('Для детализации detail должен быть sells или all')
+    detail = resolve_detail(detail)
+    if ton_price_usd is None:
+        ton_price_usd = get_ton_price_usd()
+
+    period = date(year, month, 1)
+    details = _load_months(wallet_address, period, period, detail)[0][1]['transactions']
+    page = details[offset:offset + limit]
+    next_offset = offset + len(page)
+    return {
+        'year': year,
+        'month': month,
+        'detail': detail,
+        'transactions': [_price_transaction(d, ton_price_usd) for d in page],
+        'total': len(details),
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if next_offset < len(details) else None,
+    }
+
+
+@timed('tax')
+def calculate_tax_for_all_months(wallet_address, start_year=None, start_month=None, ton_price_usd=None,
+                                 detail=None, fields=None):
+    bounds = TransactionHistory.objects.filter(
         wallet_address=wallet_address
-    ).order_by('-timestamp').first()
-    
-    if not last_tx:
+    ).aggregate(first=Min('timestamp'), last=Max('timestamp'))
+
+    if bounds['first'] is None:
         return []
-    
+
+    first_period = _period_of(bounds['first'])
     if start_year is None:
-        start_year = first_tx.timestamp.year
+        start_year = first_period.year
     if start_month is None:
-        start_month = first_tx.timestamp.month
-    
-    end_year = last_tx.timestamp.year
-    end_month = last_tx.timestamp.month
-    
+        start_month = first_period.month
+
+    start_period = date(start_year, start_month, 1)
+    end_period = _period_of(bounds['last'])
+
+    if ton_price_usd is None:
+        ton_price_usd = get_ton_price_usd()
+
+    detail = resolve_detail(detail, fields)
+
+    # Раньше мы отбрасывали месяцы без исходящих транзакций.
+    # Теперь всегда добавляем месяц, чтобы он отображался на фронте даже с нулевым налогом.
+    return [
+        _select_fields(_price_month(period, month_data, ton_price_usd, detail), fields)
+        for period, month_data in _load_months(wallet_address, start_period, end_period, detail)
+    ]
+
+
+@timed('tax')
+def calculate_monthly_volumes(wallet_address, start_year=None, start_month=None, ton_price_usd=None):
+    """
+    Помесячные объёмы входящих и исходящих переводов.
+    Агрегация выполняется в БД (TruncMonth + Sum) по индексу
+    (wallet_address, direction, timestamp) — для сводок, где не нужна
+    FIFO-детализация по операциям.
+    """
+    queryset = TransactionHistory.objects.filter(
+        wallet_address=wallet_address,
+        direction__in=[TransactionHistory.DIRECTION_IN, TransactionHistory.DIRECTION_OUT],
+    )
+    if start_year is not None:
+        start_period = date(start_year, start_month or 1, 1)
+        queryset = queryset.filter(timestamp__gte=_month_bounds(start_period)[0])
+
+    rows = (
+        queryset
+        .annotate(period=TruncMonth('timestamp'))
+        .values('period', 'direction')
+        .annotate(total=Sum('amount_nano'), count=Count('id'))
+        .order_by('period')
+    )
+
     if ton_price_usd is None:
         ton_price_usd = get_ton_price_usd()
-    
-    tax_results = []
-    current_year = start_year
-    current_month = start_month
-    
-    while (current_year < end_year) or (current_year == end_year and current_month <= end_month):
-        tax_info = calculate_tax_for_month(wallet_address, current_year, current_month, ton_price_usd)
-        # Раньше мы отбрасывали месяцы без исходящих транзакций.
-        # Теперь всегда добавляем месяц, чтобы он отображался на фронте даже с нулевым налогом.
-        tax_results.append(tax_info)
-        
-        current_month += 1
-        if current_month > 12:
-            current_month = 1
-            current_year += 1
-    
-    return tax_results
-
-
-def calculate_total_tax(wallet_address, start_year=None, start_month=None, ton_price_usd=None):
-    monthly_taxes = calculate_tax_for_all_months(wallet_address, start_year, start_month, ton_price_usd)
-    
+
+    volumes = {}
+    for row in rows:
+        period = _period_of(row['period']) if isinstance(row['period'], datetime) else row['period']
+        item = volumes.setdefault(period, {
+            'year': period.year,
+            'month': period.month,
+            'incoming_ton': Decimal('0'),
+            'outgoing_ton': Decimal('0'),
+            'incoming_count': 0,
+            'outgoing_count': 0,
+        })
+        prefix = 'incoming' if row['direction'] == TransactionHistory.DIRECTION_IN else 'outgoing'
+        item[f'{prefix}_ton'] = Decimal(row['total'] or 0).scaleb(-9)
+        item[f'{prefix}_count'] = row['count']
+
+    result = []
+    for item in volumes.values():
+        for prefix in ('incoming', 'outgoing'):
+            amount_ton = item[f'{prefix}_ton']
+            item[f'{prefix}_ton'] = float(amount_ton)
+            item[f'{prefix}_usd'] = float(amount_ton * ton_price_usd)
+        result.append(item)
+    return result
+
+
+@timed('tax')
+def calculate_total_tax(wallet_address, start_year=None, start_month=None, ton_price_usd=None,
+                        detail=None, fields=None, price_quote=None):
+    # Курс получаем один раз и передаём во все помесячные расчёты
+    price_stale = False
+    if ton_price_usd is None:
+        quote = price_quote or get_ton_price()
+        ton_price_usd = quote.price
+        price_stale = quote.stale
+
+    # Итоги считаются по полным месяцам, fields применяется уже к ответу
+    detail = resolve_detail(detail, fields)
+    monthly_taxes = calculate_tax_for_all_months(
+        wallet_address, start_year, start_month, ton_price_usd, detail=detail
+    )
+
     total_tax_ton = sum(tax['total_tax_ton'] for tax in monthly_taxes)
     total_tax_usd = sum(tax['total_tax_usd'] for tax in monthly_taxes)
     total_sent_ton = sum(tax['total_sent_ton'] for tax in monthly_taxes)
     total_sent_usd = sum(tax['total_sent_usd'] for tax in monthly_taxes)
     total_transactions = sum(tax['transactions_count'] for tax in monthly_taxes)
-    
+
     period = None
     if monthly_taxes:
         first_month = monthly_taxes[0]
@@ -281,10 +592,7 @@ def calculate_total_tax(wallet_address, start_year=None, start_month=None, ton_p
             'start': f"{first_month['year']}-{first_month['month']:02d}",
             'end': f"{last_month['year']}-{last_month['month']:02d}"
         }
-    
-    if ton_price_usd is None:
-        ton_price_usd = get_ton_price_usd()
-    
+
     return {
         'total_tax_ton': float(total_tax_ton),
         'total_tax_usd': float(total_tax_usd),
@@ -292,6 +600,7 @@ def calculate_total_tax(wallet_address, start_year=None, start_month=None, ton_p
         'total_sent_usd': float(total_sent_usd),
         'total_transactions': total_transactions,
         'ton_price_usd': float(ton_price_usd),
-        'monthly_taxes': monthly_taxes,
+        'ton_price_stale': price_stale,
+        'monthly_taxes': [_select_fields(tax, fields) for tax in monthly_taxes],
         'period': period
-    }
\ No newline at end of file
+    }
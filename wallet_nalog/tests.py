@@ -1,12 +1,95 @@
+import base64
+import hashlib
+import io
+import json
+import logging
 import jwt
+import marshal
+import msgpack
+import os
+import subprocess
+import sys
 import time
-from datetime import datetime, timedelta
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from contextlib import redirect_stdout
+from unittest import mock
 from django.urls import reverse
+from prometheus_client import REGISTRY
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.test import APITestCase
 
-from .models import User, WalletSession
+from .models import User, WalletSession, TransactionHistory, MonthlyTaxSnapshot, AccountAddress, WalletDataVersion, ProfileArtifact, SyncJob, WebhookDelivery, tx_hash_to_bytes
+from .authentication import JWTAuthentication, decoded_tokens
+from .price_service import fetch_ton_price_usd, get_ton_price, reset_price_cache
+from .tax_calculator import calculate_total_tax, calculate_tax_for_all_months, calculate_monthly_volumes, calculate_month_transactions
+from .admin import transaction_month_histogram
+from .jobs import PROVIDER_SLOT_KEY, PROVIDER_SLOT_POLL, provider_throttle, recover_orphaned, run_job
+from .logsampling import SampledLog
+from . import tonservice, warmup
+from . import bloom, history_stream, parse_pool, provider_json
+from .tiered_cache import RedisBackend, TieredCache, redis_backend, tiered_cache
+from .webhooks import reconcile_due, sign_payload
+from .tonservice import save_transactions_to_db
+
+
+def create_user_with_wallet(email, wallet_address, **extra_fields):
+    """Пользователь с подключённым кошельком wallet_address."""
+    user = User.objects.create_user(email=email, password='strongpassword123', **extra_fields)
+    user.wallet.wallet_address = wallet_address
+    user.wallet.connected = True
+    user.wallet.save()
+    return user
+
+
+def toncenter_history(tag, start, count, first_lt=1000, interval=60):
+    """
+    Входящие транзакции в формате TON Center с номерами start..start+count-1.
+    Хеш и lt зависят только от tag и номера, поэтому повторный вызов отдаёт
+    те же транзакции.
+    """
+    return [{
+        'transaction_id': {'lt': str(first_lt + i), 'hash': hashlib.sha256(f'{tag}:{i}'.encode()).hexdigest()},
+        'utime': 1700000000 + i * interval,
+        'in_msg': {'value': str(1000000000 + i), 'source': f'UQ_{tag}_sender'},
+    } for i in range(start, start + count)]
+
+
+class FixedPriceMixin:
+    """Курс TON не запрашивается у CoinGecko: кэш курса сброшен, fetch_ton_price_usd возвращает ton_price."""
+
+    ton_price = Decimal('3')
+
+    def setUp(self):
+        super().setUp()
+        reset_price_cache()
+        self.price_patcher = mock.patch('wallet_nalog.price_service.fetch_ton_price_usd', return_value=self.ton_price)
+        self.price_patcher.start()
+        self.addCleanup(self.price_patcher.stop)
+
+
+class IngestTestMixin(FixedPriceMixin):
+    """
+    Тесты загрузки транзакций: кэши процесса (L1 tiered_cache, id адресов)
+    очищаются до и после теста — id адресов кэшируются после коммита, а
+    транзакция теста откатывается.
+    """
+
+    def setUp(self):
+        super().setUp()
+        tiered_cache.local.clear()
+        AccountAddress.objects.clear_cache()
+        self.addCleanup(tiered_cache.local.clear)
+        self.addCleanup(AccountAddress.objects.clear_cache)
 
 
 class RegistrationTests(APITestCase):
@@ -499,3 +582,1639 @@ class UserModelTests(APITestCase):
         self.assertIsNotNone(user.wallet)
         self.assertIsInstance(user.wallet, WalletSession)
         self.assertIsNotNone(user.wallet.session_key)
+
+
+class PriceServiceTests(APITestCase):
+    """Тесты для кэша курса TON/USD"""
+
+    def setUp(self):
+        reset_price_cache()
+
+    def tearDown(self):
+        reset_price_cache()
+
+    def _coingecko_response(self, price):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'the-open-network': {'usd': price}}
+        return response
+
+    def test_price_is_served_from_cache(self):
+        """Повторный запрос курса не обращается к CoinGecko"""
+        with mock.patch('requests.get',
+                        return_value=self._coingecko_response(3.5)) as get_mock:
+            first = get_ton_price()
+            second = get_ton_price()
+
+        self.assertEqual(first.price, Decimal('3.5'))
+        self.assertEqual(second.price, Decimal('3.5'))
+        self.assertFalse(second.stale)
+        self.assertEqual(get_mock.call_count, 1)
+
+    @override_settings(TON_PRICE_CACHE_TTL=0, TON_PRICE_RETRY_AFTER=0)
+    def test_last_known_price_is_returned_as_stale_when_upstream_is_down(self):
+        """При недоступности CoinGecko отдаётся последний известный курс с флагом stale"""
+        with mock.patch('requests.get',
+                        return_value=self._coingecko_response(4.2)):
+            get_ton_price()
+
+        with mock.patch('requests.get',
+                        side_effect=ConnectionError('down')):
+            quote = get_ton_price()
+
+        self.assertEqual(quote.price, Decimal('4.2'))
+        self.assertTrue(quote.stale)
+
+    def test_total_tax_requests_price_once(self):
+        """Итоговый налог запрашивает курс один раз"""
+        with mock.patch('requests.get',
+                        return_value=self._coingecko_response(2.0)) as get_mock:
+            summary = calculate_total_tax('UQ_test_wallet')
+
+        self.assertEqual(get_mock.call_count, 1)
+        self.assertEqual(summary['ton_price_usd'], 2.0)
+        self.assertFalse(summary['ton_price_stale'])
+
+
+class MonthlyTaxSnapshotTests(APITestCase):
+    """Тесты для материализованных помесячных срезов налога"""
+
+    wallet = 'UQ_snapshot_wallet'
+
+    def _create_tx(self, tx_hash, when, amount, incoming):
+        return TransactionHistory.objects.create(
+            wallet_address=self.wallet,
+            tx_hash=tx_hash,
+            timestamp=when,
+            amount=Decimal(amount),
+            from_address='UQ_counterparty' if incoming else self.wallet,
+            to_address=self.wallet if incoming else 'UQ_counterparty',
+        )
+
+    def setUp(self):
+        self._create_tx('buy-jan', datetime(2024, 1, 10, tzinfo=dt_timezone.utc), '10', incoming=True)
+        self._create_tx('sell-feb', datetime(2024, 2, 10, tzinfo=dt_timezone.utc), '4', incoming=False)
+
+    def test_completed_months_are_materialized_with_carried_lots(self):
+        """Завершённые месяцы сохраняются в срезы вместе с остатком FIFO-пула"""
+        months = calculate_tax_for_all_months(self.wallet, ton_price_usd=Decimal('2'))
+
+        self.assertEqual([(m['year'], m['month']) for m in months], [(2024, 1), (2024, 2)])
+        february = MonthlyTaxSnapshot.objects.get(wallet_address=self.wallet, period=date(2024, 2, 1))
+        self.assertEqual([Decimal(lot) for lot in february.closing_lots], [Decimal('6')])
+        # Продажа полностью покрыта покупкой января — прибыли нет
+        self.assertEqual(months[1]['transactions'][0]['profit_ton'], 0.0)
+        self.assertEqual(months[1]['total_sent_usd'], 8.0)
+
+    def test_ingest_recomputes_from_earliest_affected_month(self):
+        """Загрузка транзакций пересчитывает срезы с самого раннего затронутого месяца"""
+        calculate_tax_for_all_months(self.wallet, ton_price_usd=Decimal('2'))
+
+        saved = save_transactions_to_db(self.wallet, [{
+            'hash': 'buy-jan-2',
+            'utime': int(datetime(2024, 1, 20, tzinfo=dt_timezone.utc).timestamp()),
+            'in_msg': {'value': '2000000000', 'source': 'UQ_counterparty'},
+        }])
+
+        self.assertEqual(saved, 1)
+        january = MonthlyTaxSnapshot.objects.get(wallet_address=self.wallet, period=date(2024, 1, 1))
+        february = MonthlyTaxSnapshot.objects.get(wallet_address=self.wallet, period=date(2024, 2, 1))
+        self.assertEqual(january.transactions_count, 2)
+        self.assertEqual([Decimal(lot) for lot in february.closing_lots], [Decimal('6'), Decimal('2')])
+
+
+class TaxDetailSelectionTests(APITestCase):
+    """Тесты для выбора полей и уровня детализации налоговых эндпоинтов"""
+
+    wallet = 'UQ_detail_wallet'
+
+    def setUp(self):
+        for tx_hash, day, amount, incoming in [('det-1', 1, '10', True), ('det-2', 2, '3', False), ('det-3', 3, '4', False)]:
+            TransactionHistory.objects.create(
+                wallet_address=self.wallet,
+                tx_hash=tx_hash,
+                timestamp=datetime(2024, 6, day, tzinfo=dt_timezone.utc),
+                amount=Decimal(amount),
+                from_address='UQ_other' if incoming else self.wallet,
+                to_address=self.wallet if incoming else 'UQ_other',
+            )
+
+    def test_summary_mode_skips_transaction_detail(self):
+        """detail=none возвращает итоги без списка операций"""
+        months = calculate_tax_for_all_months(self.wallet, ton_price_usd=Decimal('2'), detail='none')
+
+        self.assertNotIn('transactions', months[0])
+        self.assertEqual(months[0]['transactions_count'], 3)
+        self.assertEqual(months[0]['total_sent_ton'], 7.0)
+
+    def test_fields_select_keys_and_imply_no_detail(self):
+        """fields ограничивает ключи месяца, итоги считаются по полным данным"""
+        total = calculate_total_tax(self.wallet, ton_price_usd=Decimal('2'), fields=('year', 'month'))
+
+        self.assertEqual(total['monthly_taxes'], [{'year': 2024, 'month': 6}])
+        self.assertEqual(total['total_transactions'], 3)
+
+    def test_month_detail_is_paged(self):
+        """Детализация месяца отдаётся страницами, sells отфильтровывает покупки"""
+        page = calculate_month_transactions(self.wallet, 2024, 6, detail='sells', limit=1, ton_price_usd=Decimal('2'))
+
+        self.assertEqual(page['total'], 2)
+        self.assertEqual(len(page['transactions']), 1)
+        self.assertEqual(page['transactions'][0]['operation_type'], 'sell')
+        self.assertEqual(page['next_offset'], 1)
+
+    def test_unknown_field_returns_error(self):
+        """Неизвестное поле в ?fields= даёт 400"""
+        user = User.objects.create_user(email='detail@example.com', password='strongpassword123')
+        user.wallet.wallet_address = self.wallet
+        user.wallet.connected = True
+        user.wallet.save()
+        self.client.force_authenticate(user)
+
+        response = self.client.get(reverse('tax_all_months'), {'fields': 'year,secret'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class TransactionDirectionTests(APITestCase):
+    """Тесты для направления транзакций и агрегации объёмов в БД"""
+
+    wallet = 'UQ_direction_wallet'
+
+    def test_direction_is_classified_on_save(self):
+        """Направление вычисляется при сохранении транзакции"""
+        common = {'wallet_address': self.wallet, 'timestamp': datetime(2024, 3, 1, tzinfo=dt_timezone.utc), 'amount': Decimal('1')}
+        incoming = TransactionHistory.objects.create(tx_hash='d-in', from_address='UQ_other', to_address=self.wallet, **common)
+        outgoing = TransactionHistory.objects.create(tx_hash='d-out', from_address=self.wallet, to_address='UQ_other', **common)
+        own = TransactionHistory.objects.create(tx_hash='d-self', from_address=self.wallet, to_address=self.wallet, **common)
+
+        self.assertEqual(incoming.direction, TransactionHistory.DIRECTION_IN)
+        self.assertEqual(outgoing.direction, TransactionHistory.DIRECTION_OUT)
+        self.assertEqual(own.direction, TransactionHistory.DIRECTION_SELF)
+
+    def test_monthly_volumes_are_aggregated_per_direction(self):
+        """Помесячные объёмы суммируются по направлениям"""
+        for tx_hash, day, amount, incoming in [('v1', 1, '5', True), ('v2', 2, '1.5', False), ('v3', 3, '0.5', False)]:
+            TransactionHistory.objects.create(
+                wallet_address=self.wallet,
+                tx_hash=tx_hash,
+                timestamp=datetime(2024, 4, day, tzinfo=dt_timezone.utc),
+                amount=Decimal(amount),
+                from_address='UQ_other' if incoming else self.wallet,
+                to_address=self.wallet if incoming else 'UQ_other',
+            )
+
+        volumes = calculate_monthly_volumes(self.wallet, ton_price_usd=Decimal('2'))
+
+        self.assertEqual(len(volumes), 1)
+        self.assertEqual((volumes[0]['year'], volumes[0]['month']), (2024, 4))
+        self.assertEqual(volumes[0]['incoming_ton'], 5.0)
+        self.assertEqual(volumes[0]['outgoing_ton'], 2.0)
+        self.assertEqual(volumes[0]['outgoing_count'], 2)
+        self.assertEqual(volumes[0]['outgoing_usd'], 4.0)
+
+
+class CompactTransactionSchemaTests(APITestCase):
+    """Тесты для компактной схемы TransactionHistory"""
+
+    def test_tx_hash_formats_are_normalized_to_32_bytes(self):
+        """Хеши в hex и base64 приводятся к одним и тем же 32 байтам"""
+        raw = bytes(range(32))
+
+        self.assertEqual(tx_hash_to_bytes(raw.hex()), raw)
+        self.assertEqual(tx_hash_to_bytes(base64.b64encode(raw).decode()), raw)
+        self.assertEqual(len(tx_hash_to_bytes('legacy-hash')), 32)
+
+    def test_toncenter_payload_is_stored_with_lt_and_nanotons(self):
+        """Транзакция сохраняется с lt и суммой в нанотонах"""
+        raw = bytes(range(32))
+        save_transactions_to_db('UQ_compact_wallet', [{
+            'transaction_id': {'lt': '47000000000001', 'hash': base64.b64encode(raw).decode()},
+            'utime': 1700000000,
+            'in_msg': {'value': '1234567891', 'source': 'UQ_counterparty'},
+        }])
+
+        tx = TransactionHistory.objects.get(wallet_address='UQ_compact_wallet')
+        self.assertEqual(bytes(tx.tx_hash), raw)
+        self.assertEqual(tx.lt, 47000000000001)
+        self.assertEqual(tx.amount_nano, 1234567891)
+        self.assertEqual(tx.amount, Decimal('1.234567891'))
+
+
+class AccountAddressInterningTests(APITestCase):
+    """Тесты для интернирования адресов контрагентов"""
+
+    friendly = 'UQCD39VS5jcptHL8vMjEXrzGaRcCVYto7HUn4bpAOg8xqEBI'
+
+    def test_intern_many_reuses_existing_rows(self):
+        """Повторное интернирование возвращает те же id без новых строк"""
+        first = AccountAddress.objects.intern_many([self.friendly, 'UQ_unparsed', ''])
+        second = AccountAddress.objects.intern_many([self.friendly, 'UQ_unparsed'])
+
+        self.assertEqual(first, second)
+        self.assertEqual(AccountAddress.objects.count(), 2)
+        parsed = AccountAddress.objects.get(friendly=self.friendly)
+        self.assertEqual(parsed.workchain, 0)
+        self.assertEqual(len(bytes(parsed.hash_part)), 32)
+
+    def test_ingest_links_transactions_to_interned_addresses(self):
+        """Загруженные транзакции ссылаются на интернированные адреса"""
+        save_transactions_to_db('UQ_interned_wallet', [
+            {'hash': 'a' * 64, 'utime': 1700000000, 'in_msg': {'value': '1', 'source': 'UQ_sender'}},
+            {'hash': 'b' * 64, 'utime': 1700000001, 'in_msg': {'value': '2', 'source': 'UQ_sender'}},
+        ])
+
+        txs = list(TransactionHistory.objects.select_related('from_account', 'to_account'))
+        self.assertEqual(len(txs), 2)
+        self.assertEqual(txs[0].from_account_id, txs[1].from_account_id)
+        self.assertEqual(txs[0].from_address, 'UQ_sender')
+        self.assertEqual(txs[0].to_address, 'UQ_interned_wallet')
+        self.assertEqual(txs[0].direction, TransactionHistory.DIRECTION_IN)
+
+
+class TransactionPaginationTests(APITestCase):
+    """Тесты для курсорной пагинации истории транзакций"""
+
+    wallet = 'UQ_paged_wallet'
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='paged@example.com', password='strongpassword123')
+        self.user.wallet.wallet_address = self.wallet
+        self.user.wallet.connected = True
+        self.user.wallet.save()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('wallet_transactions')
+        # Первая страница запускает фоновую синхронизацию с блокчейном — в тестах она не нужна
+        patcher = mock.patch('wallet_nalog.views.threading')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        base = datetime(2024, 5, 1, tzinfo=dt_timezone.utc)
+        # Две транзакции с одинаковым временем проверяют разрешение ничьих по id
+        for i in range(5):
+            TransactionHistory.objects.create(
+                wallet_address=self.wallet,
+                tx_hash=f'page-{i}',
+                timestamp=base + timedelta(hours=min(i, 3)),
+                amount=Decimal('1'),
+                from_address='UQ_other',
+                to_address=self.wallet,
+            )
+
+    def _hashes(self, response):
+        return [tx['tx_hash'] for tx in response.data['transactions']]
+
+    def test_pages_follow_cursor_without_gaps_or_duplicates(self):
+        """Страницы по курсору покрывают всю историю без пропусков и повторов"""
+        first = self.client.get(self.url, {'limit': 2})
+        second = self.client.get(self.url, {'limit': 2, 'before': first.data['next_cursor']})
+        third = self.client.get(self.url, {'limit': 2, 'before': second.data['next_cursor']})
+
+        expected = [
+            tx.tx_hash_hex for tx in
+            TransactionHistory.objects.filter(wallet_address=self.wallet).order_by('-timestamp', '-id')
+        ]
+        self.assertEqual(self._hashes(first) + self._hashes(second) + self._hashes(third), expected)
+        self.assertTrue(second.data['has_more'])
+        self.assertFalse(third.data['has_more'])
+        self.assertIsNone(third.data['next_cursor'])
+        self.assertIsNone(first.data['prev_cursor'])
+
+    def test_after_cursor_returns_newer_page(self):
+        """Курсор after возвращает более новую страницу в том же порядке"""
+        first = self.client.get(self.url, {'limit': 2})
+        second = self.client.get(self.url, {'limit': 2, 'before': first.data['next_cursor']})
+
+        back = self.client.get(self.url, {'limit': 2, 'after': second.data['prev_cursor']})
+
+        self.assertEqual(self._hashes(back), self._hashes(first))
+
+    def test_invalid_cursor_returns_error(self):
+        """Некорректный курсор даёт 400"""
+        response = self.client.get(self.url, {'before': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RendererNegotiationTests(APITestCase):
+    """Тесты для выбора формата ответа (JSON / MessagePack)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='renderer@example.com', password='strongpassword123')
+        self.user.wallet.wallet_address = 'UQ_renderer_wallet'
+        self.user.wallet.connected = True
+        self.user.wallet.save()
+        TransactionHistory.objects.create(
+            wallet_address='UQ_renderer_wallet',
+            tx_hash='render-1',
+            timestamp=datetime(2024, 7, 1, tzinfo=dt_timezone.utc),
+            amount=Decimal('1.5'),
+            from_address='UQ_other',
+            to_address='UQ_renderer_wallet',
+        )
+        patcher = mock.patch('wallet_nalog.views.threading')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_msgpack_is_returned_when_requested(self):
+        """Accept: application/msgpack возвращает тот же ответ в MessagePack"""
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get(reverse('wallet_transactions'), HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        body = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(body['transactions'][0]['amount_ton'], '1.500000000')
+
+    def test_json_is_default(self):
+        """Без Accept ответ отдаётся в JSON"""
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get(reverse('wallet_transactions'))
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_auth_endpoints_render_json_only(self):
+        """Эндпоинты авторизации всегда отвечают JSON с токенами-строками"""
+        response = self.client.post(
+            reverse('login'),
+            data={'email': self.user.email, 'password': 'strongpassword123'},
+            format='json',
+            HTTP_ACCEPT='application/msgpack',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+        response = self.client.post(
+            reverse('login'),
+            data={'email': self.user.email, 'password': 'strongpassword123'},
+            format='json',
+        )
+        self.assertIsInstance(response.json()['tokens']['access'], str)
+
+
+class ConditionalGetTests(FixedPriceMixin, APITestCase):
+    """Тесты для ETag / 304 на эндпоинтах чтения"""
+
+    wallet = 'UQ_etag_wallet'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user_with_wallet('etag@example.com', self.wallet)
+        self.client.force_authenticate(self.user)
+        save_transactions_to_db(self.wallet, [
+            {'hash': 'e' * 64, 'utime': 1700000000, 'in_msg': {'value': '1000000000', 'source': 'UQ_sender'}},
+        ])
+        patcher = mock.patch('wallet_nalog.views.threading')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ingest_bumps_data_version(self):
+        """Загрузка новых транзакций увеличивает версию данных кошелька"""
+        self.assertEqual(WalletDataVersion.current(self.wallet)[0], 1)
+
+        save_transactions_to_db(self.wallet, [
+            {'hash': 'f' * 64, 'utime': 1700000100, 'in_msg': {'value': '1', 'source': 'UQ_sender'}},
+        ])
+
+        self.assertEqual(WalletDataVersion.current(self.wallet)[0], 2)
+
+    def test_unchanged_tax_returns_304_without_recalculation(self):
+        """Повторный запрос с If-None-Match получает 304 без запуска расчёта"""
+        first = self.client.get(reverse('tax_total'), {'detail': 'none'})
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+
+        with mock.patch('wallet_nalog.views.calculate_total_tax') as calculate:
+            second = self.client.get(reverse('tax_total'), {'detail': 'none'}, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        calculate.assert_not_called()
+
+    def test_new_data_changes_transactions_etag(self):
+        """После загрузки транзакций ETag списка меняется"""
+        first = self.client.get(reverse('wallet_transactions'))
+        save_transactions_to_db(self.wallet, [
+            {'hash': 'f' * 64, 'utime': 1700000100, 'in_msg': {'value': '1', 'source': 'UQ_sender'}},
+        ])
+
+        second = self.client.get(reverse('wallet_transactions'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.data['count'], 2)
+
+
+class JWTAuthenticationCacheTests(APITestCase):
+    """Тесты для кэша пользователя и токенов в JWTAuthentication"""
+
+    def setUp(self):
+        tiered_cache.local.clear()
+        self.addCleanup(tiered_cache.local.clear)
+        decoded_tokens.clear()
+        self.user = User.objects.create_user(email='auth-cache@example.com', password='strongpassword123')
+        self.token = self.user.generate_tokens()['access']
+        self.factory = RequestFactory()
+
+    def _authenticate(self):
+        request = self.factory.get('/api/wallet/balance/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        user, _ = JWTAuthentication().authenticate(request)
+        return user
+
+    def test_user_and_wallet_are_loaded_once(self):
+        """Первый запрос читает пользователя с кошельком одним запросом, повторный — ни одного"""
+        with self.assertNumQueries(1):
+            user = self._authenticate()
+            self.assertFalse(user.wallet.connected)
+
+        with self.assertNumQueries(0):
+            user = self._authenticate()
+            self.assertFalse(user.wallet.connected)
+
+    def test_wallet_save_invalidates_cached_user(self):
+        """Сохранение кошелька сбрасывает закэшированного пользователя"""
+        self._authenticate()
+
+        self.user.connect_wallet('UQ_cached_wallet', 'tonkeeper')
+
+        with self.assertNumQueries(1):
+            user = self._authenticate()
+        self.assertTrue(user.wallet.connected)
+        self.assertEqual(user.wallet.wallet_address, 'UQ_cached_wallet')
+
+    def test_deactivated_user_is_rejected_after_save(self):
+        """Деактивация пользователя действует сразу, несмотря на кэш"""
+        self._authenticate()
+        self.user.is_active = False
+        self.user.save()
+
+        request = self.factory.get('/api/wallet/balance/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with self.assertRaises(AuthenticationFailed):
+            JWTAuthentication().authenticate(request)
+
+    def test_authenticated_get_runs_view_without_auth_queries(self):
+        """Аутентифицированный GET с прогретым кэшем не делает запросов до логики view"""
+        self.user.connect_wallet('UQ_view_wallet', 'tonkeeper')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get(reverse('Wallet'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('Wallet'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_user_keeps_only_auth_fields(self):
+        """В кэше только поля для аутентификации и кошелёк; пароль в Redis не попадает"""
+        self.user.connect_wallet('UQ_roundtrip_wallet', 'tonkeeper')
+        fresh = self._authenticate()
+        payload = json.loads(tiered_cache.local.get(f'auth:user:{self.user.pk}'))
+        self.assertEqual(set(payload['user']), {'id', 'wallet_id', 'is_active', 'is_staff'})
+        self.assertNotIn(fresh.password, json.dumps(payload))
+
+        with self.assertNumQueries(0):
+            cached = self._authenticate()
+            self.assertEqual((cached.pk, cached.is_active, cached.is_staff), (fresh.pk, True, False))
+            self.assertEqual(cached.wallet.wallet_address, 'UQ_roundtrip_wallet')
+            self.assertEqual(cached.wallet.updated_at, fresh.wallet.updated_at)
+        self.assertFalse(cached._state.adding)
+        self.assertIn('password', cached.get_deferred_fields())
+
+        # save() пользователя из кэша не затирает отложенные поля
+        cached.connect_wallet('UQ_cached_save_wallet', 'tonkeeper')
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertTrue(stored.check_password('strongpassword123'))
+        self.assertEqual(stored.email, 'auth-cache@example.com')
+        self.assertEqual(stored.wallet.wallet_address, 'UQ_cached_save_wallet')
+
+    def test_invalidation_reaches_other_workers(self):
+        """Сброс кэша пользователя удаляет его и из L1 другого воркера"""
+        redis = mock.Mock()
+        redis.get.return_value = None
+        backend = RedisBackend()
+        with mock.patch.object(TieredCache, '_ensure_listener'):
+            local, other = TieredCache(backend), TieredCache(RedisBackend())
+        with mock.patch.object(backend, '_connect', return_value=redis):
+            backend.client()
+
+        key = f'auth:user:{self.user.pk}'
+        with mock.patch('wallet_nalog.authentication.tiered_cache', local):
+            self._authenticate()
+            other.local.set(key, local.local.get(key), 30)
+            redis.publish.reset_mock()
+
+            self.user.is_active = False
+            self.user.save()
+
+        self.assertNotIn(key, local.local)
+        redis.delete.assert_any_call(key)
+        for _, payload in (call.args for call in redis.publish.call_args_list):
+            other.handle_invalidation(payload)
+        self.assertNotIn(key, other.local)
+
+
+class DashboardTests(FixedPriceMixin, APITestCase):
+    """Тесты для сводного эндпоинта дашборда"""
+
+    wallet = 'UQ_dashboard_wallet'
+    ton_price = Decimal('4')
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user_with_wallet('dashboard@example.com', self.wallet)
+        self.client.force_authenticate(self.user)
+        TransactionHistory.objects.create(
+            wallet_address=self.wallet,
+            tx_hash='dash-1',
+            timestamp=datetime(2024, 8, 1, tzinfo=dt_timezone.utc),
+            amount=Decimal('2'),
+            from_address='UQ_other',
+            to_address=self.wallet,
+        )
+        patcher = mock.patch('wallet_nalog.views.threading')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dashboard_combines_sections(self):
+        """Дашборд возвращает баланс, транзакции, налог и курс одним ответом"""
+        info = {'address': self.wallet, 'balance': 2.5, 'is_active': True}
+        with mock.patch('wallet_nalog.views.account_info', new=mock.AsyncMock(return_value=info)):
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['wallet']['wallet_address'], self.wallet)
+        self.assertEqual(response.data['balance']['data']['balance_ton'], '2.500000000')
+        self.assertEqual(response.data['transactions']['data']['count'], 1)
+        self.assertTrue(response.data['tax']['ok'])
+        self.assertEqual(response.data['price']['data']['ton_price_usd'], 4.0)
+
+    def test_failed_section_does_not_break_others(self):
+        """Ошибка получения баланса не мешает остальным секциям"""
+        with mock.patch('wallet_nalog.views.account_info', new=mock.AsyncMock(side_effect=RuntimeError('lite server down'))):
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['balance']['ok'])
+        self.assertIn('lite server down', response.data['balance']['error'])
+        self.assertTrue(response.data['transactions']['ok'])
+        self.assertTrue(response.data['tax']['ok'])
+
+    def test_saturated_pool_skips_network_sections(self):
+        """При заполненном пуле баланс не запрашивается, курс берётся из кэша"""
+        get_ton_price()
+        account = mock.AsyncMock()
+        with mock.patch('wallet_nalog.views._dashboard_inflight', 8), \
+                mock.patch('wallet_nalog.views.account_info', new=account):
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        account.assert_not_called()
+        self.assertFalse(response.data['balance']['ok'])
+        self.assertEqual(response.data['price']['data']['ton_price_usd'], 4.0)
+        self.assertTrue(response.data['tax']['ok'])
+        self.assertEqual(response.data['transactions']['data']['count'], 1)
+
+
+class ServerTimingTests(FixedPriceMixin, APITestCase):
+    """Тесты для Server-Timing и лога медленных запросов"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user_with_wallet('timing@example.com', 'UQ_timing_wallet')
+        self.client.force_authenticate(self.user)
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_server_timing_header_has_db_and_tax_spans(self):
+        """Заголовок Server-Timing содержит время БД, налогового движка и общее"""
+        response = self.client.get(reverse('tax_total'))
+
+        header = response['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn('tax;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_TOP_SPANS=2)
+    def test_slow_request_is_logged_with_query_count(self):
+        """Запрос дольше порога пишется в лог с числом запросов и самыми медленными спанами"""
+        with self.assertLogs('wallet_nalog.slow_requests', level='WARNING') as logs:
+            self.client.get(reverse('tax_total'))
+
+        entry = json.loads(logs.records[0].getMessage().split(' ', 1)[1])
+        self.assertEqual(entry['path'], reverse('tax_total'))
+        self.assertGreater(entry['query_count'], 0)
+        self.assertLessEqual(len(entry['slowest']), 2)
+        self.assertIn('tax', entry['spans'])
+
+
+class MetricsTests(FixedPriceMixin, APITestCase):
+    """Тесты для эндпоинта /metrics и счётчиков приложения"""
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_metrics_endpoint_exposes_prometheus_text(self):
+        """С localhost /metrics отдаёт текстовый формат Prometheus"""
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'wallet_provider_request_seconds', response.content)
+        self.assertIn(b'wallet_transactions_ingested_total', response.content)
+
+    def test_metrics_endpoint_rejects_remote_clients(self):
+        """С адреса вне METRICS_ALLOWED_IPS /metrics недоступен"""
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_token_is_required_when_configured(self):
+        """С METRICS_TOKEN адрес не проверяется, но без токена доступа нет даже с localhost"""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='10.0.0.5', HTTP_AUTHORIZATION='Bearer scrape-secret'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_endpoint_latency_is_labelled_by_route_name(self):
+        """Время ответа пишется в гистограмму с именем маршрута, а не путём"""
+        labels = {'method': 'GET', 'view': 'index', 'status': '200'}
+        before = self.sample('wallet_http_request_seconds_count', **labels)
+
+        self.client.get(reverse('index'))
+
+        self.assertEqual(self.sample('wallet_http_request_seconds_count', **labels), before + 1)
+
+    def test_ingested_transactions_are_counted(self):
+        """Сохранённые транзакции увеличивают wallet_transactions_ingested_total"""
+        before = self.sample('wallet_transactions_ingested_total')
+
+        save_transactions_to_db('UQ_metrics_wallet', [{
+            'transaction_id': {'lt': '1', 'hash': base64.b64encode(bytes(32)).decode()},
+            'utime': 1700000000,
+            'in_msg': {'value': '1000000000', 'source': 'UQ_counterparty'},
+        }])
+
+        self.assertEqual(self.sample('wallet_transactions_ingested_total'), before + 1)
+
+    def test_price_cache_hits_and_misses(self):
+        """Первый запрос курса — промах кэша, повторный — попадание"""
+        miss = self.sample('wallet_cache_requests_total', cache='price', result='miss')
+        hit = self.sample('wallet_cache_requests_total', cache='price', result='hit')
+
+        get_ton_price()
+        get_ton_price()
+
+        self.assertEqual(self.sample('wallet_cache_requests_total', cache='price', result='miss'), miss + 1)
+        self.assertEqual(self.sample('wallet_cache_requests_total', cache='price', result='hit'), hit + 1)
+
+    def test_provider_failure_is_timed_and_counted(self):
+        """Ошибка CoinGecko попадает в гистограмму с outcome=error и в счётчик ошибок синхронизации"""
+        self.price_patcher.stop()
+        failures = self.sample('wallet_sync_failures_total', stage='price')
+        errors = self.sample('wallet_provider_request_seconds_count', provider='coingecko', outcome='error')
+
+        with mock.patch('requests.get', side_effect=ConnectionError('down')):
+            self.assertIsNone(fetch_ton_price_usd())
+
+        self.assertEqual(self.sample('wallet_sync_failures_total', stage='price'), failures + 1)
+        self.assertEqual(
+            self.sample('wallet_provider_request_seconds_count', provider='coingecko', outcome='error'),
+            errors + 1,
+        )
+
+
+class ProfilingTests(FixedPriceMixin, APITestCase):
+    """Тесты для профилирования запросов по ?__profile=1"""
+
+    def setUp(self):
+        super().setUp()
+        self.staff = create_user_with_wallet('staff@example.com', 'UQ_profiled_wallet', is_staff=True)
+
+    def test_staff_request_is_profiled_and_stored(self):
+        """Запрос staff-пользователя с ?__profile=1 сохраняет профиль с pstats и стеками"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.staff.token}')
+
+        response = self.client.get(reverse('tax_total'), {'__profile': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        artifact = ProfileArtifact.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(artifact.endpoint, 'tax_total')
+        self.assertEqual(artifact.wallet_address, 'UQ_profiled_wallet')
+        self.assertEqual(artifact.status_code, 200)
+        stats = marshal.loads(bytes(artifact.pstats_dump))
+        self.assertTrue(any(func[2] == 'calculate_total_tax' for func in stats))
+
+    def test_regular_user_is_not_profiled(self):
+        """Для обычного пользователя параметр __profile игнорируется"""
+        user = User.objects.create_user(
+            email='regular@example.com', password='strongpassword123',
+            wallet=WalletSession.objects.create(session_key='profiling_regular'),
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {user.token}')
+
+        response = self.client.get(reverse('tax_total'), {'__profile': '1'})
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(ProfileArtifact.objects.exists())
+
+    def test_admin_action_and_download(self):
+        """Действие админки ставит профилирование в очередь, задача сохраняет артефакт, он скачивается"""
+        superuser = User.objects.create_superuser(
+            email='admin@example.com', password='strongpassword123',
+            wallet=WalletSession.objects.create(session_key='profiling_admin'),
+        )
+        self.client.force_login(superuser)
+
+        with mock.patch('wallet_nalog.jobs._submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('admin:wallet_nalog_walletsession_changelist'), {
+                    'action': 'profile_total_tax',
+                    '_selected_action': [self.staff.wallet.pk],
+                })
+        job = SyncJob.objects.get(kind=SyncJob.KIND_PROFILE)
+        submit.assert_called_once_with(job.pk)
+        self.assertFalse(ProfileArtifact.objects.exists())
+
+        run_job(job.pk)
+
+        artifact = ProfileArtifact.objects.get(endpoint='admin:calculate_total_tax')
+        job.refresh_from_db()
+        self.assertEqual(job.result['profile_id'], artifact.pk)
+        self.assertEqual(artifact.user, superuser)
+        response = self.client.get(
+            reverse('admin:wallet_nalog_profileartifact_download', args=[artifact.pk, 'pstats'])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(response.content, bytes(artifact.pstats_dump))
+
+
+class SampledLoggingTests(APITestCase):
+    """Тесты для сэмплирования построчных логов загрузки транзакций"""
+
+    def test_sampled_log_keeps_every_nth_and_counts_the_rest(self):
+        """Пишется каждое N-е сообщение, остальные учитываются в счётчике подавленных"""
+        test_logger = logging.getLogger('wallet_nalog.tests.sampled')
+        before = REGISTRY.get_sample_value(
+            'wallet_log_messages_suppressed_total', {'logger': test_logger.name}
+        ) or 0.0
+        item_log = SampledLog(test_logger, every=3)
+
+        with self.assertLogs(test_logger, level='DEBUG') as logs:
+            for i in range(7):
+                item_log.debug("Транзакция %d", i)
+
+        self.assertEqual([record.getMessage() for record in logs.records], ['Транзакция 0', 'Транзакция 3', 'Транзакция 6'])
+        self.assertEqual(item_log.flush(), 4)
+        self.assertEqual(
+            REGISTRY.get_sample_value('wallet_log_messages_suppressed_total', {'logger': test_logger.name}),
+            before + 4,
+        )
+
+    def test_warnings_are_sampled_separately_from_debug(self):
+        """Предупреждения не делят счётчик с отладочными строками и прореживаются своим N"""
+        test_logger = logging.getLogger('wallet_nalog.tests.sampled')
+        item_log = SampledLog(test_logger, every=100, warning_every=2)
+
+        with self.assertLogs(test_logger, level='DEBUG') as logs:
+            for i in range(3):
+                item_log.debug("Транзакция %d", i)
+                item_log.warning("Ошибка %d", i)
+
+        self.assertEqual(
+            [record.getMessage() for record in logs.records],
+            ['Транзакция 0', 'Ошибка 0', 'Ошибка 2'],
+        )
+        self.assertEqual(item_log.flush(), 3)
+
+    @override_settings(LOG_SAMPLE_EVERY=1000)
+    def test_save_transactions_logs_one_summary_line_and_nothing_to_stdout(self):
+        """Загрузка пачки пишет одну итоговую строку INFO и ничего не печатает в stdout"""
+        transactions = [{
+            'transaction_id': {'lt': str(i + 1), 'hash': base64.b64encode(bytes([i]) * 32).decode()},
+            'utime': 1700000000 + i,
+            'in_msg': {'value': '1000000000', 'source': 'UQ_counterparty'},
+        } for i in range(5)]
+        transactions.append({'utime': 1700000100})
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout), self.assertLogs('wallet_nalog.tonservice', level='INFO') as logs:
+            saved = save_transactions_to_db('UQ_sampled_wallet', transactions)
+
+        self.assertEqual(saved, 5)
+        self.assertEqual(stdout.getvalue(), '')
+        summaries = [record.getMessage() for record in logs.records if record.getMessage().startswith('Сохранено транзакций')]
+        self.assertEqual(len(summaries), 1)
+        self.assertIn('5 из 6', summaries[0])
+        self.assertIn('без hash 1', summaries[0])
+
+
+class TransactionHistoryAdminTests(APITestCase):
+    """Тесты для списка транзакций в админке на больших таблицах"""
+
+    counterparty = 'UQCD39VS5jcptHL8vMjEXrzGaRcCVYto7HUn4bpAOg8xqEBI'
+
+    def setUp(self):
+        cache.clear()
+        admin_user = User.objects.create_superuser(email='tx-admin@example.com', password='strongpassword123')
+        self.client.force_login(admin_user)
+        self.hashes = [bytes([i]) * 32 for i in (1, 2, 3)]
+        for i, (tx_hash, when) in enumerate(zip(self.hashes, [
+            datetime(2024, 1, 10, tzinfo=dt_timezone.utc),
+            datetime(2024, 1, 20, tzinfo=dt_timezone.utc),
+            datetime(2024, 3, 5, tzinfo=dt_timezone.utc),
+        ])):
+            TransactionHistory.objects.create(
+                wallet_address='UQ_admin_wallet',
+                tx_hash=tx_hash,
+                timestamp=when,
+                amount=Decimal('1'),
+                from_address=self.counterparty if i == 0 else 'UQ_admin_wallet',
+                to_address='UQ_admin_wallet' if i == 0 else 'UQ_other',
+            )
+
+    def changelist(self, **params):
+        response = self.client.get(reverse('admin:wallet_nalog_transactionhistory_changelist'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [bytes(tx.tx_hash) for tx in response.context['cl'].result_list]
+
+    def test_search_by_full_hash_and_hex_prefix(self):
+        """Хеш ищется целиком и по hex-префиксу"""
+        self.assertEqual(self.changelist(q=self.hashes[1].hex()), [self.hashes[1]])
+        self.assertEqual(self.changelist(q=self.hashes[2].hex()[:10]), [self.hashes[2]])
+
+    def test_search_by_address_uses_interned_accounts(self):
+        """Адрес контрагента ищется по интернированным адресам, кошелёк — по префиксу"""
+        self.assertEqual(self.changelist(q=self.counterparty), [self.hashes[0]])
+        self.assertEqual(len(self.changelist(q='UQ_admin')), 3)
+
+    def test_month_filter_uses_cached_histogram(self):
+        """Фильтр по месяцу строится по гистограмме, которая кэшируется"""
+        self.assertEqual(transaction_month_histogram(), [(date(2024, 3, 1), 1), (date(2024, 1, 1), 2)])
+        with self.assertNumQueries(0):
+            transaction_month_histogram()
+
+        self.assertEqual(sorted(self.changelist(month='2024-01')), self.hashes[:2])
+
+
+class SyncJobTests(APITestCase):
+    """Тесты для фоновых задач синхронизации из админки"""
+
+    wallet = 'UQ_job_wallet'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='jobs@example.com', password='strongpassword123')
+        self.admin.wallet.wallet_address = self.wallet
+        self.admin.wallet.connected = True
+        self.admin.wallet.save()
+        self.client.force_login(self.admin)
+
+    def run_action(self, action, model='walletsession', pk=None):
+        return self.client.post(reverse(f'admin:wallet_nalog_{model}_changelist'), {
+            'action': action,
+            '_selected_action': [pk or self.admin.wallet.pk],
+        })
+
+    def test_admin_action_enqueues_without_running_inline(self):
+        """Действие ставит задачу в очередь и отдаёт её пулу после коммита, повтор не дублирует"""
+        with mock.patch('wallet_nalog.jobs._submit') as submit, \
+                mock.patch('wallet_nalog.jobs.stream_history') as fetch:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.run_action('resync_history')
+            self.run_action('resync_history', model='user', pk=self.admin.pk)
+
+        job = SyncJob.objects.get()
+        self.assertEqual((job.kind, job.wallet_address, job.status), (SyncJob.KIND_RESYNC, self.wallet, SyncJob.STATUS_QUEUED))
+        submit.assert_called_once_with(job.pk)
+        fetch.assert_not_called()
+
+    @override_settings(SYNC_JOB_MIN_INTERVAL=0)
+    def test_resync_job_saves_history_and_reports_progress(self):
+        """Задача обновления загружает историю, сохраняет её и отмечает результат"""
+        job = SyncJob.objects.create(kind=SyncJob.KIND_RESYNC, wallet_address=self.wallet)
+        history = [{
+            'transaction_id': {'lt': '1', 'hash': base64.b64encode(bytes([7]) * 32).decode()},
+            'utime': 1700000000,
+            'in_msg': {'value': '1000000000', 'source': 'UQ_counterparty'},
+        }]
+
+        async def pages(*args):
+            yield history
+
+        with mock.patch('wallet_nalog.tonservice.iter_history_pages', new=pages):
+            run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, SyncJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.result, {'fetched': 1, 'saved': 1})
+        self.assertTrue(TransactionHistory.objects.filter(wallet_address=self.wallet).exists())
+
+    def test_recompute_job_rebuilds_snapshots_and_failures_are_recorded(self):
+        """Пересчёт заново строит срезы; ошибка задачи сохраняется в error"""
+        TransactionHistory.objects.create(
+            wallet_address=self.wallet, tx_hash='job-buy', timestamp=datetime(2024, 1, 10, tzinfo=dt_timezone.utc),
+            amount=Decimal('5'), from_address='UQ_counterparty', to_address=self.wallet,
+        )
+        MonthlyTaxSnapshot.objects.create(wallet_address=self.wallet, period=date(2023, 6, 1))
+        ok = SyncJob.objects.create(kind=SyncJob.KIND_RECOMPUTE, wallet_address=self.wallet)
+        failing = SyncJob.objects.create(kind=SyncJob.KIND_RECOMPUTE, wallet_address='UQ_broken')
+
+        run_job(ok.pk)
+        with mock.patch('wallet_nalog.jobs.rebuild_monthly_snapshots', side_effect=RuntimeError('boom')), \
+                self.assertLogs('wallet_nalog.jobs', level='ERROR'):
+            run_job(failing.pk)
+
+        ok.refresh_from_db()
+        failing.refresh_from_db()
+        self.assertEqual(ok.status, SyncJob.STATUS_SUCCEEDED)
+        self.assertFalse(MonthlyTaxSnapshot.objects.filter(wallet_address=self.wallet, period=date(2023, 6, 1)).exists())
+        self.assertEqual(
+            MonthlyTaxSnapshot.objects.filter(wallet_address=self.wallet).order_by('period').first().period,
+            date(2024, 1, 1),
+        )
+        self.assertEqual((failing.status, failing.error), (SyncJob.STATUS_FAILED, 'boom'))
+
+    @override_settings(SYNC_JOB_STALE_AFTER=600)
+    def test_orphaned_jobs_are_recovered_after_restart(self):
+        """После перезапуска очередь снова уходит в пул, зависшие задачи отмечаются ошибкой"""
+        now = datetime.now(dt_timezone.utc)
+        queued = SyncJob.objects.create(kind=SyncJob.KIND_RESYNC, wallet_address=self.wallet)
+        stale = SyncJob.objects.create(
+            kind=SyncJob.KIND_BACKFILL, wallet_address=self.wallet,
+            status=SyncJob.STATUS_RUNNING, started_at=now - timedelta(hours=1),
+        )
+        recent = SyncJob.objects.create(
+            kind=SyncJob.KIND_RECOMPUTE, wallet_address=self.wallet,
+            status=SyncJob.STATUS_RUNNING, started_at=now - timedelta(minutes=1),
+        )
+
+        with mock.patch('wallet_nalog.jobs._submit') as submit, \
+                self.assertLogs('wallet_nalog.jobs', level='WARNING'):
+            self.assertEqual(recover_orphaned(), (1, 1))
+
+        submit.assert_called_once_with(queued.pk)
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(stale.status, SyncJob.STATUS_FAILED)
+        self.assertIsNotNone(stale.finished_at)
+        self.assertEqual(recent.status, SyncJob.STATUS_RUNNING)
+
+    @override_settings(SYNC_JOB_MIN_INTERVAL=5)
+    def test_provider_throttle_slot_is_shared_through_tiered_cache(self):
+        """Слот провайдера — ключ в tiered_cache: пока он занят, следующий вызов ждёт"""
+        tiered_cache.local.clear()
+        self.addCleanup(tiered_cache.local.clear)
+
+        with mock.patch('wallet_nalog.jobs.time.sleep') as sleep:
+            provider_throttle.wait()
+            sleep.assert_not_called()
+            self.assertIn(PROVIDER_SLOT_KEY, tiered_cache.local)
+
+            # Слот освобождается по TTL; в тесте — во время паузы
+            sleep.side_effect = lambda seconds: tiered_cache.local.delete(PROVIDER_SLOT_KEY)
+            provider_throttle.wait()
+
+        sleep.assert_called_once_with(PROVIDER_SLOT_POLL)
+
+    @override_settings(SYNC_JOB_MIN_INTERVAL=0)
+    def test_provider_throttle_runs_before_every_page(self):
+        """Пауза между обращениями к провайдеру выдерживается на каждой странице TON Center"""
+        page = [{'transaction_id': {'lt': str(i), 'hash': f'h{i}'}, 'utime': 1700000000} for i in range(2)]
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        wait = mock.Mock()
+
+        with mock.patch('requests.get', return_value=response), \
+                mock.patch('wallet_nalog.provider_json.read_items', return_value=(page, {'ok': True})):
+            pages = list(tonservice.iter_toncenter_pages(self.wallet, limit_per_page=2, max_pages=3, before_request=wait))
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(wait.call_count, 3)
+
+
+class ColdStartImportTests(APITestCase):
+    """Старт процесса не тянет TON-стек и Redis"""
+
+    def test_web_boot_stays_within_import_budget(self):
+        """django.setup() и загрузка URL-ов без pytoniq/redis и в пределах бюджета времени импорта"""
+        script = Path(settings.BASE_DIR) / 'scripts' / 'bench_import_time.py'
+        # Бюджет с запасом на медленные CI-машины; главное — запрет тяжёлых модулей
+        proc = subprocess.run(
+            [sys.executable, str(script), '--target', 'web', '--budget-ms', '5000', '--top', '0'],
+            capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stdout + proc.stderr)
+        self.assertNotIn('Загружены при старте', proc.stdout)
+
+
+class WarmupTests(IngestTestMixin, APITestCase):
+    """Прогрев воркера и проба готовности /ready"""
+
+    def setUp(self):
+        super().setUp()
+        warmup._reset_state()
+        self.addCleanup(warmup._reset_state)
+        self.patches = [
+            mock.patch.object(redis_backend, 'client', return_value=None),
+            mock.patch('wallet_nalog.tonservice.get_mainnet_config', return_value={'liteservers': [{}, {}]}),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_ready_reports_503_until_warmup_finishes(self):
+        """До прогрева /ready отвечает 503, после — 200 с результатами шагов"""
+        with mock.patch('wallet_nalog.views.ensure_warmup_started') as start:
+            response = self.client.get(reverse('ready'))
+        start.assert_called_once_with()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'pending')
+
+        warmup.run_warmup(hot_wallets=0)
+
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, 200)
+        steps = response.json()['steps']
+        self.assertEqual(list(steps), ['database', 'redis', 'liteserver_config', 'price', 'sync_jobs'])
+        self.assertTrue(steps['price']['ok'])
+        self.assertEqual(steps['liteserver_config']['detail'], 'liteserver-ов: 2')
+        # Недоступный Redis не мешает готовности
+        self.assertFalse(steps['redis']['ok'])
+
+    def test_hot_wallets_are_preloaded_into_caches(self):
+        """Прогрев кладёт в кэши пользователей активных кошельков и их адреса"""
+        user = create_user_with_wallet('hot@example.com', 'UQ_hot_wallet')
+        AccountAddress.objects.intern('UQ_hot_wallet')
+        AccountAddress.objects.clear_cache()
+        tiered_cache.local.clear()
+
+        results = warmup.run_warmup(hot_wallets=5)
+
+        self.assertEqual(results['hot_wallets']['detail'], 'пользователей: 1, адресов: 1')
+        self.assertIn(f'auth:user:{user.pk}', tiered_cache.local)
+        self.assertIn('UQ_hot_wallet', AccountAddress.objects._cache)
+
+    def test_warmup_command_is_strict_on_request(self):
+        """manage.py warmup печатает шаги; с --strict падает на невыполненном шаге"""
+        out = io.StringIO()
+        call_command('warmup', '--hot-wallets', '0', stdout=out)
+        self.assertIn('liteserver_config', out.getvalue())
+        self.assertIn('Redis недоступен', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'redis'):
+            call_command('warmup', '--strict', stdout=io.StringIO())
+
+    def test_only_server_processes_warm_up_on_start(self):
+        """migrate и другие команды не прогреваются, runserver — только в дочернем процессе"""
+        cases = [
+            (['manage.py', 'migrate'], {}, False),
+            (['manage.py', 'runserver'], {}, False),
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['/venv/bin/gunicorn', 'wallet.wsgi'], {}, True),
+        ]
+        for argv, env, expected in cases:
+            with self.subTest(argv=argv), mock.patch.object(sys, 'argv', argv), \
+                    mock.patch.dict('os.environ', env):
+                self.assertEqual(warmup._is_server_process(), expected)
+
+
+class MainnetConfigCacheTests(APITestCase):
+    """Конфиг сети TON скачивается один раз на процесс"""
+
+    def setUp(self):
+        tonservice._mainnet_config = None
+        self.addCleanup(setattr, tonservice, '_mainnet_config', None)
+
+    def test_config_is_downloaded_once_and_kept_on_failure(self):
+        """Повторные клиенты берут конфиг из памяти; при ошибке обновления остаётся прежний"""
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'liteservers': [{'ip': 1}]}
+        with mock.patch('requests.get', return_value=response) as get:
+            first = tonservice.get_mainnet_config()
+            second = tonservice.get_mainnet_config()
+        self.assertIs(first, second)
+        get.assert_called_once()
+
+        with override_settings(LITESERVER_CONFIG_TTL=0), \
+                mock.patch('requests.get', side_effect=OSError('offline')), \
+                self.assertLogs('wallet_nalog.tonservice', level='WARNING'):
+            self.assertIs(tonservice.get_mainnet_config(), first)
+
+
+class TieredCacheTests(APITestCase):
+    """Двухуровневый кэш: L1 перед Redis, переподключение с задержкой, инвалидация"""
+
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.redis.get.return_value = None
+        self.backend = RedisBackend()
+        with mock.patch.object(TieredCache, '_ensure_listener') as listener:
+            self.cache = TieredCache(self.backend)
+        self.listener = listener
+
+    def connect(self):
+        with mock.patch.object(self.backend, '_connect', return_value=self.redis):
+            self.assertIs(self.backend.client(), self.redis)
+
+    @override_settings(REDIS_RECONNECT_BACKOFF=1.0, REDIS_RECONNECT_BACKOFF_MAX=60.0)
+    def test_reconnect_is_attempted_with_exponential_backoff(self):
+        """Пока задержка не истекла, connect не выполняется; задержка удваивается"""
+        clock = mock.Mock(return_value=100.0)
+        connect = mock.Mock(side_effect=[ConnectionError('refused'), ConnectionError('refused'), self.redis])
+        with mock.patch('wallet_nalog.tiered_cache.time.monotonic', clock), \
+                mock.patch.object(self.backend, '_connect', connect), \
+                self.assertLogs('wallet_nalog.tiered_cache', level='WARNING'):
+            attempts = []
+            for now in (100.0, 100.5, 101.0, 102.5, 103.0, 104.0):
+                clock.return_value = now
+                attempts.append(self.backend.client())
+                if now == 102.5:
+                    health = self.backend.health()
+
+        self.assertEqual(attempts, [None, None, None, None, self.redis, self.redis])
+        self.assertEqual(connect.call_count, 3)
+        self.assertEqual((health['status'], health['failures'], health['retry_in']), ('down', 2, 0.5))
+        self.assertEqual(self.backend.health()['status'], 'up')
+        self.assertEqual(REGISTRY.get_sample_value('wallet_redis_up'), 1.0)
+        self.listener.assert_called_once_with(self.redis)
+
+    @override_settings(CACHE_L1_SIZE=2, CACHE_L1_MAX_VALUE_BYTES=8)
+    def test_reads_are_served_from_bounded_l1(self):
+        """Записанное значение читается из L1; L1 ограничен по числу записей и размеру значения"""
+        self.connect()
+        self.cache.set('a', 'one', 60)
+        self.redis.set.assert_called_once_with('a', 'one', ex=60)
+        channel, payload = self.redis.publish.call_args.args
+        self.assertEqual(channel, settings.CACHE_INVALIDATION_CHANNEL)
+        self.assertEqual(json.loads(payload), {'key': 'a', 'origin': self.cache.origin})
+
+        self.assertEqual(self.cache.get('a'), 'one')
+        self.redis.get.assert_not_called()
+
+        self.cache.set('b', 'two', 60)
+        self.cache.set('c', 'three', 60)
+        self.cache.set('big', 'x' * 100, 60)
+        self.assertNotIn('a', self.cache.local)
+        self.assertNotIn('big', self.cache.local)
+
+        self.redis.get.return_value = 'fresh'
+        self.assertEqual(self.cache.get('a'), 'fresh')
+        self.assertIn('a', self.cache.local)
+
+    def test_invalidation_from_another_worker_drops_l1_entry(self):
+        """Сообщение другого воркера удаляет ключ из L1, своё — игнорируется"""
+        self.cache.local.set('price', '1', 30)
+        self.cache.handle_invalidation(json.dumps({'key': 'price', 'origin': self.cache.origin}))
+        self.assertIn('price', self.cache.local)
+
+        self.cache.handle_invalidation(json.dumps({'key': 'price', 'origin': 'other-worker'}))
+        self.assertNotIn('price', self.cache.local)
+        self.cache.handle_invalidation('not json')
+
+    def test_command_error_switches_to_l1_until_backoff_expires(self):
+        """Ошибка команды Redis переводит кэш на L1 без повторных обращений к Redis"""
+        self.connect()
+        self.redis.get.side_effect = ConnectionError('reset by peer')
+
+        with self.assertLogs('wallet_nalog.tiered_cache', level='WARNING'):
+            self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.backend.status, 'down')
+
+        self.assertFalse(self.cache.set('k', 'v', 60))
+        self.assertEqual(self.cache.get('k'), 'v')
+        self.assertEqual(self.redis.get.call_count, 1)
+        self.redis.set.assert_not_called()
+
+    def test_add_is_shared_through_redis_and_local_without_it(self):
+        """add пишет в Redis через SET NX, а без Redis — в L1 на весь ttl"""
+        self.connect()
+        self.redis.set.return_value = None
+        self.assertFalse(self.cache.add('mark', '1', 900))
+        self.redis.set.assert_called_once_with('mark', '1', px=900000, nx=True)
+
+        with mock.patch.object(self.backend, 'client', return_value=None):
+            self.assertTrue(self.cache.add('mark', '1', 900))
+            self.assertFalse(self.cache.add('mark', '1', 900))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'нужен os.fork')
+    def test_forked_child_reconnects_and_starts_own_listener(self):
+        """Дочерний процесс после fork не наследует клиента и подписчика родителя"""
+        self.addCleanup(redis_backend.reset)
+        self.addCleanup(setattr, tiered_cache, '_listener_pid', None)
+        redis_backend._client = self.redis
+        redis_backend.status = 'up'
+        tiered_cache._listener_pid = os.getpid()
+        tiered_cache.local.set('inherited', '1', 30)
+        parent_origin = tiered_cache.origin
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                state = {
+                    'status': redis_backend.status,
+                    'client': redis_backend._client is not None,
+                    'listener_pid': tiered_cache._listener_pid,
+                    'same_origin': tiered_cache.origin == parent_origin,
+                    'inherited': 'inherited' in tiered_cache.local,
+                }
+                os.write(write_fd, json.dumps(state).encode())
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            state = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+
+        self.assertEqual(state, {
+            'status': 'unknown', 'client': False, 'listener_pid': None,
+            'same_origin': False, 'inherited': False,
+        })
+        self.assertEqual(redis_backend.status, 'up')
+
+
+@override_settings(WEBHOOK_SECRETS=['old-secret', 'hook-secret'])
+class TransactionWebhookTests(IngestTestMixin, APITestCase):
+    """Приём подписанных уведомлений о транзакциях"""
+
+    wallet = 'UQ_hook_wallet'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user_with_wallet('hook@example.com', self.wallet)
+
+    def event(self, lt, prev_lt=None, account=None, body=True):
+        tx_hash = hashlib.sha256(f'hook:{lt}'.encode()).hexdigest()
+        event = {'account': account or self.wallet, 'lt': lt, 'prev_lt': prev_lt, 'tx_hash': tx_hash}
+        if body:
+            event['transaction'] = {
+                'hash': tx_hash, 'lt': lt, 'utime': 1700000000 + lt,
+                'in_msg': {'value': '1000000000', 'source': {'address': 'UQ_hook_sender'}},
+            }
+        return event
+
+    def post(self, delivery_id, events, secret='hook-secret', timestamp=None):
+        body = json.dumps({'delivery_id': delivery_id, 'events': events}).encode()
+        timestamp = str(timestamp or int(time.time()))
+        return self.client.generic(
+            'POST', reverse('transactions_webhook'), body, content_type='application/json',
+            HTTP_X_WEBHOOK_TIMESTAMP=timestamp,
+            HTTP_X_WEBHOOK_SIGNATURE=sign_payload(secret, timestamp, body),
+        )
+
+    def test_unsigned_stale_or_disabled_requests_are_rejected(self):
+        """Чужая подпись и устаревший timestamp — 401, без секретов приём выключен"""
+        events = [self.event(10)]
+        self.assertEqual(self.post('d-1', events, secret='wrong').status_code, 401)
+        self.assertEqual(self.post('d-1', events, timestamp=int(time.time()) - 3600).status_code, 401)
+        with override_settings(WEBHOOK_SECRETS=[]):
+            self.assertEqual(self.post('d-1', events).status_code, 403)
+        self.assertEqual(self.post('d-1', [{'lt': 1}]).status_code, 400)
+        self.assertFalse(WebhookDelivery.objects.exists())
+        self.assertFalse(TransactionHistory.objects.exists())
+
+    def test_out_of_order_batch_is_ingested_once(self):
+        """Пачка сохраняется независимо от порядка событий, повторная доставка не обрабатывается"""
+        events = [self.event(14, 12), self.event(10), self.event(12, 10), self.event(5, account='UQ_stranger')]
+        with mock.patch('wallet_nalog.jobs._submit') as submit:
+            first = self.post('d-1', events, secret='old-secret')
+            again = self.post('d-1', events)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(
+            {k: first.json()[k] for k in ('saved', 'ignored', 'resync', 'duplicate')},
+            {'saved': 3, 'ignored': 1, 'resync': [], 'duplicate': False},
+        )
+        self.assertTrue(again.json()['duplicate'])
+        self.assertEqual(again.json()['saved'], 3)
+        self.assertEqual(
+            list(TransactionHistory.objects.order_by('lt').values_list('lt', flat=True)), [10, 12, 14],
+        )
+        self.assertTrue(MonthlyTaxSnapshot.objects.filter(wallet_address=self.wallet).exists())
+        submit.assert_not_called()
+
+    def test_gaps_and_hash_only_events_queue_reconciliation(self):
+        """Разрыв цепочки и события без тела ставят обновление истории в очередь"""
+        self.post('d-1', [self.event(10)])
+
+        with mock.patch('wallet_nalog.jobs._submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            response = self.post('d-2', [self.event(20, prev_lt=18)])
+            self.post('d-3', [self.event(30, prev_lt=20, body=False)])
+
+        self.assertEqual(response.json()['saved'], 1)
+        self.assertEqual(response.json()['resync'], [self.wallet])
+        job = SyncJob.objects.get()
+        self.assertEqual((job.kind, job.wallet_address), (SyncJob.KIND_RESYNC, self.wallet))
+        submit.assert_called_once_with(job.pk)
+
+    def test_polling_becomes_periodic_reconciliation(self):
+        """После уведомления опрос сети для кошелька откладывается до следующей сверки"""
+        other = 'UQ_polled_wallet'
+        self.assertTrue(reconcile_due(other))
+        self.assertFalse(reconcile_due(other))
+
+        self.post('d-1', [self.event(10)])
+        self.assertFalse(reconcile_due(self.wallet))
+        with override_settings(WEBHOOK_SECRETS=[]):
+            self.assertTrue(reconcile_due(self.wallet))
+
+
+def streamed_response(payload, status_code=200):
+    """Ответ requests, тело которого читается потоком (как при stream=True)."""
+    import requests
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(payload).encode())
+    return response
+
+
+class BloomDedupTests(IngestTestMixin, APITestCase):
+    """Bloom-фильтр известных хешей: дедупликация при загрузке и остановка пагинации"""
+
+    wallet = 'UQ_bloom_wallet'
+
+    def history(self, start, count):
+        return toncenter_history('bloom', start, count, first_lt=1000)
+
+    def test_filter_has_no_false_negatives_and_bounded_false_positives(self):
+        """Все добавленные хеши находятся, доля ложных срабатываний около заданной"""
+        bf = bloom.BloomFilter(1000, 0.01)
+        added = [hashlib.sha256(f'in:{i}'.encode()).digest() for i in range(1000)]
+        for tx_hash in added:
+            bf.add(tx_hash)
+        restored = bloom.BloomFilter.loads(bf.dumps())
+
+        self.assertTrue(all(tx_hash in restored for tx_hash in added))
+        others = (hashlib.sha256(f'out:{i}'.encode()).digest() for i in range(10000))
+        self.assertLess(sum(tx_hash in restored for tx_hash in others), 300)
+
+    @override_settings(BLOOM_MIN_CAPACITY=10)
+    def test_resync_of_known_history_skips_per_row_lookups(self):
+        """Повторная загрузка известной истории не делает запрос на каждую транзакцию"""
+        self.assertEqual(save_transactions_to_db(self.wallet, self.history(0, 50)), 50)
+        # Фильтр переполнился при записи и перестроен с запасом
+        self.assertEqual(bloom.get_filter(self.wallet).capacity, 100)
+
+        with CaptureQueriesContext(connection) as queries:
+            saved = save_transactions_to_db(self.wallet, self.history(0, 100))
+        self.assertEqual(saved, 50)
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 100)
+        # Одна проверка известных хешей до разбора и одна — в транзакции записи перед INSERT
+        lookups = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and '"tx_hash" IN' in q['sql']]
+        self.assertEqual(len(lookups), 2)
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT') and 'INTO "transaction_history"' in q['sql']]
+        self.assertEqual(len(inserts), 1)
+
+    @override_settings(BLOOM_MIN_CAPACITY=10)
+    def test_sync_run_writes_filter_once(self):
+        """Загрузка из нескольких пачек записывает фильтр в tiered_cache один раз, в конце"""
+        key = bloom.BLOOM_CACHE_KEY.format(wallet=self.wallet)
+        pages = [self.history(0, 4), self.history(4, 4), self.history(8, 4)]
+
+        with mock.patch.object(tiered_cache, 'set', wraps=tiered_cache.set) as cache_set:
+            result = parse_pool.ingest_pages(self.wallet, iter(pages))
+
+        self.assertEqual(result['saved'], 12)
+        self.assertEqual([c.args[0] for c in cache_set.call_args_list].count(key), 1)
+        cached = bloom._cached(self.wallet)
+        self.assertEqual(cached.version, WalletDataVersion.current(self.wallet)[0])
+        self.assertTrue(all(tonservice.tx_hash_bytes(tx) in cached for page in pages for tx in page))
+
+    def test_concurrent_insert_of_same_hash_is_counted_as_duplicate(self):
+        """Хеш, вставленный параллельной записью после проверки, не считается сохранённым этой пачкой"""
+        save_transactions_to_db(self.wallet, self.history(0, 1))
+        version, _ = WalletDataVersion.current(self.wallet)
+        bloom._store(self.wallet, bloom.BloomFilter(1000, 0.01, version=version))
+        real = tonservice._existing_hashes
+        # Первая проверка не видит строку — как если бы её закоммитили сразу после SELECT
+        checks = iter([lambda hashes: set(), real])
+
+        with mock.patch('wallet_nalog.tonservice._existing_hashes', side_effect=lambda hashes: next(checks)(hashes)), \
+                mock.patch('wallet_nalog.tonservice.bloom.known_hashes', return_value=set()):
+            saved = save_transactions_to_db(self.wallet, self.history(0, 3))
+
+        self.assertEqual(saved, 2)
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 3)
+
+    def test_stale_filter_falls_back_to_unique_constraint(self):
+        """Фильтр, не знающий о сохранённых хешах, не приводит к ошибкам и дублям"""
+        save_transactions_to_db(self.wallet, self.history(0, 5))
+        version, _ = WalletDataVersion.current(self.wallet)
+        bloom._store(self.wallet, bloom.BloomFilter(1000, 0.01, version=version))
+
+        self.assertEqual(save_transactions_to_db(self.wallet, self.history(0, 7)), 2)
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 7)
+
+    def test_pagination_stops_on_fully_known_page(self):
+        """TON Center не листается дальше страницы, которая целиком уже сохранена"""
+        pages = [self.history(100, 3), self.history(0, 3)]
+        save_transactions_to_db(self.wallet, pages[0])
+
+        def responses():
+            return [streamed_response({'ok': True, 'result': page}) for page in pages]
+
+        def known(page):
+            return bloom.page_known(self.wallet, [tonservice.tx_hash_bytes(tx) for tx in page])
+
+        with mock.patch('requests.get', side_effect=responses()) as get:
+            fetched = tonservice.fetch_all_toncenter_transactions(
+                self.wallet, limit_per_page=3, max_pages=2, stop_when=known,
+            )
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(len(fetched), 3)
+
+        # Без проверки листаются обе страницы, до лимита max_pages
+        with mock.patch('requests.get', side_effect=responses()) as get:
+            fetched = tonservice.fetch_all_toncenter_transactions(self.wallet, limit_per_page=3, max_pages=2)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(len(fetched), 6)
+
+
+class ParsePoolTests(IngestTestMixin, APITestCase):
+    """Разбор транзакций страницами, в том числе в пуле процессов"""
+
+    wallet = 'UQ_parse_wallet'
+
+    def history(self, start, count):
+        return toncenter_history('parse', start, count, first_lt=5000, interval=3600)
+
+    def test_parse_is_pure_and_returns_compact_records(self):
+        """Разбор не обращается к БД и отдаёт только поля для записи"""
+        batch = self.history(0, 3) + self.history(0, 1) + [{'utime': 1700000000}]
+        with self.assertNumQueries(0):
+            records, stats = tonservice.parse_transactions(self.wallet, batch)
+
+        self.assertEqual((stats['total'], stats['duplicates'], stats['skipped'], stats['failed']), (5, 1, 1, 0))
+        self.assertEqual([r['lt'] for r in records], [5000, 5001, 5002])
+        self.assertEqual(
+            set(records[0]), {'tx_hash', 'timestamp', 'amount_nano', 'lt', 'from_address', 'to_address'},
+        )
+        self.assertEqual(records[1]['amount_nano'], 1000000001)
+        self.assertEqual(records[0]['to_address'], self.wallet)
+
+    def test_pages_are_pulled_only_as_fast_as_they_are_consumed(self):
+        """Страница берётся у загрузки, только когда в пуле есть место"""
+        pulled = []
+
+        def pages():
+            for n in range(6):
+                pulled.append(n)
+                yield self.history(n * 2, 2)
+
+        stream = parse_pool.parse_pages(self.wallet, pages(), max_in_flight=2)
+        next(stream)
+        self.assertEqual(pulled, [0])
+
+        with override_settings(PARSE_WORKERS=1):
+            stream = parse_pool.parse_pages(self.wallet, pages(), max_in_flight=2)
+            pulled.clear()
+            with mock.patch.object(parse_pool, '_get_executor') as executor:
+                executor.return_value.submit.side_effect = lambda fn, *args: mock.Mock(result=lambda: fn(*args))
+                next(stream)
+                self.assertEqual(pulled, [0, 1])
+                stream.close()
+
+    @override_settings(PARSE_WORKERS=2, PARSE_MAX_IN_FLIGHT=2)
+    def test_process_pool_matches_inline_parse_and_saves_pages(self):
+        """Пул процессов даёт те же записи, что и разбор на месте; записи сохраняются страницами"""
+        self.addCleanup(parse_pool.shutdown)
+        history = self.history(0, 25)
+        inline, _ = tonservice.parse_transactions(self.wallet, history)
+
+        pooled = [r for records, _ in parse_pool.parse_pages(self.wallet, parse_pool.chunked(history, 10)) for r in records]
+        self.assertEqual(pooled, inline)
+
+        with mock.patch('wallet_nalog.tax_calculator.refresh_monthly_snapshots') as refresh:
+            result = parse_pool.ingest_pages(self.wallet, parse_pool.chunked(history, 10))
+            again = parse_pool.ingest_pages(self.wallet, parse_pool.chunked(self.history(20, 10), 10))
+        self.assertEqual(result, {'fetched': 25, 'saved': 25})
+        self.assertEqual(again, {'fetched': 10, 'saved': 5})
+        self.assertEqual(refresh.call_count, 2)
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 30)
+
+
+class HistoryStreamTests(IngestTestMixin, APITestCase):
+    """Потоковая загрузка истории: память ограничена, частичный прогресс сохраняется"""
+
+    wallet = 'UQ_stream_wallet'
+
+    def setUp(self):
+        super().setUp()
+        self.produced = 0
+
+    def page(self, n, size=5):
+        return toncenter_history('stream', n * size, size, first_lt=9000)
+
+    def pages(self, count, fail_after=None):
+        async def pages(*args):
+            for n in range(count):
+                if n == fail_after:
+                    raise ConnectionError('liteserver timeout')
+                self.produced += 1
+                yield self.page(n)
+        return pages
+
+    @override_settings(PARSE_CHUNK_SIZE=5)
+    def test_fetch_waits_for_writer_and_memory_stays_bounded(self):
+        """Загрузка опережает запись не больше чем на размер очереди"""
+        lag = []
+        store = tonservice.store_records
+
+        def slow_store(*args, **kwargs):
+            lag.append(self.produced - len(lag) - 1)
+            time.sleep(0.01)
+            return store(*args, **kwargs)
+
+        with mock.patch('wallet_nalog.tonservice.iter_history_pages', new=self.pages(20)), \
+                mock.patch('wallet_nalog.tonservice.store_records', side_effect=slow_store):
+            result = history_stream.stream_history(self.wallet, in_flight=2, refresh_snapshots=False)
+
+        self.assertEqual(result, {'fetched': 100, 'saved': 100})
+        self.assertEqual(len(lag), 20)
+        self.assertLessEqual(max(lag), 3)
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 100)
+
+    @override_settings(PARSE_CHUNK_SIZE=5)
+    def test_failed_page_keeps_already_written_chunks(self):
+        """Ошибка на поздней странице не теряет записанное, отметка загрузки не ставится"""
+        with mock.patch('wallet_nalog.tonservice.iter_history_pages', new=self.pages(5, fail_after=3)), \
+                self.assertLogs('wallet_nalog.history_stream', level='ERROR'):
+            result = history_stream.stream_history(self.wallet)
+
+        self.assertEqual((result['fetched'], result['saved']), (15, 15))
+        self.assertIn('liteserver timeout', result['error'])
+        self.assertEqual(TransactionHistory.objects.filter(wallet_address=self.wallet).count(), 15)
+
+        # Повтор дописывает остальное; после полной загрузки сеть не нужна до истечения отметки
+        with mock.patch('wallet_nalog.tonservice.iter_history_pages', new=self.pages(5)):
+            self.assertEqual(history_stream.stream_history(self.wallet), {'fetched': 25, 'saved': 10})
+        with mock.patch('wallet_nalog.tonservice.iter_history_pages') as fetch:
+            self.assertEqual(history_stream.stream_history(self.wallet), {'fetched': 0, 'saved': 0})
+        fetch.assert_not_called()
+
+
+class ProviderJSONTests(APITestCase):
+    """Потоковый разбор ответов провайдеров: только нужные поля, те же записи"""
+
+    wallet = 'UQ_provider_json_wallet'
+
+    def tonapi_transactions(self, count):
+        return [{
+            'hash': hashlib.sha256(f'tonapi:{i}'.encode()).hexdigest(),
+            'lt': 7000 + i,
+            'account': {'address': self.wallet, 'is_scam': False, 'is_wallet': True},
+            'success': True,
+            'utime': 1700000000 + i * 60,
+            'total_fees': 1234,
+            'in_msg': {
+                'msg_type': 'int_msg', 'value': 1000000000 + i, 'bounce': False,
+                'source': {'address': 'UQ_tonapi_sender', 'name': 'sender', 'is_scam': False},
+                'destination': {'address': self.wallet, 'is_scam': False},
+                'raw_body': 'b5ee9c72' * 64,
+                'decoded_body': {'text': f'payment {i}', 'payload': [{'op': 1}, {'op': 2}]},
+            },
+            'out_msgs': [{
+                'value': 5, 'destination': {'address': 'UQ_tonapi_recipient', 'name': None},
+                'raw_body': 'ff' * 32,
+            }],
+            'compute_phase': {'skipped': False, 'success': True, 'gas_used': 3308, 'vm_steps': 68},
+            'raw': 'b5ee9c72' * 256,
+        } for i in range(count)]
+
+    def test_only_needed_fields_are_built(self):
+        """Сообщения, фазы и BOC в запись не попадают, нужные поля — как в полном ответе"""
+        full = self.tonapi_transactions(3)
+        items, meta = provider_json.read_items(io.BytesIO(json.dumps({'transactions': full, 'ok': True}).encode()), 'transactions')
+
+        self.assertEqual(meta, {'ok': True})
+        self.assertEqual(items[0], {
+            'hash': full[0]['hash'], 'lt': 7000, 'utime': 1700000000,
+            'in_msg': {'value': 1000000000, 'source': {'address': 'UQ_tonapi_sender'}},
+            'out_msgs': [{'value': 5, 'destination': {'address': 'UQ_tonapi_recipient'}}],
+        })
+        self.assertEqual(
+            tonservice.parse_transactions(self.wallet, items)[0],
+            tonservice.parse_transactions(self.wallet, full)[0],
+        )
+
+    def test_toncenter_shape_and_errors(self):
+        """У TON Center адреса — строки, ok и error читаются из верхнего уровня"""
+        page = [{
+            '@type': 'raw.transaction', 'utime': 1700000000, 'data': 'te6cck' * 50,
+            'transaction_id': {'@type': 'internal.transactionId', 'lt': '10', 'hash': base64.b64encode(bytes([3]) * 32).decode()},
+            'in_msg': {'source': 'UQ_tc_sender', 'destination': self.wallet, 'value': '42', 'msg_data': {'body': 'te6'}},
+            'out_msgs': [],
+        }]
+        items, meta = provider_json.read_items(io.BytesIO(json.dumps({'ok': True, 'result': page}).encode()), 'result')
+        self.assertEqual(items, [{
+            'utime': 1700000000, 'transaction_id': {'lt': '10', 'hash': page[0]['transaction_id']['hash']},
+            'in_msg': {'source': 'UQ_tc_sender', 'value': '42'}, 'out_msgs': [],
+        }])
+
+        failed = {'ok': False, 'error': 'LITE_SERVER_UNKNOWN', 'code': 500}
+        with mock.patch('requests.get', return_value=streamed_response(failed)), \
+                self.assertLogs('wallet_nalog.tonservice', level='WARNING') as logs:
+            self.assertEqual(tonservice.fetch_all_toncenter_transactions(self.wallet), [])
+        self.assertIn('LITE_SERVER_UNKNOWN', '\n'.join(logs.output))
+
@@ -0,0 +1,342 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса (L1) перед Redis (L2).
+
+- Подключение к Redis берётся из REDIS_URL через общий пул соединений.
+- Если Redis недоступен, повторное подключение выполняется не сразу, а с
+  экспоненциальной задержкой (REDIS_RECONNECT_BACKOFF ... _MAX секунд).
+  Пока задержка не истекла, кэш работает только на L1, и запрос не
+  тратит время на connect.
+- L1 ограничен CACHE_L1_SIZE записями и CACHE_L1_TTL секундами. Значения
+  больше CACHE_L1_MAX_VALUE_BYTES в L1 не кладутся.
+- set и delete публикуют ключ в канал CACHE_INVALIDATION_CHANNEL. Остальные
+  воркеры получают сообщение и удаляют ключ из своего L1. Пока подписка
+  не работает, L1 согласован только в пределах CACHE_L1_TTL.
+- После fork (gunicorn с preload_app) дочерний процесс забывает клиента
+  родителя и подключается заново; при подключении запускается свой
+  подписчик.
+
+Значения — строки (JSON сериализуют вызывающие).
+"""
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from .metrics import REDIS_UP, cache_hit, cache_miss, track_background_thread
+
+logger = logging.getLogger(__name__)
+
+REDIS_STATUS_UNKNOWN = 'unknown'
+REDIS_STATUS_UP = 'up'
+REDIS_STATUS_DOWN = 'down'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _LocalLRU:
+    """LRU с TTL на запись; потокобезопасен."""
+
+    def __init__(self):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > _setting('CACHE_L1_SIZE', 512):
+                self._items.popitem(last=False)
+
+    def add(self, key, value, ttl):
+        """Записывает, только если живого значения нет; True — записано."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return False
+            self._items[key] = (value, time.monotonic() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > _setting('CACHE_L1_SIZE', 512):
+                self._items.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RedisBackend:
+    """
+    Клиент Redis с пулом соединений и состоянием здоровья.
+    client() отдаёт клиента или None, если Redis недоступен и время
+    следующей попытки подключения ещё не наступило.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self.status = REDIS_STATUS_UNKNOWN
+        self.failures = 0
+        self.last_error = ''
+        self._retry_at = 0.0
+        self._on_up = []
+
+    def _connect(self):
+        import redis
+
+        pool = redis.ConnectionPool.from_url(
+            _setting('REDIS_URL', 'redis://localhost:6379/0'),
+            max_connections=_setting('REDIS_MAX_CONNECTIONS', 20),
+            socket_timeout=_setting('REDIS_SOCKET_TIMEOUT', 1.0),
+            socket_connect_timeout=_setting('REDIS_SOCKET_TIMEOUT', 1.0),
+            decode_responses=True,
+        )
+        client = redis.Redis(connection_pool=pool)
+        client.ping()
+        return client
+
+    def _backoff(self):
+        base = _setting('REDIS_RECONNECT_BACKOFF', 1.0)
+        return min(_setting('REDIS_RECONNECT_BACKOFF_MAX', 60.0), base * 2 ** (self.failures - 1))
+
+    def client(self):
+        if self.status == REDIS_STATUS_UP:
+            return self._client
+        if time.monotonic() < self._retry_at:
+            return None
+
+        with self._lock:
+            if self.status == REDIS_STATUS_UP:
+                return self._client
+            if time.monotonic() < self._retry_at:
+                return None
+            try:
+                client = self._connect()
+            except Exception as e:
+                self._set_down(e)
+                return None
+            self._client = client
+            self.status = REDIS_STATUS_UP
+            self.failures = 0
+            self.last_error = ''
+            REDIS_UP.set(1)
+            logger.info("Подключение к Redis установлено")
+        for callback in self._on_up:
+            callback(client)
+        return client
+
+    def _set_down(self, error):
+        self.failures += 1
+        self.status = REDIS_STATUS_DOWN
+        self.last_error = str(error)[:200]
+        self._retry_at = time.monotonic() + self._backoff()
+        self._client = None
+        REDIS_UP.set(0)
+        logger.warning(
+            "Redis недоступен (%s), следующая попытка через %.0f с", self.last_error, self._backoff(),
+        )
+
+    def mark_down(self, error):
+        """Ошибка команды: переходим на L1 до истечения задержки."""
+        with self._lock:
+            if self.status != REDIS_STATUS_DOWN:
+                self._set_down(error)
+
+    def on_up(self, callback):
+        self._on_up.append(callback)
+
+    def health(self):
+        return {
+            'status': self.status,
+            'failures': self.failures,
+            'retry_in': round(max(0.0, self._retry_at - time.monotonic()), 1) if self.status == REDIS_STATUS_DOWN else 0,
+            'last_error': self.last_error,
+        }
+
+    def _after_fork(self):
+        # Сокеты пула общие с родителем, а блокировку мог держать его поток
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Забывает клиента и задержку (тесты, смена REDIS_URL)."""
+        with self._lock:
+            self._client = None
+            self.status = REDIS_STATUS_UNKNOWN
+            self.failures = 0
+            self.last_error = ''
+            self._retry_at = 0.0
+
+
+class TieredCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.local = _LocalLRU()
+        # Свои сообщения об инвалидации воркер пропускает
+        self.origin = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        backend.on_up(self._ensure_listener)
+
+    def _local_ttl(self, ttl):
+        return min(ttl, _setting('CACHE_L1_TTL', 30))
+
+    def _remember(self, key, value, ttl):
+        if len(value) <= _setting('CACHE_L1_MAX_VALUE_BYTES', 256 * 1024):
+            self.local.set(key, value, self._local_ttl(ttl))
+
+    def get(self, key, ttl=None):
+        """
+        Значение из L1, иначе из Redis (с записью в L1 на min(ttl, CACHE_L1_TTL)).
+        None — ключа нет ни на одном уровне.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            cache_hit('l1')
+            return value
+        cache_miss('l1')
+
+        client = self.backend.client()
+        if client is None:
+            return None
+        try:
+            value = client.get(key)
+        except Exception as e:
+            self.backend.mark_down(e)
+            return None
+        if value is not None:
+            self._remember(key, value, ttl or _setting('CACHE_L1_TTL', 30))
+        return value
+
+    def set(self, key, value, ttl):
+        self._remember(key, value, ttl)
+        client = self.backend.client()
+        if client is None:
+            return False
+        try:
+            client.set(key, value, ex=int(ttl))
+            self._publish(client, key)
+        except Exception as e:
+            self.backend.mark_down(e)
+            return False
+        return True
+
+    def add(self, key, value, ttl):
+        """
+        Атомарно записывает ключ, если его ещё нет (SET NX), — общая на все
+        воркеры отметка «уже сделано». True — ключ записан этим вызовом.
+        Без Redis отметка живёт только в L1 этого процесса, но на весь ttl.
+        """
+        client = self.backend.client()
+        if client is None:
+            return self.local.add(key, value, ttl)
+        try:
+            # PX: ttl может быть дробным (паузы между обращениями к провайдерам)
+            return bool(client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+        except Exception as e:
+            self.backend.mark_down(e)
+            return self.local.add(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        client = self.backend.client()
+        if client is None:
+            return False
+        try:
+            client.delete(key)
+            self._publish(client, key)
+        except Exception as e:
+            self.backend.mark_down(e)
+            return False
+        return True
+
+    def _channel(self):
+        return _setting('CACHE_INVALIDATION_CHANNEL', 'wallet:cache:invalidate')
+
+    def _publish(self, client, key):
+        client.publish(self._channel(), json.dumps({'key': key, 'origin': self.origin}))
+
+    def handle_invalidation(self, data):
+        """Сообщение из канала инвалидации: удаляем ключ из L1, если его изменил другой воркер."""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get('origin') != self.origin and message.get('key'):
+            self.local.delete(message['key'])
+
+    def _after_fork(self):
+        # Поток-подписчик родителя в дочерний процесс не переходит
+        self._listener_lock = threading.Lock()
+        self._listener_pid = None
+        self.origin = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Без подписки до подключения L1 ребёнка мог бы разойтись с остальными
+        self.local = _LocalLRU()
+
+    def _ensure_listener(self, client):
+        # После fork поток-подписчик родителя в дочернем процессе не работает
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self.origin = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        threading.Thread(
+            target=self._listen, args=(client,), name='cache-invalidation', daemon=True,
+        ).start()
+
+    def _listen(self, client):
+        with track_background_thread('cache_invalidation'):
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel())
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self.handle_invalidation(message.get('data'))
+            except Exception as e:
+                # Без подписки L1 может разойтись с другими воркерами
+                self.local.clear()
+                self.backend.mark_down(e)
+            finally:
+                with self._listener_lock:
+                    self._listener_pid = None
+
+
+redis_backend = RedisBackend()
+tiered_cache = TieredCache(redis_backend)
+
+
+def _after_fork_in_child():
+    redis_backend._after_fork()
+    tiered_cache._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
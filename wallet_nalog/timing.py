@@ -0,0 +1,139 @@
+"""
+Лёгкие таймеры для разбора времени запроса.
+
+ServerTimingMiddleware (см. middleware.py) создаёт RequestTiming на каждый
+запрос и кладёт его в contextvar. Код приложения оборачивает интересные
+места в span('имя'); если запроса нет (фоновые потоки, management-команды),
+span ничего не делает.
+
+Вложенные span с тем же именем не учитываются повторно: calculate_total_tax
+внутри вызывает calculate_tax_for_all_months, и время налога считается один раз.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import heapq
+import inspect
+import itertools
+import threading
+import time
+
+_current_timing = ContextVar('request_timing', default=None)
+_active_spans = ContextVar('request_timing_active_spans', default=frozenset())
+
+
+class RequestTiming:
+    def __init__(self, top_n=5):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.totals = {}  # имя -> [секунды, количество]
+        self.query_count = 0
+        self._top_n = top_n
+        self._slowest = []  # min-heap из (секунды, seq, имя, детали)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, detail=None):
+        with self._lock:
+            total = self.totals.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+            if name == 'db':
+                self.query_count += 1
+            item = (seconds, next(self._seq), name, detail)
+            if len(self._slowest) < self._top_n:
+                heapq.heappush(self._slowest, item)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        """Обёртка для connection.execute_wrapper: время каждого SQL-запроса."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - started, sql[:200])
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def total(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def slowest(self):
+        return [
+            {'name': name, 'ms': round(seconds * 1000, 2), 'detail': detail}
+            for seconds, _, name, detail in sorted(self._slowest, reverse=True)
+        ]
+
+    def server_timing_header(self):
+        """Значение заголовка Server-Timing: db;dur=12.3;desc="4", ..., total;dur=..."""
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="{count}"'
+            for name, (seconds, count) in sorted(self.totals.items())
+        ]
+        parts.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(parts)
+
+    def summary(self):
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'query_count': self.query_count,
+            'spans': {
+                name: {'ms': round(seconds * 1000, 2), 'count': count}
+                for name, (seconds, count) in self.totals.items()
+            },
+            'slowest': self.slowest(),
+        }
+
+
+def current_timing():
+    return _current_timing.get()
+
+
+def start_timing(top_n=5):
+    """Начинает замер запроса. Возвращает (timing, token) для stop_timing."""
+    timing = RequestTiming(top_n=top_n)
+    return timing, _current_timing.set(timing)
+
+
+def stop_timing(timing, token):
+    timing.finish()
+    _current_timing.reset(token)
+
+
+@contextmanager
+def span(name, detail=None):
+    timing = _current_timing.get()
+    active = _active_spans.get()
+    if timing is None or name in active:
+        yield
+        return
+
+    token = _active_spans.set(active | {name})
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started, detail)
+        _active_spans.reset(token)
+
+
+def timed(name):
+    """Декоратор: весь вызов функции (или корутины) — один span."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, func.__name__):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
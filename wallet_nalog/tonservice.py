@@ -1,91 +1,153 @@
-from pytoniq import LiteClient
-from pytoniq_core import Address
-from .models import WalletSession, TransactionHistory, User
+from .models import WalletSession, TransactionHistory, User, AccountAddress, WalletDataVersion, tx_hash_to_bytes
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
 from django.utils import timezone
 from datetime import datetime
 import asyncio
-import requests
 import logging
 import json
-import redis
+import threading
+import time
+
+from . import bloom
+from .logsampling import SampledLog
+from .metrics import SYNC_FAILURES, TRANSACTIONS_INGESTED, cache_hit, cache_miss, provider_timer, timed_provider
+from .tiered_cache import tiered_cache
+from .timing import span, timed
 
 logger = logging.getLogger(__name__)
 
-# Клиент Redis для кэширования истории транзакций
-_redis_client = None
+# pytoniq и requests импортируются внутри функций: модуль тянут
+# views, admin и tax_calculator, а migrate и эндпоинты авторизации
+# не должны платить за загрузку TON-стека.
+
+# История транзакций в двухуровневом кэше (L1 процесса + Redis), секунды
+TRANSACTIONS_CACHE_TTL = 3600
+
 
-def get_redis_client():
+# Глобальный конфиг сети TON (список liteserver-ов).
+# LiteClient.from_mainnet_config скачивает его заново при каждом создании
+# клиента, поэтому держим копию в памяти процесса.
+TON_GLOBAL_CONFIG_URL = "https://ton.org/global-config.json"
+_mainnet_config = None
+_mainnet_config_loaded_at = 0.0
+_mainnet_config_lock = threading.Lock()
+
+
+def get_mainnet_config():
     """
-    Ленивая инициализация клиента Redis.
-    Если Redis недоступен – возвращаем None и работаем без кэша.
+    Конфиг сети из кэша процесса (LITESERVER_CONFIG_TTL секунд).
+    Если обновить не удалось, отдаём прежний конфиг; без него — исключение.
     """
-    global _redis_client
-    if _redis_client is not None:
-        return _redis_client
-    try:
-        client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
-        # Проверяем соединение
-        client.ping()
-        logger.info("Подключение к Redis успешно установлено")
-        _redis_client = client;
-    except Exception as e:
-        logger.warning(f"Redis недоступен, кэш транзакций отключен: {e}")
-        _redis_client = None
-    return _redis_client
-
+    global _mainnet_config, _mainnet_config_loaded_at
+    ttl = getattr(settings, 'LITESERVER_CONFIG_TTL', 3600)
+    if _mainnet_config is not None and time.monotonic() - _mainnet_config_loaded_at < ttl:
+        return _mainnet_config
 
-def fetch_all_toncenter_transactions(address_str, limit_per_page=100, max_pages=3):
-    url = "https://toncenter.com/api/v2/getTransactions"
-    all_txs = []
-    params = {
-        "address": address_str,
-        "limit": limit_per_page,
-    }
+    with _mainnet_config_lock:
+        if _mainnet_config is not None and time.monotonic() - _mainnet_config_loaded_at < ttl:
+            return _mainnet_config
+        import requests
 
-    for page in range(max_pages):
         try:
-            response = requests.get(url, params=params, timeout=8)
-            logger.info(f"TON Center API (page {page}) статус: {response.status_code}")
+            with span('http', 'ton_config'), provider_timer('ton_config'):
+                response = requests.get(TON_GLOBAL_CONFIG_URL, timeout=10)
+                response.raise_for_status()
+                config = response.json()
+        except Exception as e:
+            if _mainnet_config is None:
+                raise
+            logger.warning("Не удалось обновить конфиг сети TON, используем прежний: %s", e)
+            return _mainnet_config
+        _mainnet_config = config
+        _mainnet_config_loaded_at = time.monotonic()
+        return config
 
-            if response.status_code != 200:
-                logger.error(f"TON Center API ошибка: {response.text[:300]}")
-                break
 
-            data = response.json()
-            if not data.get("ok") or not data.get("result"):
-                logger.warning(f"TON Center API вернул пустой результат или ok!=true: {data}")
-                break
+def _lite_client(timeout):
+    from pytoniq import LiteClient
 
-            result = data["result"]
-            all_txs.extend(result)
-            logger.info(f"TON Center API страница {page}, получено {len(result)} транзакций, всего {len(all_txs)}")
+    return LiteClient.from_config(get_mainnet_config(), ls_i=0, trust_level=2, timeout=timeout)
 
-            if len(result) < limit_per_page:
-                break
 
-            last_tx = result[-1]
-            tx_id = last_tx.get("transaction_id") or last_tx.get("prev_transaction_id") or {}
-            if isinstance(tx_id, dict):
-                lt = tx_id.get("lt")
-                h = tx_id.get("hash")
-            else:
-                lt = h = None
+def iter_toncenter_pages(address_str, limit_per_page=100, max_pages=3, stop_when=None, before_request=None):
+    """
+    Страницы истории из TON Center, от новых к старым, не больше max_pages.
+    stop_when(page) -> True — дальше не листать (страница уже известна);
+    before_request() вызывается перед каждым запросом (ограничение частоты).
+    Ошибка запроса пробрасывается: уже отданные страницы остаются у вызывающего.
+    """
+    import requests
 
-            if not lt or not h:
-                logger.info("Нет lt/hash для продолжения пагинации, останавливаемся")
-                break
+    from .provider_json import response_items
 
-            params["lt"] = lt
-            params["hash"] = h
-        except Exception as e:
-            logger.error(f"Ошибка при пагинации TON Center API: {e}")
-            break
+    url = "https://toncenter.com/api/v2/getTransactions"
+    params = {
+        "address": address_str,
+        "limit": limit_per_page,
+    }
+    total = 0
 
+    for page in range(max_pages):
+        if before_request is not None:
+            before_request()
+        # Тело читается потоком, от транзакции остаются только нужные поля (provider_json)
+        with span('http', 'toncenter'), provider_timer('toncenter'), \
+                requests.get(url, params=params, timeout=8, stream=True) as response:
+            logger.info("TON Center API (page %s) статус: %s", page, response.status_code)
+
+            if response.status_code != 200:
+                logger.error("TON Center API ошибка: %s", response.text[:300])
+                return
+
+            result, meta = response_items(response, 'result')
+        if not meta.get("ok") or not result:
+            logger.warning("TON Center API вернул пустой результат или ok!=true: %s", meta)
+            return
+
+        total += len(result)
+        logger.info("TON Center API страница %s, получено %d транзакций, всего %d", page, len(result), total)
+        yield result
+
+        if len(result) < limit_per_page:
+            return
+        if stop_when is not None and stop_when(result):
+            logger.info("TON Center: страница %d уже сохранена, дальше не листаем", page)
+            return
+
+        last_tx = result[-1]
+        tx_id = last_tx.get("transaction_id") or last_tx.get("prev_transaction_id") or {}
+        if isinstance(tx_id, dict):
+            lt = tx_id.get("lt")
+            h = tx_id.get("hash")
+        else:
+            lt = h = None
+
+        if not lt or not h:
+            logger.info("Нет lt/hash для продолжения пагинации, останавливаемся")
+            return
+
+        params["lt"] = lt
+        params["hash"] = h
+
+
+def fetch_all_toncenter_transactions(address_str, limit_per_page=100, max_pages=3, stop_when=None):
+    """История из TON Center одним списком (см. iter_toncenter_pages)."""
+    all_txs = []
+    try:
+        for page in iter_toncenter_pages(address_str, limit_per_page, max_pages, stop_when):
+            all_txs.extend(page)
+    except Exception as e:
+        logger.error("Ошибка при пагинации TON Center API: %s", e)
     return all_txs
 
 
+@timed('liteclient')
+@timed_provider('liteclient')
 async def account_info(address_str):
-    client = LiteClient.from_mainnet_config(ls_i=0, trust_level=2, timeout=15)
+    from pytoniq_core import Address
+
+    client = _lite_client(timeout=15)
     
     try:
         await client.connect()
@@ -127,14 +189,16 @@ async def account_info(address_str):
         
         return result
     except Exception as e:
-        print(f"Ошибка при получении информации об аккаунте: {e}")
+        logger.warning("Ошибка при получении информации об аккаунте %s: %s", address_str, e)
         return None
     finally:
         await client.close()
 
 
 async def get_balance(address_str, interval=60):
-    client = LiteClient.from_mainnet_config(ls_i=0, trust_level=2, timeout=15)
+    from pytoniq_core import Address
+
+    client = _lite_client(timeout=15)
     
     try:
         await client.connect()
@@ -149,69 +213,80 @@ async def get_balance(address_str, interval=60):
                 
                 if last_balance is not None and current_balance != last_balance:
                     diff = current_balance - last_balance
-                    print(f"Баланс изменился: {last_balance} -> {current_balance} TON ({diff:+.9f})")
+                    logger.info("Баланс изменился: %s -> %s TON (%+.9f)", last_balance, current_balance, diff)
                 
                 last_balance = current_balance
-                print(f"Текущий баланс: {current_balance} TON")
+                logger.debug("Текущий баланс: %s TON", current_balance)
                 
                 await asyncio.sleep(interval)
             except Exception as e:
-                print(f"Ошибка: {e}")
+                logger.warning("Ошибка при получении баланса %s: %s", address_str, e)
                 await asyncio.sleep(interval)
     except Exception as e:
-        print(f"Ошибка подключения: {e}")
+        logger.error("Ошибка подключения к LiteClient: %s", e)
     finally:
         await client.close()
 
 
 
-async def get_history_transaction(address_str):
+async def iter_history_pages(address_str, max_pages=3, max_iterations=5, stop_at_known=True, before_request=None):
     """
-    Получение истории транзакций для адреса.
-    Добавлено кэширование в Redis, чтобы после первого запроса
-    история подгружалась мгновенно и без повторных обращений к внешним API.
+    Асинхронный генератор страниц истории транзакций, от новых к старым.
+    Страница отдаётся сразу после получения; вся история в памяти не
+    собирается. Источник — LiteClient, для аккаунтов без last_transaction_lt
+    — TON API (одна страница до 400 транзакций), затем TON Center.
+
+    max_pages / max_iterations — глубина истории в TON Center и LiteClient;
+    stop_at_known — остановить пагинацию на странице, целиком сохранённой
+    в БД (Bloom-фильтр кошелька, см. bloom.py);
+    before_request — блокирующий вызов перед каждым обращением к провайдеру
+    (выполняется в to_thread), например пауза между запросами задач.
+    Ошибка загрузки пробрасывается после уже отданных страниц.
     """
-    redis_client = get_redis_client()
-    cache_key = None
-    if redis_client is not None:
+    from pytoniq_core import Address
+    import requests
+
+    from .provider_json import response_items
+
+    # Проверка обращается к БД, поэтому вызывается только вне цикла событий (to_thread)
+    page_known = None
+    if stop_at_known:
         try:
-            # Используем дружелюбный адрес как часть ключа
-            addr_obj = Address(address_str)
-            friendly = addr_obj.to_str(is_bounceable=False)
-            cache_key = f"ton:tx:{friendly}"
-            cached = redis_client.get(cache_key)
-            if cached:
-                logger.info(f"Возвращаем транзакции из Redis-кэша для {friendly}")
-                try:
-                    return json.loads(cached)
-                except Exception as e:
-                    logger.warning(f"Не удалось распарсить кэшированные транзакции: {e}, перезаписываем кэш")
-        except Exception as e:
-            logger.warning(f"Ошибка работы с Redis (чтение): {e}")
+            known_wallet = Address(address_str).to_str(is_bounceable=False)
+        except Exception:
+            known_wallet = address_str
+
+        def page_known(page):
+            return bloom.page_known(known_wallet, [h for h in map(tx_hash_bytes, page) if h])
 
-    client = LiteClient.from_mainnet_config(ls_i=0, trust_level=2, timeout=10)
+    async def pace():
+        if before_request is not None:
+            await asyncio.to_thread(before_request)
+
+    client = _lite_client(timeout=10)
 
     try:
-        await client.connect()
-        
-        address = Address(address_str)
-        account_state = await client.get_account_state(address)
-        print(f"Тип account_state: {type(account_state)}")
-        print(f"Атрибуты: {[attr for attr in dir(account_state) if not attr.startswith('_')]}")
-        
-        transactions = []
+        await pace()
+        with provider_timer('liteclient'):
+            await client.connect()
+
+            address = Address(address_str)
+            account_state = await client.get_account_state(address)
+        logger.debug("Тип account_state: %s", type(account_state).__name__)
+
+        total = 0
         current_lt = None
         current_hash = None
-        
+
         if hasattr(account_state, 'last_transaction_lt'):
             current_lt = account_state.last_transaction_lt
-            print(f"Найден last_transaction_lt: {current_lt}")
+            logger.debug("Найден last_transaction_lt: %s", current_lt)
         elif hasattr(account_state, 'account') and hasattr(account_state.account, 'last_transaction_lt'):
             current_lt = account_state.account.last_transaction_lt
-            print(f"Найден last_transaction_lt через account: {current_lt}")
+            logger.debug("Найден last_transaction_lt через account: %s", current_lt)
         elif hasattr(account_state, 'state') and hasattr(account_state.state, 'last_transaction_lt'):
             current_lt = account_state.state.last_transaction_lt
-            print(f"Найден last_transaction_lt через state: {current_lt}")
+            logger.debug("Найден last_transaction_lt через state: %s", current_lt)
         
         if hasattr(account_state, 'last_transaction_hash'):
             current_hash = account_state.last_transaction_hash
@@ -220,61 +295,49 @@ async def get_history_transaction(address_str):
         elif hasattr(account_state, 'state') and hasattr(account_state.state, 'last_transaction_hash'):
             current_hash = account_state.state.last_transaction_hash
         
-        print(f"Получение транзакций для {address_str}, LT: {current_lt}, Hash: {current_hash}")
+        logger.info("Получение транзакций для %s, LT: %s", address_str, current_lt)
         if not current_lt:
-            print("Нет last_transaction_lt, используем внешние API для получения транзакций...")
-            try:
-                address_obj = Address(address_str)
-                address_b64 = address_obj.to_str(is_bounceable=False)
-                print(f"Используем адрес в формате base64: {address_b64}")
-
-                url = f"https://tonapi.io/v2/accounts/{address_b64}/transactions"
-                params = {
-                    "limit": 400 
-                }
-                headers = {"Accept": "application/json"}
-                response = requests.get(url, params=params, headers=headers, timeout=8)
-                print(f"TON API статус: {response.status_code}")
-
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("transactions"):
-                        transactions_data = data["transactions"]
-                        print(f"Получено {len(transactions_data)} транзакций через TON API")
-                        await client.close()
-                        return transactions_data
-                    else:
-                        print(f"TON API вернул пустой результат: {list(data.keys())}")
-
-                print("Пробуем постранично загрузить историю через TON Center API")
-                # Ограничиваемся максимум ~300 транзакциями (3 страницы по 100),
-                # чтобы не ждать слишком долго и не перегружать внешнее API.
-                transactions_data = fetch_all_toncenter_transactions(
-                    address_str,
-                    limit_per_page=100,
-                    max_pages=3,
+            logger.info("Нет last_transaction_lt, используем внешние API для получения транзакций")
+            address_b64 = Address(address_str).to_str(is_bounceable=False)
+            logger.debug("Используем адрес в формате base64: %s", address_b64)
+
+            url = f"https://tonapi.io/v2/accounts/{address_b64}/transactions"
+            params = {
+                "limit": 400
+            }
+            headers = {"Accept": "application/json"}
+            await pace()
+            with span('http', 'tonapi'), provider_timer('tonapi'):
+                response = await asyncio.to_thread(
+                    requests.get, url, params=params, headers=headers, timeout=8, stream=True,
                 )
-                print(f"TON Center (пагинация) вернул {len(transactions_data)} транзакций")
-                await client.close()
-
-                # Сохраняем результат в Redis для ускорения последующих запросов
-                if redis_client is not None and cache_key:
-                    try:
-                        redis_client.set(cache_key, json.dumps(transactions_data), ex=3600)
-                        logger.info(f"История транзакций для {address_b64} сохранена в Redis")
-                    except Exception as e:
-                        logger.warning(f"Ошибка записи транзакций в Redis: {e}")
-
-                return transactions_data
-
-            except Exception as e:
-                print(f"Альтернативный API не сработал: {e}")
-                import traceback
-                traceback.print_exc()
-
-            print("Не удалось получить транзакции, возвращаем пустой список")
-            await client.close()
-            return []
+                with response:
+                    logger.debug("TON API статус: %s", response.status_code)
+                    transactions_data = meta = None
+                    if response.status_code == 200:
+                        # До 400 транзакций с сообщениями и BOC: разбираем потоком,
+                        # не строя полное дерево ответа (provider_json)
+                        transactions_data, meta = await asyncio.to_thread(response_items, response, 'transactions')
+
+            if transactions_data:
+                logger.info("Получено %d транзакций через TON API", len(transactions_data))
+                yield transactions_data
+                return
+            if meta is not None:
+                logger.info("TON API вернул пустой результат: %s", list(meta))
+
+            logger.info("Пробуем постранично загрузить историю через TON Center API")
+            # По умолчанию ограничиваемся ~300 транзакциями (3 страницы по 100),
+            # чтобы не ждать слишком долго и не перегружать внешнее API.
+            pages = iter_toncenter_pages(
+                address_str, limit_per_page=100, max_pages=max_pages, stop_when=page_known,
+                before_request=before_request,
+            )
+            while True:
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    return
+                yield page
 
         if current_hash and not isinstance(current_hash, bytes):
             if hasattr(current_hash, 'hex'):
@@ -288,10 +351,10 @@ async def get_history_transaction(address_str):
                 except:
                     pass
         
-        max_iterations = 5 
         iteration = 0
 
         while current_lt and iteration < max_iterations:
+            await pace()
             try:
                 txs = None
                 if hasattr(client, 'raw_get_account_transactions'):
@@ -310,7 +373,7 @@ async def get_history_transaction(address_str):
                                 limit=20
                             )
                     except Exception as e:
-                        print(f"raw_get_account_transactions не сработал: {e}")
+                        logger.debug("raw_get_account_transactions не сработал: %s", e)
                 
                 if not txs and hasattr(client, 'get_transactions'):
                     try:
@@ -321,7 +384,7 @@ async def get_history_transaction(address_str):
                             limit=10
                         )
                     except Exception as e:
-                        print(f"get_transactions не сработал: {e}")
+                        logger.debug("get_transactions не сработал: %s", e)
                 
                 if not txs and hasattr(client, 'raw_get_transactions'):
                     try:
@@ -332,18 +395,22 @@ async def get_history_transaction(address_str):
                             limit=10
                         )
                     except Exception as e:
-                        print(f"raw_get_transactions не сработал: {e}")
+                        logger.debug("raw_get_transactions не сработал: %s", e)
                 
                 if not txs:
-                    print(f"Не удалось получить транзакции на итерации {iteration}")
+                    logger.info("Не удалось получить транзакции на итерации %d", iteration)
                     break
 
                 if not txs:
-                    print(f"Нет транзакций на итерации {iteration}")
+                    logger.debug("Нет транзакций на итерации %d", iteration)
                     break
                 
-                print(f"Получено {len(txs)} транзакций на итерации {iteration}")
-                transactions.extend(txs)
+                logger.debug("Получено %d транзакций на итерации %d", len(txs), iteration)
+                total += len(txs)
+                yield txs
+                if page_known is not None and await asyncio.to_thread(page_known, txs):
+                    logger.info("LiteClient: страница %d уже сохранена, дальше не листаем", iteration)
+                    break
 
                 if txs:
                     last_tx = txs[-1]
@@ -351,7 +418,7 @@ async def get_history_transaction(address_str):
                     current_hash = getattr(last_tx, 'prev_trans_hash', None)
                     
                     if not current_lt:
-                        print("Достигнут конец истории транзакций")
+                        logger.debug("Достигнут конец истории транзакций")
                         break
                 else:
                     break
@@ -359,30 +426,60 @@ async def get_history_transaction(address_str):
                 iteration += 1
                     
             except Exception as e:
-                print(f"Ошибка при получении транзакций: {e}")
-                import traceback
-                traceback.print_exc()
-                break
+                logger.warning("Ошибка при получении транзакций на итерации %d: %s", iteration, e)
+                raise
         
-        print(f"Всего получено транзакций: {len(transactions)}")
+        logger.info("Всего получено транзакций из LiteClient для %s: %d", address_str, total)
+    finally:
         await client.close()
 
-        # Сохраняем результат в Redis для ускорения последующих запросов
-        if redis_client is not None and cache_key:
+
+@timed('liteclient')
+async def get_history_transaction(address_str, use_cache=True, max_pages=3, max_iterations=5, stop_at_known=True):
+    """
+    Получение истории транзакций для адреса одним списком (см. iter_history_pages).
+    История кэшируется (L1 процесса + Redis, см. tiered_cache), чтобы после
+    первого запроса она подгружалась мгновенно и без обращений к внешним API.
+
+    use_cache=False — не читать кэш (результат всё равно кэшируется).
+    Загрузку с записью в БД без сборки списка выполняет history_stream.
+    """
+    cache_key = None
+    try:
+        # Используем дружелюбный адрес как часть ключа
+        cache_key = f"ton:tx:{_friendly_address(address_str)}"
+        cached = tiered_cache.get(cache_key, TRANSACTIONS_CACHE_TTL) if use_cache else None
+        if cached:
+            cache_hit('transactions_redis')
+            logger.info("Возвращаем транзакции из кэша для %s", address_str)
             try:
-                redis_client.set(cache_key, json.dumps(transactions), ex=3600)
-                logger.info(f"История транзакций (node) для {address_str} сохранена в Redis")
+                return json.loads(cached)
             except Exception as e:
-                logger.warning(f"Ошибка записи транзакций в Redis (node): {e}")
+                logger.warning("Не удалось распарсить кэшированные транзакции: %s, перезаписываем кэш", e)
+        elif use_cache:
+            cache_miss('transactions_redis')
+    except Exception as e:
+        logger.warning("Ошибка чтения кэша транзакций: %s", e)
 
-        return transactions
-        
+    transactions = []
+    try:
+        async for page in iter_history_pages(address_str, max_pages, max_iterations, stop_at_known):
+            transactions.extend(page)
     except Exception as e:
-        print(f"Ошибка подключения: {e}")
-        import traceback
-        traceback.print_exc()
-        await client.close()
-        return []
+        # Неполную историю не кэшируем
+        logger.error("Ошибка при загрузке истории %s: %s", address_str, e, exc_info=True)
+        return transactions
+
+    # Сохраняем результат в кэш для ускорения последующих запросов
+    if cache_key:
+        tiered_cache.set(cache_key, json.dumps(transactions), TRANSACTIONS_CACHE_TTL)
+    return transactions
+
+
+def _friendly_address(address_str):
+    from pytoniq_core import Address
+
+    return Address(address_str).to_str(is_bounceable=False)
 
 
 def save_wallet_to_db(user, wallet_address, wallet_type=None):
@@ -391,6 +488,8 @@ def save_wallet_to_db(user, wallet_address, wallet_type=None):
     Нормализуем адрес в удобочитаемый формат base64 (non-bounceable),
     чтобы он совпадал с тем, что видит пользователь в Tonkeeper (UQ...).
     """
+    from pytoniq_core import Address
+
     try:
         try:
             addr_obj = Address(wallet_address)
@@ -401,245 +500,391 @@ def save_wallet_to_db(user, wallet_address, wallet_type=None):
         user.connect_wallet(friendly_address, wallet_type or 'TON')
         return True
     except Exception as e:
-        print(f"Ошибка при сохранении кошелька: {e}")
+        logger.error("Ошибка при сохранении кошелька: %s", e)
         return False
 
 
-def save_transactions_to_db(wallet_address, transactions):
-    saved_count = 0
-    print(f"Сохранение {len(transactions)} транзакций для {wallet_address}")
-
-    def normalize_address(addr: str) -> str:
-        if not addr:
-            return ''
-        try:
-            return Address(addr).to_str(is_bounceable=False)
-        except Exception:
-            return addr
-    
-    for idx, tx in enumerate(transactions):
-        try:
-            is_dict = isinstance(tx, dict)
-            
-            tx_hash = None
-            if is_dict:
-                if 'hash' in tx:
-                    tx_hash = tx['hash']
-                elif 'transaction_id' in tx:
-                    tx_id = tx['transaction_id']
-                    if isinstance(tx_id, dict):
-                        tx_hash = tx_id.get('hash', '')
-                    else:
-                        tx_hash = str(tx_id)
-                elif 'tx_hash' in tx:
-                    tx_hash = tx['tx_hash']
-            elif hasattr(tx, 'hash'):
-                if hasattr(tx.hash, 'hex'):
-                    tx_hash = tx.hash.hex()
-                else:
-                    tx_hash = str(tx.hash)
-            elif hasattr(tx, 'transaction_id'):
-                tx_hash = str(tx.transaction_id)
+def tx_hash_bytes(tx):
+    """Хеш транзакции провайдера (tonapi, toncenter, LiteClient) в 32 байтах или None."""
+    tx_hash = None
+    if isinstance(tx, dict):
+        if 'hash' in tx:
+            tx_hash = tx['hash']
+        elif 'transaction_id' in tx:
+            tx_id = tx['transaction_id']
+            if isinstance(tx_id, dict):
+                tx_hash = tx_id.get('hash', '')
             else:
-                print(f"Транзакция {idx} не имеет hash, пропускаем")
-                continue
-            
-            if not tx_hash:
-                print(f"Транзакция {idx} имеет пустой hash, пропускаем")
-                continue
-                
-            if TransactionHistory.objects.filter(tx_hash=tx_hash).exists():
-                continue
+                tx_hash = str(tx_id)
+        elif 'tx_hash' in tx:
+            tx_hash = tx['tx_hash']
+    elif hasattr(tx, 'hash'):
+        if hasattr(tx.hash, 'hex'):
+            tx_hash = tx.hash.hex()
+        else:
+            tx_hash = str(tx.hash)
+    elif hasattr(tx, 'transaction_id'):
+        tx_hash = str(tx.transaction_id)
+    return tx_hash_to_bytes(tx_hash) if tx_hash else None
+
+
+def _normalize_address(addr):
+    from pytoniq_core import Address
+
+    if not addr:
+        return ''
+    try:
+        return Address(addr).to_str(is_bounceable=False)
+    except Exception:
+        return addr
 
-            timestamp = timezone.now()
-            if is_dict:
-                utime = tx.get('utime') or tx.get('now') or tx.get('timestamp', 0)
-                if utime:
+
+def parse_transaction(tx, wallet_address, tx_hash, idx=0, item_log=None):
+    """
+    Разбирает транзакцию провайдера в компактную запись для TransactionHistory:
+    tx_hash, timestamp, amount_nano, lt, from_address, to_address.
+    К БД не обращается, поэтому выполняется и в процессах parse_pool.
+    """
+    item_log = item_log or logger
+    is_dict = isinstance(tx, dict)
+
+    # Логическое время транзакции (lt) — порядок транзакций аккаунта в сети
+    lt = None
+    if is_dict:
+        tx_id = tx.get('transaction_id')
+        raw_lt = tx.get('lt') or (tx_id.get('lt') if isinstance(tx_id, dict) else None)
+    else:
+        raw_lt = getattr(tx, 'lt', None)
+    try:
+        lt = int(raw_lt) if raw_lt else None
+    except (TypeError, ValueError):
+        lt = None
+
+    timestamp = timezone.now()
+    if is_dict:
+        utime = tx.get('utime') or tx.get('now') or tx.get('timestamp', 0)
+        if utime:
+            try:
+                if isinstance(utime, str):
                     try:
-                        if isinstance(utime, str):
-                            try:
-                                if 'T' in utime:
-                                    utime_str = utime.replace('Z', '+00:00')
-                                    naive_dt = datetime.strptime(utime_str.split('+')[0].split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                                    timestamp = timezone.make_aware(naive_dt)
-                                else:
-                                    naive_dt = datetime.fromtimestamp(int(utime))
-                                    timestamp = timezone.make_aware(naive_dt)
-                            except:
-                                if utime.isdigit():
-                                    naive_dt = datetime.fromtimestamp(int(utime))
-                                    timestamp = timezone.make_aware(naive_dt)
+                        if 'T' in utime:
+                            utime_str = utime.replace('Z', '+00:00')
+                            naive_dt = datetime.strptime(utime_str.split('+')[0].split('.')[0], '%Y-%m-%dT%H:%M:%S')
+                            timestamp = timezone.make_aware(naive_dt)
                         else:
-                            naive_dt = datetime.fromtimestamp(utime)
+                            naive_dt = datetime.fromtimestamp(int(utime))
                             timestamp = timezone.make_aware(naive_dt)
                     except:
-                        pass
-            elif hasattr(tx, 'now'):
-                try:
-                    naive_dt = datetime.fromtimestamp(tx.now)
-                    timestamp = timezone.make_aware(naive_dt)
-                except:
-                    pass
-            elif hasattr(tx, 'utime'):
-                try:
-                    naive_dt = datetime.fromtimestamp(tx.utime)
+                        if utime.isdigit():
+                            naive_dt = datetime.fromtimestamp(int(utime))
+                            timestamp = timezone.make_aware(naive_dt)
+                else:
+                    naive_dt = datetime.fromtimestamp(utime)
                     timestamp = timezone.make_aware(naive_dt)
-                except:
-                    pass
+            except:
+                pass
+    elif hasattr(tx, 'now'):
+        try:
+            naive_dt = datetime.fromtimestamp(tx.now)
+            timestamp = timezone.make_aware(naive_dt)
+        except:
+            pass
+    elif hasattr(tx, 'utime'):
+        try:
+            naive_dt = datetime.fromtimestamp(tx.utime)
+            timestamp = timezone.make_aware(naive_dt)
+        except:
+            pass
+    
+    amount_nano = 0
+    from_address = ''
+    to_address = wallet_address
+    if is_dict:
+        if 'actions' in tx:
+            for action in tx.get('actions', []):
+                if action.get('type') == 'TonTransfer':
+                    transfer = action.get('TonTransfer', {})
+                    if transfer:
+                        value = transfer.get('amount', 0)
+                        if value:
+                            amount_nano = int(value)
+                            from_address = action.get('sender', {}).get('address', '')
+                            to_address = action.get('recipient', {}).get('address', '')
+                            if to_address == wallet_address or from_address == wallet_address:
+                                break
+        
+        if amount_nano == 0 and ('in_msg' in tx or 'out_msgs' in tx):
+            in_msg = tx.get('in_msg')
+            out_msgs = tx.get('out_msgs', [])
             
-            amount = 0
-            from_address = ''
-            to_address = wallet_address
-            if is_dict:
-                if 'actions' in tx:
-                    for action in tx.get('actions', []):
-                        if action.get('type') == 'TonTransfer':
-                            transfer = action.get('TonTransfer', {})
-                            if transfer:
-                                value = transfer.get('amount', 0)
-                                if value:
-                                    amount = int(value) / 1e9
-                                    from_address = action.get('sender', {}).get('address', '')
-                                    to_address = action.get('recipient', {}).get('address', '')
-                                    if to_address == wallet_address or from_address == wallet_address:
-                                        break
+            if in_msg:
+                msg_value = None
+                if isinstance(in_msg, dict):
+                    msg_value = in_msg.get('value') or in_msg.get('amount')
+                else:
+                    msg_value = getattr(in_msg, 'value', None) or getattr(in_msg, 'amount', None)
                 
-                if amount == 0 and ('in_msg' in tx or 'out_msgs' in tx):
-                    in_msg = tx.get('in_msg')
-                    out_msgs = tx.get('out_msgs', [])
-                    
-                    if in_msg:
-                        msg_value = None
+                if msg_value:
+                    value = int(msg_value) if isinstance(msg_value, (int, str)) else 0
+                    if value > 0:
+                        amount_nano = value
                         if isinstance(in_msg, dict):
-                            msg_value = in_msg.get('value') or in_msg.get('amount')
+                            from_address = in_msg.get('source', {}).get('address', '') if isinstance(in_msg.get('source'), dict) else in_msg.get('source', '')
                         else:
-                            msg_value = getattr(in_msg, 'value', None) or getattr(in_msg, 'amount', None)
-                        
-                        if msg_value:
-                            value = int(msg_value) if isinstance(msg_value, (int, str)) else 0
-                            if value > 0:
-                                amount = value / 1e9
-                                if isinstance(in_msg, dict):
-                                    from_address = in_msg.get('source', {}).get('address', '') if isinstance(in_msg.get('source'), dict) else in_msg.get('source', '')
-                                else:
-                                    from_address = str(getattr(in_msg, 'source', ''))
-                                to_address = wallet_address
+                            from_address = str(getattr(in_msg, 'source', ''))
+                        to_address = wallet_address
+            
+            if amount_nano == 0 and out_msgs:
+                for msg in out_msgs if isinstance(out_msgs, list) else [out_msgs]:
+                    msg_value = None
+                    if isinstance(msg, dict):
+                        msg_value = msg.get('value') or msg.get('amount')
+                    else:
+                        msg_value = getattr(msg, 'value', None) or getattr(msg, 'amount', None)
                     
-                    if amount == 0 and out_msgs:
-                        for msg in out_msgs if isinstance(out_msgs, list) else [out_msgs]:
-                            msg_value = None
+                    if msg_value:
+                        value = int(msg_value) if isinstance(msg_value, (int, str)) else 0
+                        if value > 0:
+                            amount_nano = value
+                            from_address = wallet_address
                             if isinstance(msg, dict):
-                                msg_value = msg.get('value') or msg.get('amount')
+                                to_address = msg.get('destination', {}).get('address', '') if isinstance(msg.get('destination'), dict) else msg.get('destination', '')
                             else:
-                                msg_value = getattr(msg, 'value', None) or getattr(msg, 'amount', None)
-                            
-                            if msg_value:
-                                value = int(msg_value) if isinstance(msg_value, (int, str)) else 0
-                                if value > 0:
-                                    amount = value / 1e9
-                                    from_address = wallet_address
-                                    if isinstance(msg, dict):
-                                        to_address = msg.get('destination', {}).get('address', '') if isinstance(msg.get('destination'), dict) else msg.get('destination', '')
-                                    else:
-                                        to_address = str(getattr(msg, 'destination', ''))
-                                    break
-            elif hasattr(tx, 'in_msg') and tx.in_msg:
-                for msg in tx.in_msg if isinstance(tx.in_msg, list) else [tx.in_msg]:
-                    try:
-                        msg_type = getattr(msg, 'msg_type', None)
-                        if not msg_type:
-                            if hasattr(msg, 'info') and hasattr(msg.info, 'msg_type'):
-                                msg_type = msg.info.msg_type
+                                to_address = str(getattr(msg, 'destination', ''))
+                            break
+    elif hasattr(tx, 'in_msg') and tx.in_msg:
+        for msg in tx.in_msg if isinstance(tx.in_msg, list) else [tx.in_msg]:
+            try:
+                msg_type = getattr(msg, 'msg_type', None)
+                if not msg_type:
+                    if hasattr(msg, 'info') and hasattr(msg.info, 'msg_type'):
+                        msg_type = msg.info.msg_type
+                
+                if msg_type == 'internal' or (hasattr(msg, 'value') and msg.value > 0):
+                    dst = None
+                    if hasattr(msg, 'dst'):
+                        dst = str(msg.dst)
+                    elif hasattr(msg, 'info') and hasattr(msg.info, 'dest'):
+                        dst = str(msg.info.dest)
+                    
+                    if dst and dst == wallet_address:
+                        value = getattr(msg, 'value', 0)
+                        amount_nano = int(value) if value else 0
                         
-                        if msg_type == 'internal' or (hasattr(msg, 'value') and msg.value > 0):
-                            dst = None
-                            if hasattr(msg, 'dst'):
-                                dst = str(msg.dst)
-                            elif hasattr(msg, 'info') and hasattr(msg.info, 'dest'):
-                                dst = str(msg.info.dest)
-                            
-                            if dst and dst == wallet_address:
-                                value = getattr(msg, 'value', 0)
-                                if hasattr(value, '__truediv__'):
-                                    amount = value / 1e9
-                                else:
-                                    amount = value / 1e9 if value else 0
-                                
-                                src = None
-                                if hasattr(msg, 'src'):
-                                    src = str(msg.src)
-                                elif hasattr(msg, 'info') and hasattr(msg.info, 'src'):
-                                    src = str(msg.info.src)
-                                
-                                from_address = src or ''
-                                to_address = wallet_address
-                                break
-                    except Exception as e:
-                        print(f"Ошибка при обработке входящего сообщения: {e}")
-                        continue
-            
-            if amount == 0 and hasattr(tx, 'out_msgs') and tx.out_msgs:
-                for msg in tx.out_msgs if isinstance(tx.out_msgs, list) else [tx.out_msgs]:
-                    try:
-                        msg_type = getattr(msg, 'msg_type', None)
-                        if not msg_type and hasattr(msg, 'info') and hasattr(msg.info, 'msg_type'):
-                            msg_type = msg.info.msg_type
+                        src = None
+                        if hasattr(msg, 'src'):
+                            src = str(msg.src)
+                        elif hasattr(msg, 'info') and hasattr(msg.info, 'src'):
+                            src = str(msg.info.src)
                         
-                        if msg_type == 'internal' or (hasattr(msg, 'value') and msg.value > 0):
-                            src = None
-                            if hasattr(msg, 'src'):
-                                src = str(msg.src)
-                            elif hasattr(msg, 'info') and hasattr(msg.info, 'src'):
-                                src = str(msg.info.src)
-                            
-                            if src and src == wallet_address:
-                                value = getattr(msg, 'value', 0)
-                                if hasattr(value, '__truediv__'):
-                                    amount = value / 1e9
-                                else:
-                                    amount = value / 1e9 if value else 0
-                                
-                                dst = None
-                                if hasattr(msg, 'dst'):
-                                    dst = str(msg.dst)
-                                elif hasattr(msg, 'info') and hasattr(msg.info, 'dest'):
-                                    dst = str(msg.info.dest)
-                                
-                                from_address = wallet_address
-                                to_address = dst or ''
-                                break
-                    except Exception as e:
-                        print(f"Ошибка при обработке исходящего сообщения: {e}")
-                        continue
-            
-            if amount > 0 or True:
-                # Нормализуем адреса перед сохранением, чтобы во всех местах
-                # (админка, фронт, расчёт налога) использовать формат UQ...
-                norm_wallet_address = normalize_address(wallet_address)
-                norm_from_address = normalize_address(from_address)
-                norm_to_address = normalize_address(to_address)
-
-                TransactionHistory.objects.create(
-                    wallet_address=norm_wallet_address,
-                    tx_hash=tx_hash,
-                    timestamp=timestamp,
-                    amount=amount,
-                    from_address=norm_from_address,
-                    to_address=norm_to_address,
-                    status='completed'
-                )
-                saved_count += 1
-                if amount > 0:
-                    print(f"Сохранена транзакция {tx_hash[:16]}... amount={amount} TON")
-                            
+                        from_address = src or ''
+                        to_address = wallet_address
+                        break
+            except Exception as e:
+                item_log.warning("Ошибка при обработке входящего сообщения транзакции %d: %s", idx, e)
+                continue
+    
+    if amount_nano == 0 and hasattr(tx, 'out_msgs') and tx.out_msgs:
+        for msg in tx.out_msgs if isinstance(tx.out_msgs, list) else [tx.out_msgs]:
+            try:
+                msg_type = getattr(msg, 'msg_type', None)
+                if not msg_type and hasattr(msg, 'info') and hasattr(msg.info, 'msg_type'):
+                    msg_type = msg.info.msg_type
+                
+                if msg_type == 'internal' or (hasattr(msg, 'value') and msg.value > 0):
+                    src = None
+                    if hasattr(msg, 'src'):
+                        src = str(msg.src)
+                    elif hasattr(msg, 'info') and hasattr(msg.info, 'src'):
+                        src = str(msg.info.src)
+                    
+                    if src and src == wallet_address:
+                        value = getattr(msg, 'value', 0)
+                        amount_nano = int(value) if value else 0
+                        
+                        dst = None
+                        if hasattr(msg, 'dst'):
+                            dst = str(msg.dst)
+                        elif hasattr(msg, 'info') and hasattr(msg.info, 'dest'):
+                            dst = str(msg.info.dest)
+                        
+                        from_address = wallet_address
+                        to_address = dst or ''
+                        break
+            except Exception as e:
+                item_log.warning("Ошибка при обработке исходящего сообщения транзакции %d: %s", idx, e)
+                continue
+
+    # Нормализуем адреса перед сохранением, чтобы во всех местах
+    # (админка, фронт, расчёт налога) использовать формат UQ...
+    return {
+        'tx_hash': tx_hash,
+        'timestamp': timestamp,
+        'amount_nano': amount_nano,
+        'lt': lt,
+        'from_address': _normalize_address(from_address),
+        'to_address': _normalize_address(to_address),
+    }
+
+
+def parse_transactions(wallet_address, transactions, skip_hashes=()):
+    """
+    Разбор пачки транзакций: (записи, счётчики). Транзакции без hash,
+    повторы внутри пачки и хеши из skip_hashes в записи не попадают.
+    """
+    records = []
+    stats = {'total': len(transactions), 'skipped': 0, 'duplicates': 0, 'failed': 0, 'suppressed': 0}
+    # Построчные сообщения сэмплируются, итоговую строку пишет store_records
+    item_log = SampledLog(logger)
+    seen = set()
+
+    for idx, tx in enumerate(transactions):
+        try:
+            tx_hash = tx_hash_bytes(tx)
+            if tx_hash is None:
+                stats['skipped'] += 1
+                item_log.debug("Транзакция %d не имеет hash, пропускаем", idx)
+                continue
+            if tx_hash in skip_hashes or tx_hash in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(tx_hash)
+            records.append(parse_transaction(tx, wallet_address, tx_hash, idx, item_log))
         except Exception as e:
-            print(f"Ошибка при сохранении транзакции {idx}: {e}")
-            import traceback
-            traceback.print_exc()
+            stats['failed'] += 1
+            item_log.warning("Ошибка при разборе транзакции %d: %s", idx, e, exc_info=True)
             continue
-    
-    print(f"Сохранено транзакций: {saved_count} из {len(transactions)}")
-    return saved_count
+
+    stats['suppressed'] = item_log.flush()
+    return records, stats
+
+
+def _existing_hashes(hashes):
+    """Какие из хешей уже есть в таблице; на PostgreSQL строки блокируются до конца транзакции."""
+    # Проверяем по всей таблице: tx_hash уникален глобально
+    existing = TransactionHistory.objects.select_for_update().filter(tx_hash__in=hashes)
+    return {bytes(tx_hash) for tx_hash in existing.values_list('tx_hash', flat=True)}
+
+
+def _insert_new(objects):
+    """
+    Вставляет пачку одним INSERT и возвращает хеши вставленных строк.
+    Уже сохранённые хеши находятся до вставки в той же транзакции. Если
+    параллельная запись успела вставить тот же хеш между проверкой и INSERT,
+    уникальный индекс откатывает пачку, и она повторяется один раз — повторная
+    проверка видит закоммиченную строку.
+    """
+    for attempt in range(2):
+        try:
+            with db_transaction.atomic():
+                existing = _existing_hashes([obj.tx_hash for obj in objects])
+                new = [obj for obj in objects if obj.tx_hash not in existing]
+                TransactionHistory.objects.bulk_create(new)
+            return {obj.tx_hash for obj in new}
+        except IntegrityError:
+            if attempt:
+                raise
+            logger.info("Пачка транзакций пересеклась с параллельной записью, повторяем")
+
+
+def store_records(wallet_address, records, stats=None, bloom_filter=None, refresh_snapshots=True):
+    """
+    Запись разобранных транзакций одной транзакцией БД (bulk_create).
+    Без bloom_filter уже сохранённые хеши отсекаются здесь (записи пришли
+    из parse_pool без предварительной проверки).
+    refresh_snapshots=False — налоговые срезы пересчитает вызывающий.
+    Возвращает (число сохранённых, самая ранняя сохранённая дата).
+    """
+    stats = dict(stats or {'total': len(records), 'skipped': 0, 'duplicates': 0, 'failed': 0, 'suppressed': 0})
+    item_log = SampledLog(logger)
+    norm_wallet_address = _normalize_address(wallet_address)
+    if bloom_filter is None:
+        bloom_filter = bloom.get_filter(norm_wallet_address)
+        known = bloom.known_hashes(norm_wallet_address, [record['tx_hash'] for record in records], bloom_filter)
+        if known:
+            stats['duplicates'] += sum(1 for record in records if record['tx_hash'] in known)
+            records = [record for record in records if record['tx_hash'] not in known]
+
+    # Адреса интернируем одной пачкой и сравниваем дальше по id
+    address_ids = AccountAddress.objects.intern_many(
+        [norm_wallet_address]
+        + [record['from_address'] for record in records]
+        + [record['to_address'] for record in records]
+    )
+    wallet_id = address_ids.get(norm_wallet_address)
+    objects = []
+    for record in records:
+        from_id = address_ids.get(record['from_address'])
+        to_id = address_ids.get(record['to_address'])
+        objects.append(TransactionHistory(
+            wallet_address=norm_wallet_address,
+            tx_hash=record['tx_hash'],
+            timestamp=record['timestamp'],
+            amount_nano=record['amount_nano'],
+            lt=record['lt'],
+            from_account_id=from_id,
+            to_account_id=to_id,
+            status='completed',
+            direction=TransactionHistory.classify_direction(wallet_id, from_id, to_id),
+        ))
+
+    inserted = set()
+    if objects:
+        try:
+            inserted = _insert_new(objects)
+        except Exception as e:
+            stats['failed'] += len(objects)
+            logger.error("Ошибка при сохранении пачки транзакций для %s: %s", norm_wallet_address, e, exc_info=True)
+        else:
+            stats['duplicates'] += len(objects) - len(inserted)
+
+    saved_records = [record for record in records if record['tx_hash'] in inserted]
+    for record in saved_records:
+        item_log.debug(
+            "Сохранена транзакция %s amount_nano=%d", record['tx_hash'].hex()[:16], record['amount_nano']
+        )
+    saved_count = len(saved_records)
+    saved_hashes = [record['tx_hash'] for record in saved_records]
+    earliest_saved = min((record['timestamp'] for record in saved_records), default=None)
+
+    logger.info(
+        "Сохранено транзакций для %s: %d из %d (дубликатов %d, без hash %d, ошибок %d, подавлено сообщений %d)",
+        norm_wallet_address, saved_count, stats['total'], stats['duplicates'], stats['skipped'], stats['failed'],
+        stats['suppressed'] + item_log.flush(),
+    )
+
+    if saved_count:
+        TRANSACTIONS_INGESTED.inc(saved_count)
+        # Новая версия данных инвалидирует ETag у эндпоинтов чтения
+        WalletDataVersion.bump(norm_wallet_address)
+        bloom.remember(norm_wallet_address, bloom_filter, saved_hashes)
+
+        if refresh_snapshots:
+            refresh_snapshots_since(norm_wallet_address, earliest_saved)
+
+    return saved_count, earliest_saved
+
+
+def refresh_snapshots_since(wallet_address, since):
+    """Пересчитывает налоговые срезы начиная с самого раннего затронутого месяца."""
+    from .tax_calculator import refresh_monthly_snapshots
+    try:
+        refresh_monthly_snapshots(wallet_address, since=since)
+    except Exception as e:
+        SYNC_FAILURES.labels(stage='snapshots').inc()
+        logger.error("Ошибка при обновлении налоговых срезов: %s", e, exc_info=True)
 
 
+def save_transactions_to_db(wallet_address, transactions):
+    logger.debug("Сохранение %d транзакций для %s", len(transactions), wallet_address)
 
+    # Уже сохранённые хеши отсекаем до разбора одной проверкой на пачку
+    # (Bloom-фильтр + один запрос)
+    norm_wallet_address = _normalize_address(wallet_address)
+    hashes = [h for h in (tx_hash_bytes(tx) for tx in transactions) if h]
+    bloom_filter = bloom.get_filter(norm_wallet_address)
+    known = bloom.known_hashes(norm_wallet_address, hashes, bloom_filter)
+
+    records, stats = parse_transactions(wallet_address, transactions, skip_hashes=known)
+    saved_count, _ = store_records(wallet_address, records, stats, bloom_filter=bloom_filter)
+    return saved_count
@@ -5,28 +5,39 @@ from .views import (
     RefreshToken,
     connect_wallet,
     get_tax_for_month,
+    get_tax_month_transactions,
     get_tax_for_all_months,
     get_total_tax,
+    get_monthly_volumes,
     get_wallet_balance,
     get_wallet_transactions,
+    get_dashboard,
     wallet_test_page,
     index_page,
+    metrics,
+    readiness,
+    transactions_webhook,
     tonconnect_manifest
 )
-from .tonservice import account_info
 
 urlpatterns = [
     path('', index_page, name='index'),
     path('app/', index_page, name='app'),
     path('test/', wallet_test_page, name='wallet_test'),
     path('tonconnect-manifest.json', tonconnect_manifest, name='tonconnect_manifest'),
+    path('metrics', metrics, name='metrics'),
+    path('ready', readiness, name='ready'),
+    path('webhooks/transactions/', transactions_webhook, name='transactions_webhook'),
     path('register/', Registration, name='register'),
     path('login/', Login, name='login'),
     path('refresh/', RefreshToken, name='refresh_token'),
     path('Wallet/', connect_wallet, name='Wallet'),
     path('wallet/balance/', get_wallet_balance, name='wallet_balance'),
     path('wallet/transactions/', get_wallet_transactions, name='wallet_transactions'),
+    path('dashboard/', get_dashboard, name='dashboard'),
     path('tax/month/', get_tax_for_month, name='tax_month'),
+    path('tax/month/transactions/', get_tax_month_transactions, name='tax_month_transactions'),
     path('tax/all/', get_tax_for_all_months, name='tax_all_months'),
     path('tax/total/', get_total_tax, name='tax_total'),
+    path('tax/volumes/', get_monthly_volumes, name='tax_monthly_volumes'),
 ]
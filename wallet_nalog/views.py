@@ -1,20 +1,42 @@
+from django.conf import settings
 from django.contrib.auth import login
 from django.shortcuts import render
-from django.http import JsonResponse
-from rest_framework.decorators import api_view, permission_classes 
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.db.models import Q
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from pytoniq_core import Address
-from .models import WalletSession, TransactionHistory, User
-from .tonservice import save_wallet_to_db, account_info, save_transactions_to_db, get_history_transaction
+from .models import WalletSession, TransactionHistory, User, WalletDataVersion
+from .tonservice import save_wallet_to_db, account_info
+from .history_stream import stream_history
+from .price_service import get_ton_price, peek_ton_price
+from .metrics import SYNC_FAILURES, WEBHOOK_DELIVERIES, render_latest, track_background_thread
+from .renderers import UserJSONRenderer
+from .timing import timed
+from .tiered_cache import redis_backend
+from .webhooks import WebhookError, ingest as ingest_webhook, parse_events, reconcile_due, verify_signature
+from .warmup import ensure_started as ensure_warmup_started, readiness as warmup_readiness
 from .serializers import UserLoginSerializer, UserRegistrationSerializer, UserSerializer, WalletSessionSerializer, WalletSessionUpdateSerializer
-from .tax_calculator import calculate_tax_for_month, calculate_tax_for_all_months, calculate_total_tax
+from .tax_calculator import (
+    calculate_tax_for_month, calculate_tax_for_all_months, calculate_total_tax, calculate_monthly_volumes,
+    calculate_month_transactions, parse_fields, resolve_detail, DETAIL_ALL,
+)
 import asyncio
+import contextvars
+import base64
+import hashlib
+import hmac
 import json
 import os
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +46,56 @@ def wallet_test_page(request):
 def index_page(request):
     return render(request, 'wallet_nalog/index.html')
 
+def metrics(request):
+    """
+    Метрики в текстовом формате Prometheus.
+
+    Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <токен>.
+    Иначе доступ только с адресов из METRICS_ALLOWED_IPS — за обратным
+    прокси REMOTE_ADDR равен адресу прокси, и такая проверка не работает.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1']):
+        return HttpResponseForbidden()
+    body, content_type = render_latest()
+    return HttpResponse(body, content_type=content_type)
+
+def readiness(request):
+    """
+    Проба готовности: 200 только после прогрева воркера, до этого 503.
+    Первое обращение запускает прогрев, если он ещё не запущен.
+    """
+    ensure_warmup_started()
+    ready, state = warmup_readiness()
+    return JsonResponse(
+        {'ready': ready, 'status': state['status'], 'steps': state['steps'], 'redis': redis_backend.health()},
+        status=200 if ready else 503,
+    )
+
+
+@csrf_exempt
+@require_POST
+def transactions_webhook(request):
+    """
+    Пачка уведомлений о новых транзакциях, подписанная HMAC (см. webhooks.py).
+    Повтор с тем же delivery_id возвращает прежний результат с duplicate=true.
+    """
+    try:
+        verify_signature(request.body, request.META.get('HTTP_X_WEBHOOK_TIMESTAMP'), request.META.get('HTTP_X_WEBHOOK_SIGNATURE'))
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            raise WebhookError('Тело запроса — не JSON')
+        delivery_id, events = parse_events(payload)
+    except WebhookError as e:
+        WEBHOOK_DELIVERIES.labels(result='rejected').inc()
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(ingest_webhook(delivery_id, events))
+
+
 def tonconnect_manifest(request):
     # Обработка OPTIONS запроса для CORS preflight
     if request.method == 'OPTIONS':
@@ -64,6 +136,7 @@ def tonconnect_manifest(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@renderer_classes([UserJSONRenderer])
 def Registration(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
@@ -77,6 +150,7 @@ def Registration(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@renderer_classes([UserJSONRenderer])
 def Login(request):
     serializer = UserLoginSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
@@ -90,6 +164,7 @@ def Login(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@renderer_classes([UserJSONRenderer])
 def RefreshToken(request):
     """Обновление access токена с помощью refresh токена"""
     refresh_token = request.data.get('refresh_token')
@@ -127,13 +202,8 @@ def connect_wallet(request):
             # Нормализуем адрес кошелька в формат UQ... (base64, non-bounceable),
             # чтобы он совпадал с адресом в Tonkeeper.
             raw_address = wallet_session.wallet_address
-            try:
-                addr_obj = Address(raw_address)
-                friendly_address = addr_obj.to_str(is_bounceable=False)
-                data['wallet_address'] = friendly_address
-            except Exception:
-                # Если что‑то пошло не так, оставляем как есть
-                pass
+            if raw_address:
+                data['wallet_address'] = _normalize_address(raw_address)
 
             return Response(data, status=status.HTTP_200_OK)
         else:
@@ -177,6 +247,64 @@ def connect_wallet(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _conditional(request, *parts, last_modified=None):
+    """
+    Условный GET. ETag строится из пути, query-строки, заголовка Accept
+    (от него зависит формат тела) и переданных частей — версии данных
+    кошелька, курса и т.п. Если клиент прислал совпадающий If-None-Match,
+    возвращается готовый ответ 304 и ничего не вычисляется.
+
+    Возвращает (validators, not_modified_response_или_None).
+    """
+    query = '&'.join(sorted(request.META.get('QUERY_STRING', '').split('&')))
+    raw = '|'.join([request.path, query, request.META.get('HTTP_ACCEPT', ''), *map(str, parts)])
+    etag = quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32])
+    validators = (etag, last_modified)
+
+    not_modified = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if not_modified is not None:
+        _with_validators(not_modified, validators)
+    return validators, not_modified
+
+
+def _with_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Ответ зависит от пользователя: общим кэшам хранить нельзя, браузер — только с ревалидацией
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _tax_conditional(request, wallet_address, quote):
+    """Налоговые ответы зависят от версии данных кошелька и от курса."""
+    version, updated_at = WalletDataVersion.current(wallet_address)
+    last_modified = updated_at
+    if quote.fetched_at:
+        price_time = datetime.fromtimestamp(quote.fetched_at, tz=dt_timezone.utc)
+        last_modified = max(last_modified, price_time) if last_modified else price_time
+    return _conditional(
+        request, 'tax', wallet_address, version, quote.price, quote.stale,
+        last_modified=last_modified,
+    )
+
+
+def _tax_detail_params(request):
+    """
+    ?fields=year,month,total_tax_ton — какие поля месяца вернуть;
+    ?detail=none|sells|all — детализация по операциям.
+    Бросает ValueError с текстом для ответа 400.
+    """
+    fields = parse_fields(request.query_params.get('fields'))
+    detail = resolve_detail(request.query_params.get('detail') or None, fields)
+    return detail, fields
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_tax_for_month(request):
@@ -189,10 +317,12 @@ def get_tax_for_month(request):
         )
     # Нормализуем адрес в тот же формат, в котором он хранится в БД (UQ...)
     wallet_address = wallet_session.wallet_address
+    wallet_address = _normalize_address(wallet_address)
+
     try:
-        wallet_address = Address(wallet_address).to_str(is_bounceable=False)
-    except Exception:
-        pass
+        detail, fields = _tax_detail_params(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     year = request.query_params.get('year')
     month = request.query_params.get('month')
@@ -213,8 +343,15 @@ def get_tax_for_month(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        tax_info = calculate_tax_for_month(wallet_address, year, month)
-        return Response(tax_info, status=status.HTTP_200_OK)
+        quote = get_ton_price()
+        validators, not_modified = _tax_conditional(request, wallet_address, quote)
+        if not_modified is not None:
+            return not_modified
+
+        tax_info = calculate_tax_for_month(
+            wallet_address, year, month, ton_price_usd=quote.price, detail=detail, fields=fields
+        )
+        return _with_validators(Response(tax_info, status=status.HTTP_200_OK), validators)
     
     except ValueError:
         return Response(
@@ -228,6 +365,69 @@ def get_tax_for_month(request):
         )
 
 
+TAX_DETAIL_PAGE_SIZE = 100
+TAX_DETAIL_MAX_PAGE_SIZE = 500
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_tax_month_transactions(request):
+    """Постраничная детализация операций за месяц (?year, ?month, ?detail, ?offset, ?limit)."""
+    wallet_session = request.user.wallet
+    
+    if not wallet_session or not wallet_session.connected:
+        return Response(
+            {'error': 'Кошелек не подключен'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    wallet_address = wallet_session.wallet_address
+    wallet_address = _normalize_address(wallet_address)
+
+    year = request.query_params.get('year')
+    month = request.query_params.get('month')
+    if not year or not month:
+        return Response(
+            {'error': 'Необходимо указать параметры year и month'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        year = int(year)
+        month = int(month)
+        offset = int(request.query_params.get('offset', 0))
+        limit = int(request.query_params.get('limit', TAX_DETAIL_PAGE_SIZE))
+    except ValueError:
+        return Response(
+            {'error': 'Параметры year, month, offset и limit должны быть числами'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if month < 1 or month > 12:
+        return Response(
+            {'error': 'Месяц должен быть от 1 до 12'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    offset = max(0, offset)
+    limit = max(1, min(limit, TAX_DETAIL_MAX_PAGE_SIZE))
+    detail = request.query_params.get('detail') or DETAIL_ALL
+
+    try:
+        quote = get_ton_price()
+        validators, not_modified = _tax_conditional(request, wallet_address, quote)
+        if not_modified is not None:
+            return not_modified
+        page = calculate_month_transactions(
+            wallet_address, year, month, detail=detail, offset=offset, limit=limit, ton_price_usd=quote.price
+        )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response(
+            {'error': f'Ошибка при расчете налога: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    return _with_validators(Response(page, status=status.HTTP_200_OK), validators)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_tax_for_all_months(request):
@@ -240,10 +440,12 @@ def get_tax_for_all_months(request):
         )
     # Нормализуем адрес в формат UQ..., чтобы совпадал с записями TransactionHistory
     wallet_address = wallet_session.wallet_address
+    wallet_address = _normalize_address(wallet_address)
+
     try:
-        wallet_address = Address(wallet_address).to_str(is_bounceable=False)
-    except Exception:
-        pass
+        detail, fields = _tax_detail_params(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     start_year = request.query_params.get('start_year')
     start_month = request.query_params.get('start_month')
@@ -259,16 +461,24 @@ def get_tax_for_all_months(request):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
+        quote = get_ton_price()
+        validators, not_modified = _tax_conditional(request, wallet_address, quote)
+        if not_modified is not None:
+            return not_modified
+
         monthly_taxes = calculate_tax_for_all_months(
             wallet_address,
             start_year=start_year,
-            start_month=start_month
+            start_month=start_month,
+            ton_price_usd=quote.price,
+            detail=detail,
+            fields=fields
         )
         
-        return Response({
+        return _with_validators(Response({
             'monthly_taxes': monthly_taxes,
             'count': len(monthly_taxes)
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK), validators)
     
     except ValueError:
         return Response(
@@ -294,10 +504,12 @@ def get_total_tax(request):
         )
     # Нормализуем адрес в формат UQ..., как в TransactionHistory
     wallet_address = wallet_session.wallet_address
+    wallet_address = _normalize_address(wallet_address)
+
     try:
-        wallet_address = Address(wallet_address).to_str(is_bounceable=False)
-    except Exception:
-        pass
+        detail, fields = _tax_detail_params(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     start_year = request.query_params.get('start_year')
     start_month = request.query_params.get('start_month')
     
@@ -312,13 +524,21 @@ def get_total_tax(request):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
+        quote = get_ton_price()
+        validators, not_modified = _tax_conditional(request, wallet_address, quote)
+        if not_modified is not None:
+            return not_modified
+
         tax_summary = calculate_total_tax(
             wallet_address,
             start_year=start_year,
-            start_month=start_month
+            start_month=start_month,
+            detail=detail,
+            fields=fields,
+            price_quote=quote
         )
         
-        return Response(tax_summary, status=status.HTTP_200_OK)
+        return _with_validators(Response(tax_summary, status=status.HTTP_200_OK), validators)
     
     except ValueError:
         return Response(
@@ -332,6 +552,75 @@ def get_total_tax(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_monthly_volumes(request):
+    wallet_session = request.user.wallet
+    
+    if not wallet_session or not wallet_session.connected:
+        return Response(
+            {'error': 'Кошелек не подключен'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    # Нормализуем адрес в формат UQ..., как в TransactionHistory
+    wallet_address = wallet_session.wallet_address
+    wallet_address = _normalize_address(wallet_address)
+    start_year = request.query_params.get('start_year')
+    start_month = request.query_params.get('start_month')
+    
+    try:
+        if start_year:
+            start_year = int(start_year)
+        else:
+            start_year = None
+        if start_month:
+            start_month = int(start_month)
+            if start_month < 1 or start_month > 12:
+                return Response(
+                    {'error': 'Месяц должен быть от 1 до 12'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            start_month = None
+        
+        quote = get_ton_price()
+        validators, not_modified = _tax_conditional(request, wallet_address, quote)
+        if not_modified is not None:
+            return not_modified
+
+        monthly_volumes = calculate_monthly_volumes(
+            wallet_address,
+            start_year=start_year,
+            start_month=start_month,
+            ton_price_usd=quote.price
+        )
+        
+        return _with_validators(Response({
+            'monthly_volumes': monthly_volumes,
+            'count': len(monthly_volumes)
+        }, status=status.HTTP_200_OK), validators)
+    
+    except ValueError:
+        return Response(
+            {'error': 'Год и месяц должны быть числами'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return Response(
+            {'error': f'Ошибка при расчете объемов: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def _balance_payload(info):
+    return {
+        'address': info['address'],
+        'balance': info['balance'],
+        'is_active': info['is_active'],
+        'balance_ton': f"{info['balance']:.9f}"
+    }
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_wallet_balance(request):
@@ -354,12 +643,13 @@ def get_wallet_balance(request):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
-        return Response({
-            'address': info['address'],
-            'balance': info['balance'],
-            'is_active': info['is_active'],
-            'balance_ton': f"{info['balance']:.9f}"
-        }, status=status.HTTP_200_OK)
+        data = _balance_payload(info)
+        # Баланс берётся из сети, версии данных у него нет: ETag считаем по самому ответу,
+        # так 304 экономит хотя бы передачу и разбор тела на клиенте
+        validators, not_modified = _conditional(request, 'balance', sorted(data.items()))
+        if not_modified is not None:
+            return not_modified
+        return _with_validators(Response(data, status=status.HTTP_200_OK), validators)
     
     except Exception as e:
         return Response(
@@ -368,9 +658,132 @@ def get_wallet_balance(request):
         )
 
 
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 200
+
+
+@timed('address')
+def _normalize_address(addr):
+    """Приводит адрес к удобному формату (UQ...), невалидные строки отдаёт как есть."""
+    if not addr:
+        return ''
+    from pytoniq_core import Address
+
+    try:
+        return Address(addr).to_str(is_bounceable=False)
+    except Exception:
+        return addr
+
+
+def _encode_cursor(tx):
+    """Курсор страницы — позиция транзакции в порядке (timestamp, id)."""
+    raw = f"{tx.timestamp.isoformat()}|{tx.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """Обратное к _encode_cursor. Бросает ValueError на мусорном курсоре."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        ts_raw, pk_raw = raw.rsplit('|', 1)
+        ts = datetime.fromisoformat(ts_raw)
+        pk = int(pk_raw)
+    except Exception:
+        raise ValueError('Некорректный курсор')
+    if ts.tzinfo is None:
+        raise ValueError('Некорректный курсор')
+    return ts, pk
+
+
+def _serialize_transaction(tx):
+    return {
+        'id': tx.pk,
+        'tx_hash': tx.tx_hash_hex,
+        'timestamp': tx.timestamp.isoformat() if tx.timestamp else None,
+        'amount': float(tx.amount),
+        'amount_ton': f"{tx.amount:.9f}",
+        'from_address': _normalize_address(tx.from_address),
+        'to_address': _normalize_address(tx.to_address),
+        'status': tx.status,
+        'created_at': tx.created_at.isoformat() if tx.created_at else None,
+    }
+
+
+def _transactions_page(wallet_address, limit, before=None, after=None):
+    """
+    Страница истории в порядке от новых к старым.
+
+    Keyset-пагинация по (timestamp, id): before — строки старше курсора,
+    after — новее курсора. OFFSET не используется, поэтому стоимость запроса
+    не растёт с номером страницы. Берём limit + 1 строку, чтобы узнать,
+    есть ли продолжение, без отдельного COUNT.
+    """
+    queryset = TransactionHistory.objects.filter(
+        wallet_address=wallet_address
+    ).select_related('from_account', 'to_account')
+
+    if after is not None:
+        ts, pk = after
+        rows = list(
+            queryset.filter(Q(timestamp__gt=ts) | Q(timestamp=ts, id__gt=pk))
+            .order_by('timestamp', 'id')[:limit + 1]
+        )
+        has_newer = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        # Страница получена от курсора вверх, значит более старые строки есть
+        has_older = True
+    else:
+        if before is not None:
+            ts, pk = before
+            queryset = queryset.filter(Q(timestamp__lt=ts) | Q(timestamp=ts, id__lt=pk))
+        rows = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = before is not None
+
+    return {
+        'transactions': [_serialize_transaction(tx) for tx in rows],
+        'count': len(rows),
+        'limit': limit,
+        'has_more': has_older,
+        'next_cursor': _encode_cursor(rows[-1]) if rows and has_older else None,
+        'prev_cursor': _encode_cursor(rows[0]) if rows and has_newer else None,
+    }
+
+
+def _refresh_transactions_in_background(wallet_address):
+    # При включённых уведомлениях опрос сети — только периодическая сверка
+    if not reconcile_due(wallet_address):
+        return
+
+    def update_transactions_background():
+        with track_background_thread('transactions_refresh'):
+            try:
+                logger.info("Начало фонового обновления транзакций для %s", wallet_address)
+                result = stream_history(wallet_address)
+                logger.info("Получено транзакций из блокчейна: %s, сохранено в БД: %s", result['fetched'], result['saved'])
+            except Exception as e:
+                SYNC_FAILURES.labels(stage='transactions').inc()
+                logger.error("Ошибка при обновлении транзакций в фоне: %s", e, exc_info=True)
+
+    thread = threading.Thread(target=update_transactions_background, daemon=True)
+    thread.start()
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_wallet_transactions(request):
+    """
+    История транзакций кошелька с курсорной пагинацией.
+
+    Query-параметры:
+    - limit  — размер страницы (по умолчанию 50, максимум 200);
+    - before — курсор next_cursor: страница более старых транзакций;
+    - after  — курсор prev_cursor: страница более новых транзакций;
+    - refresh=true — перед ответом загрузить историю из блокчейна.
+    """
     wallet_session = request.user.wallet
     
     if not wallet_session or not wallet_session.connected:
@@ -381,104 +794,194 @@ def get_wallet_transactions(request):
     
     wallet_address = wallet_session.wallet_address
     force_refresh = request.query_params.get('refresh', 'false').lower() == 'true'
+
+    try:
+        limit = int(request.query_params.get('limit', TRANSACTIONS_PAGE_SIZE))
+        before_raw = request.query_params.get('before')
+        after_raw = request.query_params.get('after')
+        if before_raw and after_raw:
+            raise ValueError('Нельзя передавать before и after одновременно')
+        before = _decode_cursor(before_raw) if before_raw else None
+        after = _decode_cursor(after_raw) if after_raw else None
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, TRANSACTIONS_MAX_PAGE_SIZE))
+    first_page = before is None and after is None
     
     try:
-        logger.info(f"Запрос транзакций для адреса: {wallet_address}, force_refresh: {force_refresh}")
+        logger.info("Запрос транзакций для адреса: %s, force_refresh: %s", wallet_address, force_refresh)
         # Нормализуем адрес в удобный формат (UQ...) и дальше ВСЮДЫ используем его –
         # и для выборки из БД, и для сохранения, и для ответа фронту.
-        def normalize_address(addr: str) -> str:
-            if not addr:
-                return ''
-            try:
-                return Address(addr).to_str(is_bounceable=False)
-            except Exception:
-                return addr
-
-        normalized_wallet_address = normalize_address(wallet_address)
+        normalized_wallet_address = _normalize_address(wallet_address)
 
         if not force_refresh:
-            db_transactions = TransactionHistory.objects.filter(
-                wallet_address=normalized_wallet_address
-            ).order_by('-timestamp')[:50]
-            
-            if db_transactions.exists():
-                transactions_data = []
-                for tx in db_transactions:
-                    transactions_data.append({
-                        'tx_hash': tx.tx_hash,
-                        'timestamp': tx.timestamp.isoformat() if tx.timestamp else None,
-                        'amount': float(tx.amount),
-                        'amount_ton': f"{tx.amount:.9f}",
-                        'from_address': normalize_address(tx.from_address),
-                        'to_address': normalize_address(tx.to_address),
-                        'status': tx.status,
-                        'created_at': tx.created_at.isoformat() if tx.created_at else None,
-                    })
-                
-                logger.info(f"Возвращаем {len(transactions_data)} транзакций из БД")
-                
-                def update_transactions_background():
-                    try:
-                        logger.info(f"Начало фонового обновления транзакций для {normalized_wallet_address}")
-                        transactions = asyncio.run(get_history_transaction(normalized_wallet_address))
-                        logger.info(f"Получено транзакций из блокчейна: {len(transactions)}")
-                        saved_count = save_transactions_to_db(normalized_wallet_address, transactions)
-                        logger.info(f"Сохранено транзакций в БД: {saved_count}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при обновлении транзакций в фоне: {e}", exc_info=True)
-                
-                thread = threading.Thread(target=update_transactions_background, daemon=True)
-                thread.start()
-                
-                return Response({
-                    'transactions': transactions_data,
-                    'count': len(transactions_data),
+            validators = None
+            version, updated_at = WalletDataVersion.current(normalized_wallet_address)
+            if version:
+                validators, not_modified = _conditional(
+                    request, 'transactions', normalized_wallet_address, version, last_modified=updated_at
+                )
+                if not_modified is not None:
+                    # Клиент уже видел эти данные; синхронизацию с сетью всё равно запускаем,
+                    # иначе новая версия никогда не появится
+                    if first_page:
+                        _refresh_transactions_in_background(normalized_wallet_address)
+                    return not_modified
+
+            page = _transactions_page(normalized_wallet_address, limit, before, after)
+
+            # Следующие страницы отдаём только из БД; к блокчейну идём
+            # лишь при первом открытии истории
+            if page['transactions'] or not first_page:
+                logger.info("Возвращаем %d транзакций из БД", page['count'])
+
+                if first_page:
+                    _refresh_transactions_in_background(normalized_wallet_address)
+
+                page.update({
                     'loaded_from_blockchain': 0,
                     'saved_to_db': 0,
                     'from_cache': True
-                }, status=status.HTTP_200_OK)
+                })
+                response = Response(page, status=status.HTTP_200_OK)
+                return _with_validators(response, validators) if validators else response
         
         logger.info("Транзакций в БД нет, загружаем из блокчейна...")
-        transactions = asyncio.run(get_history_transaction(normalized_wallet_address))
-        logger.info(f"Получено транзакций из блокчейна: {len(transactions)}")
-        
-        saved_count = save_transactions_to_db(normalized_wallet_address, transactions)
-        logger.info(f"Сохранено транзакций в БД: {saved_count}")
-        
-        db_transactions = TransactionHistory.objects.filter(
-            wallet_address=normalized_wallet_address
-        ).order_by('-timestamp')[:50]
-        
-        logger.info(f"Транзакций в БД для адреса {wallet_address}: {db_transactions.count()}")
-        
-        transactions_data = []
-        for tx in db_transactions:
-            transactions_data.append({
-                'tx_hash': tx.tx_hash,
-                'timestamp': tx.timestamp.isoformat() if tx.timestamp else None,
-                'amount': float(tx.amount),
-                'amount_ton': f"{tx.amount:.9f}",
-                'from_address': normalize_address(tx.from_address),
-                'to_address': normalize_address(tx.to_address),
-                'status': tx.status,
-                'created_at': tx.created_at.isoformat() if tx.created_at else None,
-            })
+        # Страницы пишутся в БД по мере загрузки (см. history_stream)
+        result = stream_history(normalized_wallet_address)
+        logger.info("Получено транзакций из блокчейна: %s, сохранено в БД: %s", result['fetched'], result['saved'])
         
-        logger.info(f"Возвращаем {len(transactions_data)} транзакций")
+        page = _transactions_page(normalized_wallet_address, limit, before, after)
+        logger.info("Возвращаем %d транзакций", page['count'])
         
-        return Response({
-            'transactions': transactions_data,
-            'count': len(transactions_data),
-            'loaded_from_blockchain': len(transactions),
-            'saved_to_db': saved_count,
+        page.update({
+            'loaded_from_blockchain': result['fetched'],
+            'saved_to_db': result['saved'],
             'from_cache': False
-        }, status=status.HTTP_200_OK)
+        })
+        return Response(page, status=status.HTTP_200_OK)
     
     except Exception as e:
-        logger.error(f"Ошибка при получении транзакций: {e}", exc_info=True)
-        import traceback
-        traceback.print_exc()
+        logger.error("Ошибка при получении транзакций: %s", e, exc_info=True)
         return Response(
             {'error': f'Ошибка при получении транзакций: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+# Пул для сетевых секций дашборда (LiteClient, CoinGecko). Создаётся при первом
+# запросе размером DASHBOARD_WORKERS. Задача, у которой истёк таймаут ожидания,
+# продолжает занимать поток, поэтому считаем незавершённые задачи и при
+# заполненном пуле новые сетевые секции не запускаем.
+_dashboard_executor = None
+_dashboard_lock = threading.Lock()
+_dashboard_inflight = 0
+
+
+def _dashboard_task_done(future):
+    global _dashboard_inflight
+    with _dashboard_lock:
+        _dashboard_inflight -= 1
+
+
+def _submit_dashboard_task(fn):
+    """Запускает сетевую секцию в пуле. Возвращает Future или None, если пул занят."""
+    global _dashboard_executor, _dashboard_inflight
+    workers = getattr(settings, 'DASHBOARD_WORKERS', 8)
+    with _dashboard_lock:
+        if _dashboard_executor is None:
+            _dashboard_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dashboard')
+        if _dashboard_inflight >= workers:
+            return None
+        _dashboard_inflight += 1
+    # copy_context: спаны из потоков пула попадают в Server-Timing этого запроса
+    future = _dashboard_executor.submit(contextvars.copy_context().run, fn)
+    future.add_done_callback(_dashboard_task_done)
+    return future
+
+
+def _dashboard_section(fn):
+    """Секция дашборда: ошибка одной секции не ломает остальные."""
+    try:
+        return {'ok': True, 'data': fn(), 'error': None}
+    except Exception as e:
+        logger.warning("Секция дашборда не загружена: %s", e)
+        return {'ok': False, 'data': None, 'error': str(e)}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_dashboard(request):
+    """
+    Всё для первого экрана за один запрос: кошелёк, баланс, первая страница
+    транзакций, итог налога и курс.
+
+    Сетевые запросы (баланс из LiteClient, курс) запускаются параллельно
+    в пуле потоков, пока в потоке запроса читаются транзакции и считается
+    налог, поэтому время ответа примерно равно самой медленной секции.
+    Курс из кэша берётся без обращения к CoinGecko; налог ждёт курс, только
+    если в кэше его нет или он устарел. При заполненном пуле сетевые секции
+    не запускаются: баланс возвращается с ошибкой, курс — из кэша.
+    Каждая секция возвращается как {ok, data, error}.
+    """
+    wallet_session = request.user.wallet
+    if not wallet_session or not wallet_session.connected:
+        return Response({'wallet': {'connected': False}}, status=status.HTTP_200_OK)
+
+    wallet_address = _normalize_address(wallet_session.wallet_address)
+    timeout = getattr(settings, 'DASHBOARD_SECTION_TIMEOUT', 10)
+
+    balance_future = _submit_dashboard_task(lambda: asyncio.run(account_info(wallet_address)))
+    # Если курс уже в кэше, CoinGecko не нужен, а налог не ждёт сетевых секций
+    cached_quote = peek_ton_price()
+    price_future = None
+    if cached_quote is None or cached_quote.stale:
+        price_future = _submit_dashboard_task(get_ton_price)
+
+    wallet_data = dict(WalletSessionSerializer(wallet_session).data)
+    wallet_data['wallet_address'] = wallet_address
+
+    # БД читаем в потоке запроса: у него своё соединение и своя транзакция
+    transactions = _dashboard_section(
+        lambda: _transactions_page(wallet_address, TRANSACTIONS_PAGE_SIZE)
+    )
+    if transactions['ok'] and transactions['data']['transactions']:
+        _refresh_transactions_in_background(wallet_address)
+
+    def price_quote():
+        if price_future is not None:
+            return price_future.result(timeout=timeout)
+        if cached_quote is None:
+            raise RuntimeError('Пул дашборда занят, курс в кэше отсутствует')
+        return cached_quote
+
+    # Пока курс свежий в кэше, налог считается параллельно с балансом
+    price = _dashboard_section(price_quote)
+    tax = _dashboard_section(lambda: calculate_total_tax(
+        wallet_address,
+        detail='none',
+        fields=('year', 'month', 'total_tax_ton', 'total_tax_usd'),
+        # Если курс не загрузился, calculate_total_tax запросит его сам
+        price_quote=price['data'],
+    ))
+
+    def balance():
+        if balance_future is None:
+            raise RuntimeError('Пул дашборда занят, баланс не запрошен')
+        info = balance_future.result(timeout=timeout)
+        if info is None:
+            raise RuntimeError('Не удалось получить информацию о кошельке')
+        return _balance_payload(info)
+
+    quote = price['data']
+    return Response({
+        'wallet': wallet_data,
+        'balance': _dashboard_section(balance),
+        'transactions': transactions,
+        'tax': tax,
+        'price': {
+            'ok': price['ok'],
+            'data': {'ton_price_usd': float(quote.price), 'stale': quote.stale} if quote else None,
+            'error': price['error'],
+        },
+    }, status=status.HTTP_200_OK)
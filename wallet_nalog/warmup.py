@@ -0,0 +1,217 @@
+"""
+Прогрев воркера после старта.
+
+Первый запрос после деплоя платил за импорт pytoniq, загрузку конфига
+сети TON, подключение к Redis, запрос курса к CoinGecko и пустые кэши.
+run_warmup выполняет всё это заранее, а /ready отвечает 200 только после
+окончания прогрева — балансировщик не пустит трафик на холодный воркер.
+
+Запуск:
+- автоматически из AppConfig.ready при WARMUP_ON_START (в фоновом потоке);
+- после fork (gunicorn с preload_app) — заново в каждом дочернем процессе;
+- вручную: manage.py warmup;
+- первым обращением к /ready, если прогрев ещё не запускался.
+
+Прогрев же возвращает пулу фоновые задачи, потерянные при перезапуске
+(jobs.recover_orphaned).
+
+Ошибки шагов (Redis или CoinGecko недоступны) не мешают готовности:
+у всех сервисов есть деградированный режим, а шаги видны в ответе /ready.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .metrics import track_background_thread
+from .tiered_cache import redis_backend
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_READY = 'ready'
+
+_lock = threading.Lock()
+_state = {}
+_autostart = False
+
+
+def _reset_state():
+    _state.clear()
+    _state.update(status=STATUS_PENDING, pid=os.getpid(), steps={}, started_at=None, finished_at=None)
+
+
+_reset_state()
+
+
+def _hot_wallets_limit():
+    return getattr(settings, 'WARMUP_HOT_WALLETS', 0)
+
+
+def _warm_database():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return connection.vendor
+
+
+def _warm_redis():
+    # Открывает пул соединений и подписку на инвалидацию L1
+    if redis_backend.client() is None:
+        raise RuntimeError(f"Redis недоступен: {redis_backend.last_error}")
+    return 'подключено'
+
+
+def _warm_liteserver_config():
+    # Заодно импортируется pytoniq — самый тяжёлый из ленивых импортов
+    import pytoniq  # noqa: F401
+
+    from .tonservice import get_mainnet_config
+
+    return f"liteserver-ов: {len(get_mainnet_config().get('liteservers', []))}"
+
+
+def _warm_price():
+    from .price_service import get_ton_price
+
+    quote = get_ton_price()
+    if quote.stale:
+        raise RuntimeError(f'курс устарел, используется {quote.price}')
+    return str(quote.price)
+
+
+def _warm_sync_jobs():
+    from .jobs import recover_orphaned
+
+    queued, failed = recover_orphaned()
+    return f"в пул: {queued}, прервано: {failed}"
+
+
+def _warm_hot_wallets(limit):
+    from .authentication import get_cached_user
+    from .models import AccountAddress, User
+
+    users = list(
+        User.objects.filter(wallet__connected=True, wallet__wallet_address__isnull=False)
+        .order_by('-wallet__updated_at')
+        .values_list('pk', 'wallet__wallet_address')[:limit]
+    )
+    for user_id, _ in users:
+        get_cached_user(user_id)
+    addresses = AccountAddress.objects.preload(address for _, address in users)
+    return f"пользователей: {len(users)}, адресов: {addresses}"
+
+
+def _steps(hot_wallets):
+    steps = [
+        ('database', _warm_database),
+        ('redis', _warm_redis),
+        ('liteserver_config', _warm_liteserver_config),
+        ('price', _warm_price),
+        ('sync_jobs', _warm_sync_jobs),
+    ]
+    if hot_wallets:
+        steps.append(('hot_wallets', lambda: _warm_hot_wallets(hot_wallets)))
+    return steps
+
+
+def run_warmup(hot_wallets=None):
+    """
+    Синхронно выполняет все шаги прогрева.
+    Возвращает {шаг: {'ok', 'ms', 'detail' или 'error'}}.
+    """
+    if hot_wallets is None:
+        hot_wallets = _hot_wallets_limit()
+    with _lock:
+        _state.update(status=STATUS_RUNNING, steps={}, started_at=time.time(), finished_at=None)
+
+    results = {}
+    for name, step in _steps(hot_wallets):
+        started = time.perf_counter()
+        try:
+            result = {'ok': True, 'detail': step()}
+        except Exception as e:
+            logger.warning("Прогрев: шаг %s не выполнен: %s", name, e)
+            result = {'ok': False, 'error': str(e)}
+        result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        results[name] = result
+        with _lock:
+            _state['steps'][name] = result
+
+    with _lock:
+        _state.update(status=STATUS_READY, finished_at=time.time())
+    logger.info(
+        "Прогрев воркера %s завершён за %.0f мс: %s",
+        os.getpid(), sum(r['ms'] for r in results.values()),
+        ', '.join(f"{name}={'ok' if r['ok'] else 'ошибка'}" for name, r in results.items()),
+    )
+    return results
+
+
+def _run_in_background():
+    try:
+        with track_background_thread('warmup'):
+            run_warmup()
+    except Exception as e:
+        logger.error("Прогрев воркера завершился ошибкой: %s", e, exc_info=True)
+        with _lock:
+            _state.update(status=STATUS_READY, finished_at=time.time())
+    finally:
+        close_old_connections()
+
+
+def ensure_started():
+    """Запускает прогрев в фоновом потоке, если в этом процессе он ещё не запускался."""
+    with _lock:
+        if _state['pid'] != os.getpid():
+            _reset_state()
+        if _state['status'] != STATUS_PENDING:
+            return False
+        _state['status'] = STATUS_RUNNING
+    threading.Thread(target=_run_in_background, name='warmup', daemon=True).start()
+    return True
+
+
+def readiness():
+    """(готов ли воркер, копия состояния прогрева для ответа /ready)."""
+    with _lock:
+        if _state['pid'] != os.getpid():
+            _reset_state()
+        snapshot = dict(_state, steps=dict(_state['steps']))
+    return snapshot['status'] == STATUS_READY, snapshot
+
+
+def _is_server_process():
+    """manage.py migrate, shell и т. п. не прогреваем; у runserver — только дочерний процесс автоперезагрузки."""
+    argv = sys.argv
+    if not argv or os.path.basename(argv[0]) not in ('manage.py', 'django-admin'):
+        return True
+    if len(argv) < 2 or argv[1] != 'runserver':
+        return False
+    return '--noreload' in argv or os.environ.get('RUN_MAIN') == 'true'
+
+
+def schedule_on_start():
+    """Вызывается из AppConfig.ready."""
+    global _autostart
+    if not getattr(settings, 'WARMUP_ON_START', False) or not _is_server_process():
+        return
+    _autostart = True
+    ensure_started()
+
+
+def _after_fork_in_child():
+    # Потоки родителя в дочерний процесс не переходят, а блокировка
+    # могла быть захвачена одним из них в момент fork
+    global _lock
+    _lock = threading.Lock()
+    _reset_state()
+    if _autostart:
+        ensure_started()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
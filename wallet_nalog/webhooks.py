@@ -0,0 +1,207 @@
+"""
+Приём уведомлений о транзакциях от провайдера (push вместо опроса).
+
+    POST /api/webhooks/transactions/
+    X-Webhook-Timestamp: <unix-время отправки>
+    X-Webhook-Signature: sha256=<hex HMAC-SHA256(секрет, "<timestamp>.<тело>")>
+
+    {"delivery_id": "...", "events": [
+        {"account": "<адрес кошелька>", "lt": 47000000000001, "prev_lt": 46999999999999,
+         "tx_hash": "<hex|base64>", "transaction": {...}}
+    ]}
+
+transaction — транзакция в формате tonapi или toncenter, она сразу уходит
+в save_transactions_to_db (одним вызовом на кошелёк). События без тела
+(как в SSE-потоке tonapi, где есть только account_id, lt и tx_hash) и
+разрывы цепочки (prev_lt нет ни в пачке, ни в БД — событие пришло раньше
+предыдущего) ставят задачу обновления истории в очередь jobs.
+
+Повторная доставка с тем же delivery_id не обрабатывается второй раз.
+Транзакции, пришедшие не по порядку, сохраняются как есть: налоговые срезы
+пересчитываются с самого раннего затронутого месяца. Пока уведомления
+приходят, опрос сети при открытии истории выполняется не чаще раза в
+WEBHOOK_RECONCILE_INTERVAL секунд (сверка). Отметка сверки хранится в
+tiered_cache и общая для всех воркеров.
+"""
+from collections import defaultdict
+import hashlib
+import hmac
+import logging
+import time
+
+from django.conf import settings
+
+from .metrics import WEBHOOK_DELIVERIES
+from .models import SyncJob, TransactionHistory, WalletSession, WebhookDelivery
+from .tiered_cache import tiered_cache
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'HTTP_X_WEBHOOK_SIGNATURE'
+TIMESTAMP_HEADER = 'HTTP_X_WEBHOOK_TIMESTAMP'
+RECONCILE_CACHE_KEY = 'webhook:reconciled:{wallet}'
+
+
+class WebhookError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _secrets():
+    # Несколько секретов — для ротации без простоя
+    return [s for s in getattr(settings, 'WEBHOOK_SECRETS', []) if s]
+
+
+def webhooks_enabled():
+    return bool(_secrets())
+
+
+def _reconcile_interval():
+    return getattr(settings, 'WEBHOOK_RECONCILE_INTERVAL', 900)
+
+
+def sign_payload(secret, timestamp, body):
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_signature(body, timestamp, signature):
+    """Проверяет подпись и свежесть запроса; при ошибке — WebhookError."""
+    secrets = _secrets()
+    if not secrets:
+        raise WebhookError('Приём уведомлений отключён', status=403)
+    if not timestamp or not signature:
+        raise WebhookError('Нет подписи запроса', status=401)
+    try:
+        skew = abs(time.time() - int(timestamp))
+    except ValueError:
+        raise WebhookError('Неверный X-Webhook-Timestamp', status=401)
+    if skew > getattr(settings, 'WEBHOOK_MAX_SKEW', 300):
+        raise WebhookError('Запрос устарел', status=401)
+    if not any(hmac.compare_digest(sign_payload(secret, timestamp, body), signature) for secret in secrets):
+        raise WebhookError('Неверная подпись', status=401)
+
+
+def _normalize(address):
+    from pytoniq_core import Address
+
+    try:
+        return Address(address).to_str(is_bounceable=False)
+    except Exception:
+        return address
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_lt(event):
+    tx = event.get('transaction') or {}
+    tx_id = tx.get('transaction_id') if isinstance(tx.get('transaction_id'), dict) else {}
+    return _int_or_none(event.get('lt') or tx.get('lt') or tx_id.get('lt'))
+
+
+def _event_prev_lt(event):
+    tx = event.get('transaction') or {}
+    return _int_or_none(event.get('prev_lt') or tx.get('prev_trans_lt'))
+
+
+def parse_events(payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get('events'), list):
+        raise WebhookError('Ожидается объект с полем events')
+    delivery_id = str(payload.get('delivery_id') or '').strip()
+    if not delivery_id or len(delivery_id) > 100:
+        raise WebhookError('Нужен delivery_id (до 100 символов)')
+    events = payload['events']
+    if len(events) > getattr(settings, 'WEBHOOK_MAX_EVENTS', 1000):
+        raise WebhookError('Слишком много событий в пачке', status=413)
+    for event in events:
+        if not isinstance(event, dict) or not (event.get('account') or event.get('account_id')):
+            raise WebhookError('У каждого события должен быть account')
+        if event.get('transaction') is not None and not isinstance(event['transaction'], dict):
+            raise WebhookError('transaction должен быть объектом')
+    return delivery_id, events
+
+
+def reconcile_due(wallet_address):
+    """
+    Нужно ли сейчас опрашивать сеть для кошелька.
+    Без уведомлений — всегда; с ними — раз в WEBHOOK_RECONCILE_INTERVAL секунд.
+    """
+    if not webhooks_enabled():
+        return True
+    return tiered_cache.add(RECONCILE_CACHE_KEY.format(wallet=wallet_address), '1', _reconcile_interval())
+
+
+def _missing_prev_lts(wallet_address, events):
+    """prev_lt событий, которых нет ни в пачке, ни в БД (разрыв цепочки)."""
+    batch_lts = {_event_lt(event) for event in events}
+    wanted = {_event_prev_lt(event) for event in events} - batch_lts - {None, 0}
+    if not wanted:
+        return set()
+    stored = TransactionHistory.objects.filter(wallet_address=wallet_address)
+    if not stored.exists():
+        # История кошелька ещё не загружалась — сверять не с чем
+        return set()
+    return wanted - set(stored.filter(lt__in=wanted).values_list('lt', flat=True))
+
+
+def ingest(delivery_id, events):
+    """Обрабатывает пачку; повторная доставка возвращает сохранённый результат."""
+    from .history_stream import SYNCED_CACHE_KEY
+    from .jobs import enqueue
+    from .tonservice import save_transactions_to_db
+
+    delivery, created = WebhookDelivery.objects.get_or_create(
+        delivery_id=delivery_id, defaults={'events': len(events)},
+    )
+    if not created:
+        WEBHOOK_DELIVERIES.labels(result='duplicate').inc()
+        return dict(delivery.result, duplicate=True, status=delivery.status)
+
+    try:
+        by_wallet = defaultdict(list)
+        for event in events:
+            by_wallet[_normalize(event.get('account') or event.get('account_id'))].append(event)
+        tracked = set(WalletSession.objects.filter(
+            wallet_address__in=list(by_wallet), connected=True,
+        ).values_list('wallet_address', flat=True))
+
+        result = {'events': len(events), 'saved': 0, 'ignored': 0, 'resync': []}
+        for wallet_address, wallet_events in by_wallet.items():
+            if wallet_address not in tracked:
+                result['ignored'] += len(wallet_events)
+                continue
+            # Внутри пачки — по порядку цепочки, события без lt в конце
+            wallet_events.sort(key=lambda event: (_event_lt(event) is None, _event_lt(event) or 0))
+            gaps = _missing_prev_lts(wallet_address, wallet_events)
+
+            transactions = [event['transaction'] for event in wallet_events if event.get('transaction')]
+            if transactions:
+                result['saved'] += save_transactions_to_db(wallet_address, transactions)
+            # История в кэше устарела при любом уведомлении
+            tiered_cache.delete(f"ton:tx:{wallet_address}")
+            tiered_cache.delete(SYNCED_CACHE_KEY.format(wallet=wallet_address))
+            tiered_cache.set(RECONCILE_CACHE_KEY.format(wallet=wallet_address), '1', _reconcile_interval())
+
+            if gaps or len(transactions) < len(wallet_events):
+                result['resync'].append(wallet_address)
+        if result['resync']:
+            enqueue(SyncJob.KIND_RESYNC, result['resync'])
+    except Exception:
+        # Провайдер повторит доставку — она должна обработаться заново
+        delivery.delete()
+        WEBHOOK_DELIVERIES.labels(result='failed').inc()
+        raise
+
+    WebhookDelivery.objects.filter(pk=delivery.pk).update(status=WebhookDelivery.STATUS_DONE, result=result)
+    WEBHOOK_DELIVERIES.labels(result='accepted').inc()
+    logger.info(
+        "Уведомления %s: событий %d, сохранено %d, не отслеживается %d, на сверку %d",
+        delivery_id, result['events'], result['saved'], result['ignored'], len(result['resync']),
+    )
+    return dict(result, duplicate=False, status=WebhookDelivery.STATUS_DONE)